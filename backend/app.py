@@ -3,6 +3,12 @@ from flask_cors import CORS
 import os
 from dotenv import load_dotenv
 from models.db_setup import init_db
+from models.leaderboard_writer import get_leaderboard_writer
+from services.ranking_service import ranking_service
+from services.spend_cube import spend_cube, SPEND_CUBE_ENABLED
+from services.revalidation import revalidation_worker, REVALIDATION_ENABLED
+from services.vendor_resolver import vendor_resolver
+from services.duplicate_detector import duplicate_detector
 
 # Load environment variables from .env file
 load_dotenv()
@@ -11,6 +17,8 @@ load_dotenv()
 from routes.invoice_routes import invoice_bp
 from routes.query_routes import query_bp
 from routes.leaderboard_routes import leaderboard_bp
+from routes.vendor_routes import vendor_bp
+from routes.po_routes import po_bp
 
 
 def create_app():
@@ -38,10 +46,32 @@ def create_app():
     # Initialize database
     init_db()
 
+    # Start the buffered leaderboard writer if enabled (flushes on shutdown)
+    get_leaderboard_writer()
+
+    # Load vendor aliases and give POs without one a canonical vendor id
+    vendor_resolver.sync()
+
+    # Index stored invoices uploaded before duplicate detection existed
+    duplicate_detector.backfill()
+
+    # Build in-memory ranking indexes from the leaderboard table
+    ranking_service.rebuild()
+
+    # Load the in-memory spend cube in the background (SQL answers until ready)
+    if SPEND_CUBE_ENABLED:
+        spend_cube.rebuild_async()
+
+    # Re-validate stored invoices in the background when POs change
+    if REVALIDATION_ENABLED:
+        revalidation_worker.start()
+
     # Register blueprints
     app.register_blueprint(invoice_bp, url_prefix='/api/invoices')
     app.register_blueprint(query_bp, url_prefix='/api/queries')
     app.register_blueprint(leaderboard_bp, url_prefix='/api/leaderboard')
+    app.register_blueprint(vendor_bp, url_prefix='/api/vendors')
+    app.register_blueprint(po_bp, url_prefix='/api/purchase-orders')
 
     # Create upload directory if it doesn't exist
     if not os.path.exists(app.config['UPLOAD_FOLDER']):
@@ -0,0 +1,111 @@
+import sys
+sys.path.append('.')
+
+# Near-duplicate lookup latency and accuracy on a synthetic invoice history.
+# Invoices come from per-vendor templates; rescans are copies with 1%
+# OCR-style character noise under a new invoice number, fresh invoices reuse
+# a vendor's template with different lines. Recall is the share of rescans
+# flagged against their original, false positives the share of fresh
+# invoices flagged at all.
+# Usage: python benchmark_duplicate_detection.py [invoices] [lookups]
+import os
+import random
+import tempfile
+import time
+import numpy as np
+import models.db_setup as db_setup
+from models.db_setup import init_db, get_db_connection
+from services.duplicate_detector import DuplicateDetector, minhash, DUPLICATE_SIMILARITY_THRESHOLD
+
+INVOICES = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+LOOKUPS = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+VENDORS = 200
+
+ITEMS = ['Wireless Mouse', 'Steel Beam 10mm', 'Office Chair', 'Paper Ream A4', 'Network Switch 24p',
+         'Surgical Mask', 'Desk Lamp', 'Printer Toner', 'Hex Bolt M8', 'Ball Valve 25mm', 'Safety Gloves',
+         'Extension Cord 5m', 'Label Tape', 'Drill Bit Set', 'Pressure Sensor', 'Laptop Sleeve']
+
+HEADERS = ['INVOICE', 'TAX INVOICE', 'Commercial Invoice', 'Bill', 'Statement of Charges']
+TERMS = ['Payment terms: net 30. Thank you for your business.', 'Due on receipt. Late fees apply after 15 days.',
+         'Please remit to the account below within 45 days.', 'Net 60. Quote the invoice number on payment.']
+
+def vendor_template(rng, vendor):
+    """Per-vendor layout: header, address and payment terms shared by all its invoices"""
+    return {
+        'vendor': vendor,
+        'header': rng.choice(HEADERS),
+        'address': f'{rng.randint(1, 999)} {rng.choice(["Commerce", "Market", "Harbor", "Mill"])} Street, '
+                   f'{rng.choice(["Springfield", "Riverton", "Lakeside", "Fairview"])}',
+        'terms': rng.choice(TERMS)
+    }
+
+def invoice_text(rng, template, number):
+    """Extracted text of one of a vendor's invoices with 1-4 random lines"""
+    lines = []
+    total = 0.0
+    for _ in range(rng.randint(1, 4)):
+        qty = rng.randint(1, 50)
+        price = round(rng.uniform(1, 500), 2)
+        total += qty * price
+        lines.append(f'{rng.choice(ITEMS)} {qty} {price:.2f} {qty * price:.2f}')
+    date = f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+    text = '\n'.join([
+        template['header'], f'Invoice Number: {number}', f'Date: {date}', 'From:', template['vendor'],
+        template['address'], 'Bill To: Example Corp, Accounts Payable',
+        'Description Qty Unit Price Amount', *lines, f'Total: {total:.2f}', template['terms']
+    ])
+    return text, round(total, 2)
+
+def ocr_noise(text, rng, rate=0.01):
+    """Substitute or drop about rate of the characters"""
+    chars = []
+    for char in text:
+        roll = rng.random()
+        if roll < rate / 2:
+            continue
+        chars.append(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789') if roll < rate else char)
+    return ''.join(chars)
+
+rng = random.Random(7)
+vendors = [vendor_template(rng, f'{rng.choice(["Acme", "Globex", "Initech", "Umbrella"])} Supply {i} Ltd')
+           for i in range(VENDORS)]
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_setup.DATABASE_PATH = os.path.join(tmp, 'benchmark.db')
+    init_db()
+    detector = DuplicateDetector()
+
+    started = time.perf_counter()
+    texts = []
+    conn = get_db_connection()
+    for n in range(INVOICES):
+        text, total = invoice_text(rng, vendors[n % VENDORS], f'INV-{n:07d}')
+        texts.append((text, total))
+        detector._store(conn, f'INV-{n:07d}', minhash(text), total)
+    conn.commit()
+    conn.close()
+    print(f'Indexed {INVOICES} invoices in {time.perf_counter() - started:.1f}s')
+
+    latencies = []
+    found = 0
+    for _ in range(LOOKUPS):
+        n = rng.randrange(INVOICES)
+        text, total = texts[n]
+        rescan = ocr_noise(text.replace(f'INV-{n:07d}', 'INV-20240101120000'), rng)
+        started = time.perf_counter()
+        duplicates = detector.find({'raw_text': rescan, 'total': total, 'invoice_number': 'INV-20240101120000'})
+        latencies.append((time.perf_counter() - started) * 1000)
+        found += any(duplicate['invoice_id'] == f'INV-{n:07d}' for duplicate in duplicates)
+
+    flagged = 0
+    for i in range(LOOKUPS):
+        text, total = invoice_text(rng, vendors[rng.randrange(VENDORS)], f'NEW-{i}')
+        started = time.perf_counter()
+        flagged += bool(detector.find({'raw_text': text, 'total': total, 'invoice_number': f'NEW-{i}'}))
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    print(f'Similarity threshold {DUPLICATE_SIMILARITY_THRESHOLD}')
+    print(f'Rescan recall:        {found / LOOKUPS:.3f}')
+    print(f'Fresh false positives: {flagged / LOOKUPS:.3f}')
+    print(f'Lookup latency: median {np.median(latencies):.3f}ms, p99 {np.percentile(latencies, 99):.3f}ms')
+    print(detector.get_stats())
@@ -0,0 +1,66 @@
+import sys
+sys.path.append('.')
+
+# Line assignment scaling: time to build the cost matrix and solve the
+# one-to-one assignment as invoices grow to hundreds of lines, and how many
+# lines land on the right PO line compared with first-match-above-threshold.
+# Usage: python benchmark_line_matcher.py [line counts...]
+import random
+import time
+from rapidfuzz import fuzz
+from services.line_matcher import match_lines, build_cost_matrix, solve_assignment, LINE_MATCH_TIME_BUDGET_MS
+
+LINE_COUNTS = [int(arg) for arg in sys.argv[1:]] or [5, 20, 50, 100, 200, 400]
+ITEM_THRESHOLD = 75
+REPEATS = 5
+
+PRODUCTS = ['Cable Type-C', 'Monitor 24inch', 'Office Chair', 'Printer Paper', 'Network Switch',
+            'Steel Beam', 'Surgical Mask', 'Wireless Mouse', 'Laptop Sleeve', 'Desk Lamp']
+
+def make_lines(count, rng):
+    """PO lines with near-identical names (sizes/variants) and an invoice billing them shuffled"""
+    po_lines = []
+    for i in range(count):
+        qty = rng.randint(1, 200)
+        price = round(rng.uniform(2, 900), 2)
+        po_lines.append({'item': f'{PRODUCTS[i % len(PRODUCTS)]} {i // len(PRODUCTS) + 1}m',
+                         'qty': qty, 'unit_price': price})
+    order = list(range(count))
+    rng.shuffle(order)
+    invoice_lines = [dict(po_lines[j]) for j in order]
+    return invoice_lines, po_lines, order
+
+def first_match(invoice_lines, po_lines):
+    """The previous behavior: each PO line takes the first invoice line above the threshold"""
+    assignment = {}
+    for po_index, po_line in enumerate(po_lines):
+        for line_index, line in enumerate(invoice_lines):
+            if fuzz.ratio(line['item'].lower(), po_line['item'].lower()) >= ITEM_THRESHOLD:
+                assignment[line_index] = po_index
+                break
+    return assignment
+
+rng = random.Random(7)
+print(f"Line assignment scaling (best of {REPEATS}, budget {LINE_MATCH_TIME_BUDGET_MS:.0f}ms)")
+print("=" * 86)
+print(f"{'lines':>6} {'cost ms':>9} {'solve ms':>9} {'total ms':>9} {'method':>8} "
+      f"{'optimal correct':>16} {'first-match correct':>20}")
+for count in LINE_COUNTS:
+    invoice_lines, po_lines, order = make_lines(count, rng)
+
+    best_cost = best_solve = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        cost, _ = build_cost_matrix(invoice_lines, po_lines, ITEM_THRESHOLD)
+        middle = time.perf_counter()
+        solve_assignment(cost)
+        end = time.perf_counter()
+        best_cost = min(best_cost, middle - start)
+        best_solve = min(best_solve, end - middle)
+
+    result = match_lines(invoice_lines, po_lines, ITEM_THRESHOLD)
+    correct = sum(1 for line_index, po_index, _, _ in result['pairs'] if order[line_index] == po_index)
+    greedy = first_match(invoice_lines, po_lines)
+    greedy_correct = sum(1 for line_index, po_index in greedy.items() if order[line_index] == po_index)
+    print(f"{count:>6} {best_cost * 1000:>9.2f} {best_solve * 1000:>9.2f} {result['elapsed_ms']:>9.2f} "
+          f"{result['method']:>8} {correct:>10}/{count:<5} {greedy_correct:>14}/{count:<5}")
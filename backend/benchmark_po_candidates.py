@@ -0,0 +1,133 @@
+import sys
+sys.path.append('.')
+
+# Recall and latency of trigram candidate retrieval against exhaustive
+# scoring on a synthetic purchase_orders table. Invoice lines are copies of
+# random POs with typos, dropped words and vendor misspellings; recall@k is
+# the share of the exhaustive top-k scores the candidate set also reaches.
+# Usage: python benchmark_po_candidates.py [purchase_orders] [invoice_lines]
+import os
+import random
+import sqlite3
+import tempfile
+import time
+import numpy as np
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+import models.db_setup as db_setup
+from models.db_setup import init_db
+from services.po_candidates import POCandidateIndex, PO_CANDIDATE_LIMIT
+from services.po_validator import POValidator
+
+PURCHASE_ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+INVOICE_LINES = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+VENDORS = 40   # Large vendors (~25k POs each at 1M) so vendor blocking alone is not enough
+
+ADJECTIVES = ['wireless', 'steel', 'office', 'industrial', 'usb', 'ergonomic', 'heavy duty', 'compact',
+              'premium', 'basic', 'portable', 'stainless', 'adjustable', 'waterproof', 'digital']
+NOUNS = ['cable', 'monitor', 'chair', 'paper ream', 'network switch', 'beam', 'surgical mask', 'mouse',
+         'laptop sleeve', 'desk lamp', 'router', 'printer toner', 'hex bolt', 'ball valve', 'pump',
+         'pressure sensor', 'drill bit', 'safety gloves', 'extension cord', 'label tape']
+UNITS = ['', ' 1m', ' 2m', ' 5m', ' 10mm', ' 25mm', ' xl', ' pack of 10', ' pack of 50', ' v2', ' pro']
+
+def build_database(path, rng):
+    """Insert synthetic POs through the triggers that maintain purchase_orders_fts"""
+    db_setup.DATABASE_PATH = path
+    init_db()
+    conn = sqlite3.connect(path)
+    conn.execute('DELETE FROM purchase_orders')
+    vendors = [f'{rng.choice(["Acme", "Globex", "Initech", "Umbrella", "Stark", "Wayne"])} '
+               f'{rng.choice(["Supply", "Industrial", "Trading", "Parts", "Office"])} {i} Ltd' for i in range(VENDORS)]
+
+    def rows():
+        for n in range(PURCHASE_ORDERS):
+            item = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)}{rng.choice(UNITS)} {rng.randint(1, 400)}'
+            qty = rng.randint(1, 100)
+            price = round(rng.uniform(1, 500), 2)
+            yield (f'PO-{n}', vendors[n % VENDORS], item.title(), qty, price, qty * price, '2024-01-01')
+
+    conn.executemany('''
+        INSERT INTO purchase_orders (po_id, vendor, item, qty, unit_price, total, date)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows())
+    conn.commit()
+    vendor_names, items = zip(*conn.execute('SELECT vendor, item FROM purchase_orders ORDER BY rowid'))
+    conn.close()
+    return list(vendor_names), list(items)
+
+def perturb(text, rng):
+    """Drop, swap or duplicate a character, or drop a word"""
+    roll = rng.random()
+    if roll < 0.3 and len(text) > 4:
+        i = rng.randrange(len(text))
+        return text[:i] + text[i + 1:]
+    if roll < 0.5 and len(text) > 4:
+        i = rng.randrange(len(text) - 1)
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    if roll < 0.6:
+        words = text.split()
+        if len(words) > 2:
+            words.pop(rng.randrange(len(words)))
+            return ' '.join(words)
+    return text
+
+def scores(validator, invoice_vendor, invoice_item, vendor_names, items):
+    """The validator's match score for one invoice line against PO rows"""
+    vendor_similarity = cdist([invoice_vendor.lower()], [vendor.lower() for vendor in vendor_names],
+                              scorer=fuzz.ratio, dtype=np.float64, workers=-1)[0]
+    item_similarity = cdist([invoice_item.lower()], [item.lower() for item in items],
+                            scorer=fuzz.ratio, dtype=np.float64, workers=-1)[0]
+    return (np.where(vendor_similarity >= validator.vendor_similarity_threshold, vendor_similarity * 0.6, 0)
+            + np.where(item_similarity >= validator.item_similarity_threshold, item_similarity * 0.4, 0))
+
+rng = random.Random(11)
+with tempfile.TemporaryDirectory() as tmp:
+    start = time.perf_counter()
+    vendor_names, items = build_database(os.path.join(tmp, 'benchmark.db'), rng)
+    print(f"Built {PURCHASE_ORDERS} purchase orders (with trigram index) in {time.perf_counter() - start:.1f}s")
+
+    # What the validator did before retrieval: load every PO for every invoice
+    start = time.perf_counter()
+    with sqlite3.connect(db_setup.DATABASE_PATH) as conn:
+        conn.execute('SELECT * FROM purchase_orders ORDER BY date DESC').fetchall()
+    full_fetch = time.perf_counter() - start
+
+    validator = POValidator()
+    index = POCandidateIndex()
+    index.candidate_pos({'vendor': 'warm up'}, validator.vendor_similarity_threshold)
+
+    recall = {1: [], 10: []}
+    candidate_counts = []
+    retrieval_times = []
+    exhaustive_times = []
+    for _ in range(INVOICE_LINES):
+        po = rng.randrange(PURCHASE_ORDERS)
+        invoice_vendor = perturb(vendor_names[po], rng) if rng.random() < 0.3 else vendor_names[po]
+        invoice_item = perturb(items[po], rng)
+        invoice = {'vendor': invoice_vendor, 'line_items': [{'item': invoice_item}]}
+
+        start = time.perf_counter()
+        candidates = index.candidate_pos(invoice, validator.vendor_similarity_threshold)
+        retrieval_times.append(time.perf_counter() - start)
+        candidate_counts.append(len(candidates))
+
+        start = time.perf_counter()
+        exhaustive = np.sort(scores(validator, invoice_vendor, invoice_item, vendor_names, items))[::-1]
+        exhaustive_times.append(time.perf_counter() - start)
+
+        candidate_scores = scores(validator, invoice_vendor, invoice_item,
+                                  [row['vendor'] for row in candidates], [row['item'] for row in candidates])
+        for k in recall:
+            if exhaustive[k - 1] < 50:
+                continue  # Fewer than k scorable POs exist
+            recall[k].append(min(k, int(np.sum(candidate_scores >= exhaustive[k - 1]))) / k)
+
+    print("=" * 70)
+    print(f"Invoice lines:           {INVOICE_LINES} (candidate limit {PO_CANDIDATE_LIMIT} per line)")
+    print(f"Candidates per line:     {np.mean(candidate_counts):.0f} avg, {max(candidate_counts)} max")
+    print(f"Retrieval latency:       {np.median(retrieval_times) * 1000:.1f}ms median, "
+          f"{np.percentile(retrieval_times, 95) * 1000:.1f}ms p95")
+    print(f"Exhaustive scoring:      {np.median(exhaustive_times) * 1000:.1f}ms median (arrays already in memory)")
+    print(f"Full PO fetch:           {full_fetch * 1000:.1f}ms (before scoring)")
+    for k, values in recall.items():
+        print(f"Recall@{k:<3}              {np.mean(values):.3f} over {len(values)} lines")
@@ -0,0 +1,77 @@
+import sys
+sys.path.append('.')
+
+# Time a full reconciliation run over a synthetic invoice book, then
+# interrupt and resume a second run to check it finishes with the same counts.
+# Usage: python benchmark_reconciliation.py [invoices] [purchase_orders]
+import os
+import sqlite3
+import tempfile
+import time
+import models.db_setup as db_setup
+from models.db_setup import init_db
+from services.reconciliation import ReconciliationEngine
+
+INVOICES = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+PURCHASE_ORDERS = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+VENDORS = 400
+ITEMS = 3000
+
+def build_database(path):
+    """Purchase orders plus invoices: mostly exact, some misspelled, some off on qty/price, some unknown"""
+    db_setup.DATABASE_PATH = path
+    init_db()
+    conn = sqlite3.connect(path)
+    conn.execute('DELETE FROM purchase_orders')
+    conn.execute(f'''
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {PURCHASE_ORDERS})
+        INSERT INTO purchase_orders (po_id, vendor, item, qty, unit_price, total, date)
+        SELECT 'PO-' || n, 'Vendor Company ' || (n % {VENDORS}), 'Catalog Item ' || (n % {ITEMS}),
+               1 + n % 40, 5 + n % 300, (1 + n % 40) * (5 + n % 300),
+               date('2023-01-01', '+' || (n % 600) || ' days')
+        FROM seq
+    ''')
+    # Invoice n bills PO (n % PURCHASE_ORDERS) + 1; every 10th has a typo in the
+    # vendor, every 7th a different quantity, every 50th an unknown item
+    conn.execute(f'''
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {INVOICES})
+        INSERT INTO invoices (invoice_id, vendor, item, qty, unit_price, total, date, status)
+        SELECT 'INV-' || n,
+               CASE WHEN n % 10 = 0 THEN 'Vendor Compny ' ELSE 'Vendor Company ' END || (p % {VENDORS}),
+               CASE WHEN n % 50 = 0 THEN 'Unlisted Service ' || n ELSE 'Catalog Item ' || (p % {ITEMS}) END,
+               1 + p % 40 + (n % 7 = 0),
+               5 + p % 300,
+               (1 + p % 40 + (n % 7 = 0)) * (5 + p % 300),
+               date('2023-01-01', '+' || (p % 600 + 15) || ' days'),
+               'pending'
+        FROM (SELECT n, n % {PURCHASE_ORDERS} + 1 AS p FROM seq)
+    ''')
+    conn.commit()
+    conn.close()
+
+with tempfile.TemporaryDirectory() as tmp:
+    start = time.perf_counter()
+    build_database(os.path.join(tmp, 'benchmark.db'))
+    print(f"Built {INVOICES} invoices and {PURCHASE_ORDERS} purchase orders in {time.perf_counter() - start:.1f}s")
+
+    engine = ReconciliationEngine()
+    start = time.perf_counter()
+    full = engine.run(scope='all')
+    elapsed = time.perf_counter() - start
+    print(f"Full run: {elapsed:.1f}s ({INVOICES / elapsed:.0f} invoices/s) - "
+          f"{full['matched']} matched, {full['discrepancies']} discrepancies, {full['unmatched']} unmatched")
+
+    # Stop a second run after its first chunk, then resume it
+    def stop_after_first_chunk(processed, total):
+        raise KeyboardInterrupt
+
+    try:
+        engine.run(scope='all', chunk_size=INVOICES // 4 or 1, progress=stop_after_first_chunk)
+    except KeyboardInterrupt:
+        pass
+    interrupted = engine.get_run(engine.find_resumable_run())
+    print(f"Interrupted run {interrupted['run_id']} at {interrupted['processed_invoices']}/{INVOICES}")
+
+    resumed = engine.run(resume=True)
+    same = all(resumed[key] == full[key] for key in ('processed_invoices', 'matched', 'discrepancies', 'unmatched'))
+    print(f"Resumed run {resumed['run_id']} {resumed['status']}: counts match full run: {same}")
@@ -0,0 +1,77 @@
+import sys
+sys.path.append('.')
+
+# Compare the default list-of-objects query response with the opt-in columnar
+# shape: payload size and serialization time for a synthetic wide result.
+# Usage: python benchmark_result_encoding.py [rows] [columns]
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import models.db_setup as db_setup
+from models.db_setup import execute_governed_query, result_payload
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+COLUMNS = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+REPEATS = 5
+
+def build_database(path):
+    """Create a table shaped like a wide purchase order extract"""
+    column_defs = ', '.join(f'{name} {kind}' for name, kind in column_spec())
+    conn = sqlite3.connect(path)
+    conn.execute(f'CREATE TABLE wide_results ({column_defs})')
+    conn.executemany(
+        f"INSERT INTO wide_results VALUES ({', '.join('?' * COLUMNS)})",
+        (tuple(sample_value(kind, i, j) for j, (_, kind) in enumerate(column_spec())) for i in range(ROWS))
+    )
+    conn.commit()
+    conn.close()
+
+def column_spec():
+    kinds = ['TEXT', 'INTEGER', 'REAL']
+    names = ['vendor_name', 'quantity_ordered', 'unit_price_amount']
+    return [(f'{names[j % 3]}_{j}', kinds[j % 3]) for j in range(COLUMNS)]
+
+def sample_value(kind, i, j):
+    if kind == 'TEXT':
+        return f'Vendor {i % 250} Ltd'
+    if kind == 'INTEGER':
+        return i * (j + 1) % 1000
+    return round((i % 997) * 1.37, 2)
+
+def measure(columnar):
+    """Best-of-N time to run, shape and serialize the response, and its size"""
+    best_query = best_dump = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        execution = execute_governed_query('SELECT * FROM wide_results', max_rows=ROWS, columnar=columnar)
+        payload = {'success': True, **result_payload(execution)}
+        middle = time.perf_counter()
+        body = json.dumps(payload)
+        end = time.perf_counter()
+        best_query = min(best_query, middle - start)
+        best_dump = min(best_dump, end - middle)
+    return len(body.encode('utf-8')), best_query, best_dump, execution['row_count']
+
+with tempfile.TemporaryDirectory() as tmp:
+    db_setup.DATABASE_PATH = os.path.join(tmp, 'benchmark.db')
+    db_setup.QUERY_MAX_ROWS = ROWS
+    build_database(db_setup.DATABASE_PATH)
+
+    print(f"Result encoding benchmark: {ROWS} rows x {COLUMNS} columns (best of {REPEATS})")
+    print("=" * 70)
+    print(f"{'shape':<10} {'rows':>8} {'bytes':>12} {'fetch+shape ms':>16} {'json.dumps ms':>15}")
+
+    measurements = {}
+    for label, columnar in (('objects', False), ('columnar', True)):
+        size, query_time, dump_time, row_count = measure(columnar)
+        measurements[label] = (size, query_time, dump_time)
+        print(f"{label:<10} {row_count:>8} {size:>12} {query_time * 1000:>16.1f} {dump_time * 1000:>15.1f}")
+
+    objects, columnar = measurements['objects'], measurements['columnar']
+    print("-" * 70)
+    print(f"Payload size: {columnar[0] / objects[0]:.2f}x of objects "
+          f"({objects[0] / columnar[0]:.1f}x smaller)")
+    print(f"Fetch+shape:  {objects[1] / columnar[1]:.1f}x faster, "
+          f"serialization: {objects[2] / columnar[2]:.1f}x faster")
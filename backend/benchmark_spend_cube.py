@@ -0,0 +1,97 @@
+import sys
+sys.path.append('.')
+
+# Compare answering the intent router's purchase order aggregates from the
+# in-memory spend cube against running their SQL on SQLite, and check both
+# return the same rows.
+# Usage: python benchmark_spend_cube.py [rows]
+import os
+import sqlite3
+import tempfile
+import time
+import models.db_setup as db_setup
+from models.db_setup import init_db, execute_governed_query
+from services.intent_router import intent_router
+from services.spend_cube import SpendCube
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 10000000
+VENDORS = 500
+ITEMS = 2000
+REPEATS = 3
+
+QUESTIONS = [
+    'total spend per vendor',
+    'top 10 vendors by spend in 2024',
+    'how many orders does each vendor have',
+    'most purchased items',
+    'what is the average order value',
+    'total value of purchase orders'
+]
+
+def build_database(path):
+    """Fill purchase_orders with synthetic rows spread over vendors, items and two years"""
+    db_setup.DATABASE_PATH = path
+    init_db()
+    conn = sqlite3.connect(path)
+    conn.execute('DELETE FROM purchase_orders')
+    conn.execute(f'''
+        WITH RECURSIVE seq(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM seq WHERE n < {ROWS})
+        INSERT INTO purchase_orders (po_id, vendor, item, qty, unit_price, total, date)
+        SELECT 'PO-' || n,
+               'Vendor ' || (n * 7919 % {VENDORS}),
+               'Item ' || (n * 104729 % {ITEMS}),
+               1 + n % 50,
+               (n % 997) * 1.25,
+               (1 + n % 50) * (n % 997) * 1.25,
+               date('2023-01-01', '+' || (n % 730) || ' days')
+        FROM seq
+    ''')
+    conn.commit()
+    conn.close()
+
+def best_of(function):
+    """Best-of-N wall time in ms and the last result"""
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, result
+
+def same_rows(left, right):
+    """Row sets equal up to float rounding (ties may order differently)"""
+    def normalized(rows):
+        return sorted(tuple(round(value, 4) if isinstance(value, float) else value
+                            for value in row.values()) for row in rows)
+    return normalized(left) == normalized(right)
+
+with tempfile.TemporaryDirectory() as tmp:
+    start = time.perf_counter()
+    build_database(os.path.join(tmp, 'benchmark.db'))
+    print(f"Built {ROWS} purchase orders in {time.perf_counter() - start:.1f}s")
+
+    db_setup.QUERY_MAX_ROWS = ROWS
+    db_setup.QUERY_TIME_BUDGET_MS = 600000
+
+    cube = SpendCube()
+    start = time.perf_counter()
+    cube.rebuild()
+    stats = cube.get_stats()
+    print(f"Cube build: {time.perf_counter() - start:.1f}s, {stats['bytes'] / 1048576:.1f}MB "
+          f"({stats['vendors']} vendors, {stats['items']} items)")
+
+    print("=" * 78)
+    print(f"{'question':<40} {'sql ms':>10} {'cube ms':>10} {'speedup':>8} {'same':>6}")
+    for question in QUESTIONS:
+        routed = intent_router.route(question)
+        if routed is None:
+            print(f"{question:<40} (not routed)")
+            continue
+        sql_query = routed['sql_query']
+        sql_ms, sql_result = best_of(lambda: execute_governed_query(sql_query))
+        cube_ms, cube_result = best_of(lambda: cube.answer(routed['intent'], routed['parameters'], sql_query))
+        if cube_result is None:
+            print(f"{question:<40} {sql_ms:>10.1f} {'declined':>10}")
+            continue
+        same = same_rows(sql_result['results'], cube_result['results'])
+        print(f"{question:<40} {sql_ms:>10.1f} {cube_ms:>10.2f} {sql_ms / cube_ms:>7.0f}x {str(same):>6}")
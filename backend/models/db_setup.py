@@ -1,20 +1,201 @@
 import sqlite3
 import os
+import re
+import threading
+import time
 from datetime import datetime
+from models.read_pool import get_read_pool
 
 DATABASE_PATH = 'invoice_po_matching.db'
 
+# Write counters used to invalidate cached reads.
+# Every committed write through this module bumps the global version and the
+# version of each table it touched; writes to unknown tables bump '*'.
+# The counters live in the data_versions table so that every process on the
+# database (server workers, the bulk PO loader CLI) sees the others' writes;
+# below is this process's copy, re-read whenever PRAGMA data_version on a
+# dedicated connection reports a commit by any other connection.
+_data_version = 0
+_table_versions = {}
+# Per-table count of writes that changed or removed existing rows (anything
+# but a plain INSERT), for in-memory copies that can only sync appends
+_table_rewrites = {}
+_data_version_lock = threading.Lock()
+# Bumps only this process can see (e.g. leaderboard increments still buffered
+# in memory), counted on top of the shared versions
+_local_versions = {}
+_local_rewrites = {}
+_version_watch = {'path': None, 'conn': None, 'data_version': None}
+ALL_WRITES = ''   # data_versions row holding the global version
+# Pseudo-table bumped by bulk PO loads, so servers can re-validate after one
+PO_LOADS = 'purchase_order_loads'
+
+# Limits for governed (user/GPT-generated) queries
+QUERY_MAX_ROWS = int(os.environ.get('QUERY_MAX_ROWS', 10000))
+QUERY_TIME_BUDGET_MS = int(os.environ.get('QUERY_TIME_BUDGET_MS', 5000))
+QUERY_MAX_VM_STEPS = int(os.environ.get('QUERY_MAX_VM_STEPS', 0)) or None
+QUERY_FETCH_BATCH_SIZE = 500
+QUERY_EXPORT_TIME_BUDGET_MS = int(os.environ.get('QUERY_EXPORT_TIME_BUDGET_MS', 300000))
+EXPORT_FETCH_BATCH_SIZE = 2000
+PROGRESS_HANDLER_INTERVAL = 1000  # SQLite VM instructions between budget checks
+
+# sqlite3 authorizer action codes for row writes
+WRITE_ACTIONS = (sqlite3.SQLITE_INSERT, sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+REWRITE_ACTIONS = (sqlite3.SQLITE_UPDATE, sqlite3.SQLITE_DELETE)
+# Inserts that may replace existing rows
+_UPSERT_PATTERN = re.compile(r'\bOR\s+REPLACE\b|^\s*REPLACE\b|\bON\s+CONFLICT\b', re.IGNORECASE)
+
+# Secondary indexes on purchase_orders, dropped and rebuilt around bulk loads
+PO_INDEXES = [
+    # Canonical vendor lookups and merges
+    ('idx_purchase_orders_vendor_id', 'purchase_orders (vendor_id)'),
+    # Covers vendor-blocked item scans without touching the table
+    ('idx_purchase_orders_vendor_item', 'purchase_orders (vendor, item)'),
+    # Date-window range scans when validating, over all POs or a vendor block
+    ('idx_purchase_orders_date', 'purchase_orders (date)'),
+    ('idx_purchase_orders_vendor_date', 'purchase_orders (vendor, date)')
+]
+# Triggers that keep purchase_orders_fts in step with purchase_orders
+PO_FTS_TRIGGERS = [
+    ('purchase_orders_fts_insert', '''AFTER INSERT ON purchase_orders BEGIN
+            INSERT INTO purchase_orders_fts (rowid, vendor, item) VALUES (new.rowid, new.vendor, new.item);
+        END'''),
+    ('purchase_orders_fts_delete', '''AFTER DELETE ON purchase_orders BEGIN
+            INSERT INTO purchase_orders_fts (purchase_orders_fts, rowid, vendor, item)
+            VALUES ('delete', old.rowid, old.vendor, old.item);
+        END'''),
+    ('purchase_orders_fts_update', '''AFTER UPDATE OF vendor, item ON purchase_orders BEGIN
+            INSERT INTO purchase_orders_fts (purchase_orders_fts, rowid, vendor, item)
+            VALUES ('delete', old.rowid, old.vendor, old.item);
+            INSERT INTO purchase_orders_fts (rowid, vendor, item) VALUES (new.rowid, new.vendor, new.item);
+        END''')
+]
+
+def _create_data_versions(cursor):
+    """Create the table persisting per-table write versions"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0,
+            rewrites INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''')
+
+def _sync_versions():
+    """Re-read data_versions if any connection, in any process, committed since the last look"""
+    global _data_version, _table_versions, _table_rewrites
+    with _data_version_lock:
+        watch = _version_watch
+        if watch['path'] != DATABASE_PATH:
+            if watch['conn'] is not None:
+                watch['conn'].close()
+            watch.update(path=DATABASE_PATH, conn=sqlite3.connect(DATABASE_PATH, check_same_thread=False),
+                         data_version=None)
+        conn = watch['conn']
+        current = conn.execute('PRAGMA data_version').fetchone()[0]
+        if current == watch['data_version']:
+            return
+        try:
+            rows = conn.execute('SELECT table_name, version, rewrites FROM data_versions').fetchall()
+        except sqlite3.OperationalError:
+            rows = []   # Not initialized yet
+        watch['data_version'] = current
+        # Swapped in whole, so concurrent readers see the old or the new copy
+        versions = {table: version for table, version, _ in rows}
+        _data_version = versions.pop(ALL_WRITES, 0)
+        _table_versions = versions
+        _table_rewrites = {table: rewrites for table, _, rewrites in rows if table != ALL_WRITES}
+
+def get_data_version():
+    """Get the current data version (incremented on every committed write)"""
+    _sync_versions()
+    return _data_version + _local_versions.get(ALL_WRITES, 0)
+
+def get_table_versions(tables):
+    """Get the write versions of the given tables (plus the catch-all version)"""
+    _sync_versions()
+    versions = _table_versions
+    return tuple(versions.get(table, 0) + _local_versions.get(table, 0) for table in [*sorted(tables), '*'])
+
+def get_table_rewrites(table):
+    """Get how many non-append writes (updates, deletes, upserts) a table has seen"""
+    _sync_versions()
+    rewrites = _table_rewrites
+    return sum(rewrites.get(name, 0) + _local_rewrites.get(name, 0) for name in (table, '*'))
+
+def bump_data_version(tables=None, rewritten_tables=None, local=False):
+    """
+    Mark tables (or everything) as changed so cached reads are invalidated,
+    in this and every other process using the database (only this one with
+    local=True, for changes not yet written to the database).
+    rewritten_tables lists those whose existing rows changed (not just appends);
+    with no tables at all, everything counts as rewritten.
+    """
+    bumps = {ALL_WRITES: [1, 0]}
+    for table in (tables or ['*']):
+        bumps[table] = [1, 0]
+    for table in (rewritten_tables or ([] if tables else ['*'])):
+        bumps.setdefault(table, [0, 0])[1] = 1
+    if local:
+        with _data_version_lock:
+            for table, (version, rewrites) in bumps.items():
+                _local_versions[table] = _local_versions.get(table, 0) + version
+                _local_rewrites[table] = _local_rewrites.get(table, 0) + rewrites
+        return get_data_version()
+    # Own short connection: the caller's write is committed, and waiting on
+    # another writer here must not hold up readers of the versions
+    conn = sqlite3.connect(DATABASE_PATH, timeout=30)
+    try:
+        conn.execute('PRAGMA synchronous=NORMAL')
+        _create_data_versions(conn.cursor())
+        conn.executemany('''
+            INSERT INTO data_versions (table_name, version, rewrites) VALUES (?, ?, ?)
+            ON CONFLICT (table_name) DO UPDATE SET
+                version = version + excluded.version, rewrites = rewrites + excluded.rewrites
+        ''', [(table, version, rewrites) for table, (version, rewrites) in bumps.items()])
+        conn.commit()
+    finally:
+        conn.close()
+    return get_data_version()
+
 def get_db_connection():
     """Get a database connection with row factory enabled"""
     conn = sqlite3.connect(DATABASE_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
+def read_connection():
+    """
+    Borrow a pooled read-only connection for analytics and GET reads, e.g.
+    `with read_connection() as conn:`. Kept apart from the write path.
+    """
+    return get_read_pool(DATABASE_PATH).connection()
+
+def create_po_indexes(cursor):
+    """Create purchase_orders' secondary indexes and full-text sync triggers (if missing)"""
+    for name, target in PO_INDEXES:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {target}')
+    for name, body in PO_FTS_TRIGGERS:
+        cursor.execute(f'CREATE TRIGGER IF NOT EXISTS {name} {body}')
+
+def drop_po_indexes(cursor):
+    """
+    Drop purchase_orders' secondary indexes and full-text sync triggers
+    for a bulk load; rebuild purchase_orders_fts before recreating them
+    """
+    for name, _ in PO_INDEXES:
+        cursor.execute(f'DROP INDEX IF EXISTS {name}')
+    for name, _ in PO_FTS_TRIGGERS:
+        cursor.execute(f'DROP TRIGGER IF EXISTS {name}')
+
 def init_db():
     """Initialize the database with required tables and seed data"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # WAL lets the read-only analytics pool read while uploads write
+    cursor.execute('PRAGMA journal_mode=WAL')
+    
     # Create purchase_orders table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS purchase_orders (
@@ -25,10 +206,56 @@ def init_db():
             unit_price REAL NOT NULL,
             total REAL NOT NULL,
             date TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            vendor_id INTEGER REFERENCES vendors (vendor_id)
+        )
+    ''')
+    po_columns = [row[1] for row in cursor.execute('PRAGMA table_info(purchase_orders)')]
+    if 'vendor_id' not in po_columns:
+        # Canonical vendor of databases created before vendors existed (backfilled by the resolver)
+        cursor.execute('ALTER TABLE purchase_orders ADD COLUMN vendor_id INTEGER REFERENCES vendors (vendor_id)')
+
+    # Trigram full-text shadow index over PO vendor and item for candidate
+    # retrieval, kept in sync with purchase_orders by triggers (created with
+    # the secondary indexes)
+    fts_exists = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'purchase_orders_fts'"
+    ).fetchone()
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS purchase_orders_fts USING fts5(
+            vendor, item,
+            content='purchase_orders', content_rowid='rowid', tokenize='trigram'
+        )
+    ''')
+    fts_triggers = cursor.execute(f"""
+        SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger'
+        AND name IN ({', '.join('?' * len(PO_FTS_TRIGGERS))})
+    """, [name for name, _ in PO_FTS_TRIGGERS]).fetchone()[0]
+    create_po_indexes(cursor)
+    if not fts_exists or fts_triggers < len(PO_FTS_TRIGGERS):
+        # Index rows that predate the shadow table (or an interrupted bulk load)
+        cursor.execute("INSERT INTO purchase_orders_fts (purchase_orders_fts) VALUES ('rebuild')")
+
+    # Create vendor tables: canonical vendors and the normalized spellings
+    # (PO names, learned invoice variants, manual edits) that resolve to them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vendors (
+            vendor_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         )
     ''')
-    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vendor_aliases (
+            alias TEXT PRIMARY KEY,
+            vendor_id INTEGER NOT NULL,
+            source TEXT NOT NULL DEFAULT 'po',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (vendor_id) REFERENCES vendors (vendor_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vendor_aliases_vendor ON vendor_aliases (vendor_id)')
+
     # Create invoices table
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS invoices (
@@ -46,6 +273,26 @@ def init_db():
             FOREIGN KEY (po_id) REFERENCES purchase_orders (po_id)
         )
     ''')
+
+    # MinHash signature of each invoice's extracted text, and its LSH band
+    # buckets (band, bucket hash) for near-duplicate lookups
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_signatures (
+            invoice_id TEXT PRIMARY KEY,
+            signature BLOB NOT NULL,
+            total REAL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS invoice_lsh_bands (
+            band INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            invoice_id TEXT NOT NULL,
+            PRIMARY KEY (band, bucket, invoice_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_invoice_lsh_bands_invoice ON invoice_lsh_bands (invoice_id)')
     
     # Create leaderboard table
     cursor.execute('''
@@ -72,6 +319,77 @@ def init_db():
         )
     ''')
     
+    # Create translation_cache table for reusing NL-to-SQL translations
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS translation_cache (
+            normalized_query TEXT PRIMARY KEY,
+            natural_language_query TEXT NOT NULL,
+            sql_query TEXT NOT NULL,
+            schema_hash TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_used TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # Create query_plans table for sampled EXPLAIN QUERY PLAN captures
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS query_plans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            query_shape TEXT NOT NULL,
+            sql_query TEXT NOT NULL,
+            plan TEXT NOT NULL,
+            full_scan INTEGER DEFAULT 0,
+            full_scan_tables TEXT,
+            execution_time_ms REAL,
+            source TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_query_plans_shape ON query_plans (query_shape)')
+
+    # Per-table write versions shared by every process (see bump_data_version)
+    _create_data_versions(cursor)
+
+    # Create reconciliation tables for batch invoice-to-PO reconciliation runs
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reconciliation_runs (
+            run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL DEFAULT 'running',
+            scope TEXT NOT NULL DEFAULT 'open',
+            price_tolerance_percentage REAL NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            total_invoices INTEGER DEFAULT 0,
+            processed_invoices INTEGER DEFAULT 0,
+            last_invoice_rowid INTEGER DEFAULT 0,
+            matched INTEGER DEFAULT 0,
+            discrepancies INTEGER DEFAULT 0,
+            unmatched INTEGER DEFAULT 0,
+            error TEXT,
+            started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reconciliation_results (
+            run_id INTEGER NOT NULL,
+            invoice_id TEXT NOT NULL,
+            po_id TEXT,
+            linked_po_id TEXT,
+            match_method TEXT,
+            vendor_similarity REAL,
+            item_similarity REAL,
+            qty_match INTEGER,
+            price_difference_pct REAL,
+            total_difference_pct REAL,
+            date_warning INTEGER,
+            status TEXT NOT NULL,
+            PRIMARY KEY (run_id, invoice_id),
+            FOREIGN KEY (run_id) REFERENCES reconciliation_runs (run_id)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_reconciliation_results_status ON reconciliation_results (run_id, status)')
+
     # Insert seed data for purchase orders only if table is empty
     cursor.execute('SELECT COUNT(*) FROM purchase_orders')
     po_count = cursor.fetchone()[0]
@@ -129,6 +447,20 @@ def execute_query(sql_query, params=None):
     """Execute a SQL query and return results"""
     conn = get_db_connection()
     cursor = conn.cursor()
+    is_select = sql_query.strip().upper().startswith('SELECT')
+    
+    # Record which tables a write touches so only their cached reads go stale
+    written_tables = set()
+    rewritten_tables = set()
+    if not is_select:
+        upsert = bool(_UPSERT_PATTERN.search(sql_query))
+        def track_writes(action, arg1, arg2, db_name, trigger_name):
+            if action in WRITE_ACTIONS:
+                written_tables.add(arg1)
+                if action in REWRITE_ACTIONS or upsert:
+                    rewritten_tables.add(arg1)
+            return sqlite3.SQLITE_OK
+        conn.set_authorizer(track_writes)
     
     try:
         if params:
@@ -136,12 +468,13 @@ def execute_query(sql_query, params=None):
         else:
             cursor.execute(sql_query)
         
-        if sql_query.strip().upper().startswith('SELECT'):
+        if is_select:
             results = cursor.fetchall()
             # Convert Row objects to dictionaries
             return [dict(row) for row in results]
         else:
             conn.commit()
+            bump_data_version(written_tables, rewritten_tables)
             return cursor.rowcount
     except Exception as e:
         conn.rollback()
@@ -149,8 +482,178 @@ def execute_query(sql_query, params=None):
     finally:
         conn.close()
 
-def update_leaderboard_score(team_id, validation_increment=0, query_increment=0, score_increment=0):
-    """Update leaderboard scores for a team"""
+def execute_read_query(sql_query, params=None):
+    """Execute a SELECT on the read-only pool and return rows as dictionaries"""
+    with read_connection() as conn:
+        cursor = conn.execute(sql_query, params or ())
+        return [dict(row) for row in cursor.fetchall()]
+
+def execute_governed_query(sql_query, params=None, max_rows=None, time_budget_ms=None,
+                           max_vm_steps=None, authorizer=None, columnar=False):
+    """
+    Execute a read query under a time/VM-step budget and a row cap.
+    Rows are pulled with fetchmany so a huge result is never fully
+    materialized; whatever was read before a limit hit is returned with
+    truncated/timed_out flags.
+    With columnar=True results are the cursor's row tuples (no per-row dicts)
+    and column_types holds a type hint per column.
+    """
+    max_rows = min(max_rows or QUERY_MAX_ROWS, QUERY_MAX_ROWS)
+    time_budget_ms = time_budget_ms or QUERY_TIME_BUDGET_MS
+    max_vm_steps = max_vm_steps or QUERY_MAX_VM_STEPS
+    
+    start = time.monotonic()
+    deadline = start + time_budget_ms / 1000.0
+    budget = {'steps': 0, 'exceeded': None}
+    
+    def check_budget():
+        budget['steps'] += PROGRESS_HANDLER_INTERVAL
+        if time.monotonic() > deadline:
+            budget['exceeded'] = 'time'
+        elif max_vm_steps and budget['steps'] > max_vm_steps:
+            budget['exceeded'] = 'vm_steps'
+        # Any non-zero return aborts the statement
+        return 1 if budget['exceeded'] else 0
+    
+    results = []
+    columns = []
+    truncated = False
+    try:
+        with read_connection() as conn:
+            if columnar:
+                conn.row_factory = None
+            conn.set_progress_handler(check_budget, PROGRESS_HANDLER_INTERVAL)
+            if authorizer:
+                conn.set_authorizer(authorizer)
+            
+            cursor = conn.execute(sql_query, params or ())
+            columns = [description[0] for description in cursor.description or []]
+            
+            while len(results) < max_rows:
+                rows = cursor.fetchmany(min(QUERY_FETCH_BATCH_SIZE, max_rows - len(results)))
+                if not rows:
+                    break
+                results.extend(rows if columnar else (dict(row) for row in rows))
+            else:
+                # Cap reached: peek one more row to know whether anything was cut off
+                truncated = cursor.fetchone() is not None
+    except sqlite3.OperationalError as e:
+        if not budget['exceeded']:
+            raise e
+    
+    return {
+        'results': results,
+        'columns': columns,
+        'column_types': infer_column_types(columns, results) if columnar else None,
+        'row_count': len(results),
+        'truncated': truncated,
+        'timed_out': budget['exceeded'] is not None,
+        'limit_exceeded': budget['exceeded'],
+        'max_rows': max_rows,
+        'elapsed_ms': round((time.monotonic() - start) * 1000, 2)
+    }
+
+SQLITE_TYPE_NAMES = {int: 'integer', float: 'real', str: 'text', bytes: 'blob'}
+
+def infer_column_types(columns, rows):
+    """Type hint per column from its first non-NULL value ('null' if none)"""
+    types = [None] * len(columns)
+    missing = len(columns)
+    for row in rows:
+        for i, value in enumerate(row):
+            if types[i] is None and value is not None:
+                types[i] = SQLITE_TYPE_NAMES.get(type(value), 'text')
+                missing -= 1
+        if not missing:
+            break
+    return [column_type or 'null' for column_type in types]
+
+def iter_query_rows(sql_query, params=None, batch_size=EXPORT_FETCH_BATCH_SIZE, time_budget_ms=None,
+                    authorizer=None):
+    """
+    Stream a read query's rows in constant memory.
+    The first item yielded is the list of column names, then each item is a
+    batch (list) of row tuples. The statement runs on the first next() call,
+    so errors surface before a caller starts a response. The pooled
+    connection is returned when the generator is exhausted or closed.
+    The time budget counts time spent executing the statement only, not
+    time the consumer spends between batches (e.g. on a slow client).
+    """
+    time_budget_ms = time_budget_ms or QUERY_EXPORT_TIME_BUDGET_MS
+    clock = {'spent': 0.0, 'started': time.monotonic()}
+    
+    def over_budget():
+        return 1 if (clock['spent'] + time.monotonic() - clock['started']) * 1000 > time_budget_ms else 0
+    
+    def timed(step, *args):
+        clock['started'] = time.monotonic()
+        try:
+            return step(*args)
+        except sqlite3.OperationalError as e:
+            if over_budget():
+                raise sqlite3.OperationalError(f'Query exceeded its {time_budget_ms} ms execution budget') from e
+            raise
+        finally:
+            clock['spent'] += time.monotonic() - clock['started']
+    
+    with read_connection() as conn:
+        conn.row_factory = None
+        conn.set_progress_handler(over_budget, PROGRESS_HANDLER_INTERVAL)
+        if authorizer:
+            conn.set_authorizer(authorizer)
+        cursor = timed(conn.execute, sql_query, params or ())
+        yield [description[0] for description in cursor.description or []]
+        
+        while True:
+            rows = timed(cursor.fetchmany, batch_size)
+            if not rows:
+                break
+            yield rows
+
+def result_payload(result):
+    """
+    Response fields carrying a governed query's rows: 'results' as a list of
+    objects, or for columnar results the column names and types once plus
+    'rows' as positional arrays.
+    """
+    if result.get('column_types') is None:
+        return {'results': result['results']}
+    return {
+        'columns': result['columns'],
+        'column_types': result['column_types'],
+        'rows': result['results']
+    }
+
+def governor_metadata(result):
+    """Response fields describing whether a governed query hit its limits"""
+    metadata = {
+        'truncated': result['truncated'],
+        'timed_out': result['timed_out'],
+        'max_rows': result['max_rows']
+    }
+    if result['timed_out']:
+        metadata['warning'] = (f"Query stopped after exceeding its {result['limit_exceeded'].replace('_', ' ')} budget; "
+                               f"showing the {result['row_count']} rows read so far")
+    elif result['truncated']:
+        metadata['warning'] = f"Results truncated to the first {result['max_rows']} rows"
+    return metadata
+
+def update_leaderboard_score(team_id, validation_increment=0, query_increment=0, score_increment=0, buffered=True):
+    """
+    Update leaderboard scores for a team.
+    When the write-behind writer is enabled and buffered is True the increments
+    are queued and flushed in batches; pass buffered=False to write through
+    (e.g. when the caller needs to know whether the team exists).
+    """
+    from models.leaderboard_writer import get_leaderboard_writer
+    
+    writer = get_leaderboard_writer() if buffered else None
+    if writer is not None:
+        writer.add(team_id, validation_increment, query_increment, score_increment)
+        bump_data_version(['leaderboard'], ['leaderboard'], local=True)
+        _notify_score_update(team_id, validation_increment, query_increment, score_increment)
+        return True
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
@@ -165,12 +668,31 @@ def update_leaderboard_score(team_id, validation_increment=0, query_increment=0,
         ''', (score_increment, validation_increment, query_increment, team_id))
         
         conn.commit()
-        return cursor.rowcount > 0
+        bump_data_version(['leaderboard'], ['leaderboard'])
+        updated = cursor.rowcount > 0
+        
+        if updated:
+            _notify_score_update(team_id, validation_increment, query_increment, score_increment)
+        
+        return updated
     except Exception as e:
         conn.rollback()
         raise e
     finally:
         conn.close()
 
+def _notify_score_update(team_id, validation_increment, query_increment, score_increment):
+    """Update in-memory rankings and notify stream subscribers about a score change"""
+    from services.event_bus import publish_event
+    from services.ranking_service import ranking_service
+    
+    ranking_service.apply_delta(team_id, validation_increment, query_increment, score_increment)
+    publish_event('score_update', {
+        'team_id': team_id,
+        'score_increment': score_increment,
+        'validation_increment': validation_increment,
+        'query_increment': query_increment
+    })
+
 if __name__ == '__main__':
     init_db()
@@ -0,0 +1,180 @@
+import atexit
+import os
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Column order of a pending delta: (score, validations_completed, queries_executed)
+SCORE, VALIDATIONS, QUERIES = 0, 1, 2
+
+class LeaderboardWriter:
+    """
+    Write-behind aggregator for leaderboard counters.
+    Increments are coalesced per team in memory and flushed in one batched
+    transaction every flush_interval_ms or after max_pending_events adds.
+    """
+
+    def __init__(self, flush_interval_ms=200, max_pending_events=500):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_pending_events = max_pending_events
+        self._pending = {}
+        self._pending_events = 0
+        self._lock = threading.Lock()
+        self._flushed = threading.Condition(self._lock)
+        # Even while idle, odd while a batch is being committed (seqlock)
+        self._flush_sequence = 0
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def start(self):
+        """Start the background flush thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='leaderboard-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flush thread and write out everything still pending"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self.flush()
+
+    def add(self, team_id, validation_increment=0, query_increment=0, score_increment=0):
+        """Queue increments for a team"""
+        with self._lock:
+            delta = self._pending.setdefault(team_id, [0, 0, 0])
+            delta[SCORE] += score_increment
+            delta[VALIDATIONS] += validation_increment
+            delta[QUERIES] += query_increment
+            self._pending_events += 1
+            flush_now = self._pending_events >= self.max_pending_events
+
+        if flush_now:
+            self._wakeup.set()
+
+    def pending_deltas(self):
+        """Get a copy of the pending per-team deltas"""
+        with self._lock:
+            return {team_id: tuple(delta) for team_id, delta in self._pending.items()}
+
+    def read_consistent(self, read_fn):
+        """
+        Run read_fn(pending_deltas) so that its database read and the deltas
+        it merges never both include (or both miss) a batch being flushed.
+        """
+        while True:
+            with self._lock:
+                while self._flush_sequence % 2:
+                    self._flushed.wait()
+                sequence = self._flush_sequence
+                deltas = {team_id: tuple(delta) for team_id, delta in self._pending.items()}
+
+            result = read_fn(deltas)
+
+            with self._lock:
+                if self._flush_sequence == sequence:
+                    return result
+
+    def flush(self):
+        """Write all pending deltas in a single transaction"""
+        from models.db_setup import get_db_connection, bump_data_version
+
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch = self._pending
+                self._pending = {}
+                self._pending_events = 0
+                self._flush_sequence += 1
+
+            try:
+                conn = get_db_connection()
+                try:
+                    conn.executemany('''
+                        UPDATE leaderboard
+                        SET score = score + ?,
+                            validations_completed = validations_completed + ?,
+                            queries_executed = queries_executed + ?,
+                            last_updated = CURRENT_TIMESTAMP
+                        WHERE team_id = ?
+                    ''', [(delta[SCORE], delta[VALIDATIONS], delta[QUERIES], team_id)
+                          for team_id, delta in batch.items()])
+                    conn.commit()
+                    # Raw table reads change now, even though merged reads do not
+                    bump_data_version(['leaderboard'], ['leaderboard'])
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.close()
+            except Exception as e:
+                logger.error(f"Error flushing leaderboard updates, will retry: {str(e)}")
+                # Put the batch back so no increments are lost
+                with self._lock:
+                    for team_id, delta in batch.items():
+                        pending = self._pending.setdefault(team_id, [0, 0, 0])
+                        for i in (SCORE, VALIDATIONS, QUERIES):
+                            pending[i] += delta[i]
+                return 0
+            finally:
+                with self._lock:
+                    self._flush_sequence += 1
+                    self._flushed.notify_all()
+
+            return len(batch)
+
+    def _run(self):
+        """Background loop flushing on interval or when enough events queue up"""
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_leaderboard_writer():
+    """
+    Get the shared write-behind writer, or None when it is disabled.
+    Enable with LEADERBOARD_WRITE_BEHIND=1.
+    """
+    global _writer
+    if os.environ.get('LEADERBOARD_WRITE_BEHIND', '').lower() not in ('1', 'true', 'yes'):
+        return None
+
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = LeaderboardWriter(
+                    flush_interval_ms=int(os.environ.get('LEADERBOARD_FLUSH_INTERVAL_MS', 200)),
+                    max_pending_events=int(os.environ.get('LEADERBOARD_FLUSH_MAX_EVENTS', 500))
+                )
+                _writer.start()
+    return _writer
+
+def read_with_pending(read_fn):
+    """Run read_fn(pending_deltas) consistently, with {} when buffering is off"""
+    writer = get_leaderboard_writer()
+    if writer is None:
+        return read_fn({})
+    return writer.read_consistent(read_fn)
+
+def merge_pending(team, deltas):
+    """Apply a team's pending delta to a leaderboard row dict in place"""
+    delta = deltas.get(team.get('team_id'))
+    if delta:
+        if 'score' in team:
+            team['score'] += delta[SCORE]
+        if 'validations_completed' in team:
+            team['validations_completed'] += delta[VALIDATIONS]
+        if 'queries_executed' in team:
+            team['queries_executed'] += delta[QUERIES]
+    return team
@@ -0,0 +1,134 @@
+from contextlib import contextmanager
+import os
+import queue
+import sqlite3
+import threading
+import urllib.parse
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Pragma profile for analytics connections: large page cache, memory-mapped
+# reads and in-memory temp b-trees for sorts/GROUP BY
+READ_PRAGMAS = (
+    f"PRAGMA cache_size = -{int(os.environ.get('READ_POOL_CACHE_KB', 65536))}",
+    f"PRAGMA mmap_size = {int(os.environ.get('READ_POOL_MMAP_BYTES', 268435456))}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA query_only = 1"
+)
+
+class ReadPoolExhausted(RuntimeError):
+    """Raised when no analytics connection frees up within the acquire timeout"""
+
+class ReadOnlyConnectionPool:
+    """
+    Pool of read-only connections (file:...?mode=ro) for analytics reads.
+    In WAL mode these readers never block the upload path's writers. A
+    semaphore caps concurrent analytics queries independently of ingestion,
+    and idle connections keep their page cache and prepared statements.
+    """
+
+    def __init__(self, database_path, max_connections=4, acquire_timeout=10.0):
+        self.database_path = database_path
+        self.max_connections = max_connections
+        self.acquire_timeout = acquire_timeout
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.in_use = 0
+        self.waits = 0
+        self.rejected = 0
+
+    def _open(self):
+        """Open a read-only connection with the analytics pragma profile"""
+        uri = f"file:{urllib.parse.quote(os.path.abspath(self.database_path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=256)
+        for pragma in READ_PRAGMAS:
+            conn.execute(pragma)
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection (rows as sqlite3.Row) for the duration of a with block"""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                with self._lock:
+                    self.rejected += 1
+                logger.warning("Analytics connection pool exhausted, rejecting read")
+                raise ReadPoolExhausted('Analytics connection pool is busy, try again shortly')
+
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            conn.row_factory = sqlite3.Row
+            with self._lock:
+                self.in_use += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        healthy = True
+        try:
+            yield conn
+        finally:
+            with self._lock:
+                self.in_use -= 1
+            try:
+                # Reset per-query state before handing the connection back
+                conn.set_progress_handler(None, 0)
+                conn.set_authorizer(None)
+                if conn.in_transaction:
+                    conn.rollback()
+            except sqlite3.Error:
+                healthy = False
+            if healthy:
+                self._idle.put(conn)
+            else:
+                conn.close()
+            self._slots.release()
+
+    def close(self):
+        """Close all idle connections"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def get_stats(self):
+        """Get pool usage counters"""
+        with self._lock:
+            return {
+                'max_connections': self.max_connections,
+                'opened': self.opened,
+                'idle': self._idle.qsize(),
+                'in_use': self.in_use,
+                'waits': self.waits,
+                'rejected': self.rejected
+            }
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_read_pool(database_path):
+    """Get the shared read-only pool for a database file"""
+    global _pool
+    with _pool_lock:
+        if _pool is None or _pool.database_path != database_path:
+            if _pool is not None:
+                _pool.close()
+            _pool = ReadOnlyConnectionPool(
+                database_path,
+                max_connections=int(os.environ.get('READ_POOL_SIZE', 4)),
+                acquire_timeout=float(os.environ.get('READ_POOL_ACQUIRE_TIMEOUT_SECONDS', 10))
+            )
+        return _pool
@@ -4,7 +4,15 @@ import uuid
 from werkzeug.utils import secure_filename
 from services.invoice_parser import parse_invoice_file
 from services.po_validator import validate_invoice
-from models.db_setup import execute_query, update_leaderboard_score
+from models.db_setup import execute_query, execute_read_query, update_leaderboard_score
+from services.event_bus import publish_event
+from services.reconciliation import reconciliation_engine, ReconciliationBusy, DEFAULT_CHUNK_SIZE
+from services.revalidation import revalidation_index, revalidation_worker
+from services.po_candidates import po_candidate_index
+from services.po_prefilter import po_prefilter
+from services.vendor_resolver import vendor_resolver
+from services.duplicate_detector import duplicate_detector
+from services.fuzzy_memo import fuzzy_memo
 import json
 
 invoice_bp = Blueprint('invoices', __name__)
@@ -108,6 +116,22 @@ def upload_invoice():
                         json.dumps(validation_result)
                     ))
                     current_app.logger.info(f"Successfully saved invoice {invoice_id} to database")
+                    # Approved spellings become vendor aliases (exact lookups next time)
+                    vendor_resolver.learn(invoice_data.get('vendor'), validation_result)
+                    # Later uploads are checked against this invoice's text
+                    duplicate_detector.add(invoice_id, invoice_data)
+                    revalidation_index.track(
+                        invoice_id,
+                        invoice_data.get('vendor', 'Unknown Vendor'),
+                        [item.get('item') for item in line_items] or [item_name],
+                        status
+                    )
+                    publish_event('validation', {
+                        'invoice_id': invoice_id,
+                        'vendor': invoice_data.get('vendor', 'Unknown Vendor'),
+                        'status': status,
+                        'team_id': team_id
+                    })
 
                     # Insert extracted line items into purchase_orders if not already present
                     for item in line_items:
@@ -120,8 +144,8 @@ def upload_invoice():
                             # Generate a new PO ID
                             new_po_id = f"PO-{invoice_id}-{item.get('item', '').replace(' ', '').upper()}"
                             execute_query("""
-                                INSERT INTO purchase_orders (po_id, vendor, item, qty, unit_price, total, date)
-                                VALUES (?, ?, ?, ?, ?, ?, ?)
+                                INSERT INTO purchase_orders (po_id, vendor, item, qty, unit_price, total, date, vendor_id)
+                                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
                             """, (
                                 new_po_id,
                                 invoice_data.get('vendor', 'Unknown Vendor'),
@@ -129,9 +153,14 @@ def upload_invoice():
                                 item.get('qty', 1),
                                 item.get('unit_price', 0.0),
                                 item.get('total', 0.0),
-                                invoice_data.get('date', '')
+                                invoice_data.get('date', ''),
+                                vendor_resolver.register(invoice_data.get('vendor', 'Unknown Vendor'))
                             ))
                             current_app.logger.info(f"Inserted new PO {new_po_id} for item {item.get('item', '')}")
+                            # Stored invoices this PO could now match are re-validated in the background
+                            revalidation_worker.po_changed(
+                                invoice_data.get('vendor', 'Unknown Vendor'), item.get('item', ''), exclude=invoice_id
+                            )
 
                     # Update leaderboard if team_id provided
                     if team_id:
@@ -170,7 +199,7 @@ def list_invoices():
         limit = request.args.get('limit', 50, type=int)
         offset = request.args.get('offset', 0, type=int)
         
-        invoices = execute_query("""
+        invoices = execute_read_query("""
             SELECT invoice_id, vendor, item, qty, unit_price, total, date, 
                    po_id, status, created_at 
             FROM invoices 
@@ -179,7 +208,7 @@ def list_invoices():
         """, (limit, offset))
         
         # Get total count
-        total_count = execute_query("SELECT COUNT(*) as count FROM invoices")[0]['count']
+        total_count = execute_read_query("SELECT COUNT(*) as count FROM invoices")[0]['count']
         
         return jsonify({
             'success': True,
@@ -199,7 +228,7 @@ def get_invoice_details(invoice_id):
     Get detailed information about a specific invoice
     """
     try:
-        invoice = execute_query("""
+        invoice = execute_read_query("""
             SELECT * FROM invoices WHERE invoice_id = ?
         """, (invoice_id,))
         
@@ -257,11 +286,11 @@ def get_invoice_stats():
         stats = {}
         
         # Total invoices
-        total_result = execute_query("SELECT COUNT(*) as count FROM invoices")
+        total_result = execute_read_query("SELECT COUNT(*) as count FROM invoices")
         stats['total_invoices'] = total_result[0]['count'] if total_result else 0
         
         # Status breakdown
-        status_results = execute_query("""
+        status_results = execute_read_query("""
             SELECT status, COUNT(*) as count 
             FROM invoices 
             GROUP BY status
@@ -269,7 +298,7 @@ def get_invoice_stats():
         stats['status_breakdown'] = {row['status']: row['count'] for row in status_results}
         
         # Recent activity (last 7 days)
-        recent_results = execute_query("""
+        recent_results = execute_read_query("""
             SELECT COUNT(*) as count 
             FROM invoices 
             WHERE created_at >= date('now', '-7 days')
@@ -277,7 +306,7 @@ def get_invoice_stats():
         stats['recent_activity'] = recent_results[0]['count'] if recent_results else 0
         
         # Top vendors
-        vendor_results = execute_query("""
+        vendor_results = execute_read_query("""
             SELECT vendor, COUNT(*) as invoice_count, SUM(total) as total_amount
             FROM invoices 
             GROUP BY vendor 
@@ -286,6 +315,12 @@ def get_invoice_stats():
         """)
         stats['top_vendors'] = vendor_results
         
+        # Background re-validation after PO changes
+        stats['revalidation'] = revalidation_worker.get_stats()
+        stats['po_candidates'] = po_candidate_index.get_stats()
+        stats['duplicates'] = duplicate_detector.get_stats()
+        stats['fuzzy_memo'] = fuzzy_memo.get_stats()
+        
         return jsonify({
             'success': True,
             'stats': stats
@@ -294,3 +329,116 @@ def get_invoice_stats():
     except Exception as e:
         current_app.logger.error(f"Error getting invoice stats: {str(e)}")
         return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@invoice_bp.route('/validation-metrics', methods=['GET'])
+def get_validation_metrics():
+    """
+    Get how much the date-window and amount-band filters shrink validation candidates
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'metrics': po_prefilter.get_metrics()
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting validation metrics: {str(e)}")
+        return jsonify({'error': f'Metrics error: {str(e)}'}), 500
+
+@invoice_bp.route('/reconcile', methods=['POST'])
+def start_reconciliation():
+    """
+    Start a batch reconciliation of the invoice book against purchase orders
+    Runs in the background; poll /reconcile/<run_id> for progress
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        chunk_size = data.get('chunk_size', DEFAULT_CHUNK_SIZE)
+        if isinstance(chunk_size, str) and chunk_size.strip().isdigit():
+            chunk_size = int(chunk_size)
+        if isinstance(chunk_size, bool) or not isinstance(chunk_size, int) or chunk_size < 1:
+            return jsonify({'error': 'chunk_size must be a positive integer'}), 400
+        
+        run_id = reconciliation_engine.start_background(
+            scope=data.get('scope', 'open'),
+            chunk_size=chunk_size,
+            price_tolerance_percentage=data.get('price_tolerance_percentage'),
+            resume=data.get('resume', False)
+        )
+        
+        return jsonify({
+            'success': True,
+            'run_id': run_id,
+            'run': reconciliation_engine.get_run(run_id)
+        }), 202
+        
+    except ReconciliationBusy as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error starting reconciliation: {str(e)}")
+        return jsonify({'error': f'Reconciliation error: {str(e)}'}), 500
+
+@invoice_bp.route('/reconcile', methods=['GET'])
+def list_reconciliations():
+    """
+    Get recent reconciliation runs
+    """
+    try:
+        limit = min(request.args.get('limit', 20, type=int), 100)
+        if limit < 1:
+            return jsonify({'error': 'limit must be a positive integer'}), 400
+        
+        return jsonify({
+            'success': True,
+            'runs': reconciliation_engine.list_runs(limit)
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Error listing reconciliations: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@invoice_bp.route('/reconcile/<int:run_id>', methods=['GET'])
+def get_reconciliation(run_id):
+    """
+    Get a reconciliation run's progress and result counts
+    """
+    try:
+        run = reconciliation_engine.get_run(run_id)
+        if run is None:
+            return jsonify({'error': 'Reconciliation run not found'}), 404
+        
+        return jsonify({
+            'success': True,
+            'run': run
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting reconciliation: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@invoice_bp.route('/reconcile/<int:run_id>/results', methods=['GET'])
+def get_reconciliation_results(run_id):
+    """
+    Get a page of per-invoice reconciliation results
+    Optional status filter: matched, discrepancy or unmatched
+    """
+    try:
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        offset = request.args.get('offset', 0, type=int)
+        status = request.args.get('status')
+        if limit < 1 or offset < 0:
+            return jsonify({'error': 'limit must be positive and offset must not be negative'}), 400
+        
+        return jsonify({
+            'success': True,
+            'run_id': run_id,
+            'results': reconciliation_engine.get_results(run_id, status, limit, offset),
+            'limit': limit,
+            'offset': offset
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting reconciliation results: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
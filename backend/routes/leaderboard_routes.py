@@ -1,10 +1,18 @@
-from flask import Blueprint, request, jsonify, current_app
-from models.db_setup import execute_query, update_leaderboard_score
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
+from models.db_setup import execute_query, execute_read_query, update_leaderboard_score
+from models.leaderboard_writer import read_with_pending, merge_pending
+from services.response_cache import cached_response
+from services.event_bus import event_bus, format_sse, publish_event
+from services.ranking_service import ranking_service, RANKING_METRICS
 import json
 
 leaderboard_bp = Blueprint('leaderboard', __name__)
 
+SSE_HEARTBEAT_SECONDS = 15
+SSE_RETRY_MILLISECONDS = 3000
+
 @leaderboard_bp.route('/', methods=['GET'])
+@cached_response()
 def get_leaderboard():
     """
     Get the current leaderboard rankings
@@ -12,17 +20,8 @@ def get_leaderboard():
     try:
         limit = request.args.get('limit', 20, type=int)
         
-        leaderboard = execute_query("""
-            SELECT team_id, team_name, score, validations_completed, 
-                   queries_executed, last_updated
-            FROM leaderboard 
-            ORDER BY score DESC, validations_completed DESC 
-            LIMIT ?
-        """, (limit,))
-        
-        # Add ranking
-        for i, team in enumerate(leaderboard):
-            team['rank'] = i + 1
+        # Ranked teams come from the in-memory index (includes pending increments)
+        leaderboard = ranking_service.top_k('score', limit)
         
         return jsonify({
             'success': True,
@@ -30,6 +29,8 @@ def get_leaderboard():
             'total_teams': len(leaderboard)
         })
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         current_app.logger.error(f"Error getting leaderboard: {str(e)}")
         return jsonify({'error': f'Database error: {str(e)}'}), 500
@@ -41,9 +42,12 @@ def get_team_stats(team_id):
     """
     try:
         # Get team info
-        team_result = execute_query("""
-            SELECT * FROM leaderboard WHERE team_id = ?
-        """, (team_id,))
+        team_result = read_with_pending(lambda deltas: [
+            merge_pending(team, deltas)
+            for team in execute_read_query("""
+                SELECT * FROM leaderboard WHERE team_id = ?
+            """, (team_id,))
+        ])
         
         if not team_result:
             return jsonify({'error': 'Team not found'}), 404
@@ -51,7 +55,7 @@ def get_team_stats(team_id):
         team_data = team_result[0]
         
         # Get team's query history
-        query_history = execute_query("""
+        query_history = execute_read_query("""
             SELECT natural_language_query, sql_query, execution_time, 
                    result_count, created_at
             FROM query_history 
@@ -75,13 +79,43 @@ def get_team_stats(team_id):
                 'total_execution_time': round(total_execution_time, 3),
                 'average_execution_time': round(avg_execution_time, 3),
                 'recent_queries': len(query_history)
-            }
+            },
+            'rankings': {metric: ranking_service.rank_of(metric, team_id) for metric in RANKING_METRICS}
         })
         
     except Exception as e:
         current_app.logger.error(f"Error getting team stats: {str(e)}")
         return jsonify({'error': f'Database error: {str(e)}'}), 500
 
+@leaderboard_bp.route('/team/<team_id>/rank', methods=['GET'])
+def get_team_rank(team_id):
+    """
+    Get a team's rank for a metric and the teams ranked around it
+    """
+    try:
+        metric = request.args.get('metric', 'score')
+        radius = request.args.get('radius', 2, type=int)
+        
+        if metric not in RANKING_METRICS:
+            return jsonify({'error': f'Unknown metric. Use one of: {", ".join(RANKING_METRICS)}'}), 400
+        
+        rank = ranking_service.rank_of(metric, team_id)
+        if rank is None:
+            return jsonify({'error': 'Team not found'}), 404
+        
+        return jsonify({
+            'success': True,
+            'team_id': team_id,
+            'metric': metric,
+            'rank': rank,
+            'total_teams': ranking_service.team_count(),
+            'neighbors': ranking_service.neighbors(metric, team_id, max(0, min(radius, 50)))
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Error getting team rank: {str(e)}")
+        return jsonify({'error': f'Ranking error: {str(e)}'}), 500
+
 @leaderboard_bp.route('/update', methods=['POST'])
 def update_team_score():
     """
@@ -106,7 +140,8 @@ def update_team_score():
             team_id, 
             validation_increment, 
             query_increment, 
-            score_increment
+            score_increment,
+            buffered=False  # write through so a missing team is reported
         )
         
         if success:
@@ -155,6 +190,12 @@ def create_team():
             VALUES (?, ?, 0, 0, 0)
         """, (team_id, team_name))
         
+        ranking_service.upsert_team(execute_query("""
+            SELECT team_id, team_name, score, validations_completed, queries_executed, last_updated
+            FROM leaderboard WHERE team_id = ?
+        """, (team_id,))[0])
+        publish_event('team_created', {'team_id': team_id, 'team_name': team_name})
+        
         return jsonify({
             'success': True,
             'message': 'Team created successfully',
@@ -167,6 +208,7 @@ def create_team():
         return jsonify({'error': f'Creation error: {str(e)}'}), 500
 
 @leaderboard_bp.route('/stats', methods=['GET'])
+@cached_response(max_age=60)  # recent-activity counts use 24h windows
 def get_leaderboard_stats():
     """
     Get overall leaderboard statistics
@@ -175,25 +217,24 @@ def get_leaderboard_stats():
         stats = {}
         
         # Total teams
-        total_teams_result = execute_query("SELECT COUNT(*) as count FROM leaderboard")
+        total_teams_result = execute_read_query("SELECT COUNT(*) as count FROM leaderboard")
         stats['total_teams'] = total_teams_result[0]['count'] if total_teams_result else 0
         
-        # Total score across all teams
-        total_score_result = execute_query("SELECT SUM(score) as total_score FROM leaderboard")
-        stats['total_score'] = total_score_result[0]['total_score'] or 0
+        # Totals across all teams, including pending buffered increments
+        def read_totals(deltas):
+            totals = execute_read_query("""
+                SELECT SUM(score) as total_score,
+                       SUM(validations_completed) as total_validations,
+                       SUM(queries_executed) as total_queries
+                FROM leaderboard
+            """)[0]
+            return {
+                'total_score': (totals['total_score'] or 0) + sum(delta[0] for delta in deltas.values()),
+                'total_validations': (totals['total_validations'] or 0) + sum(delta[1] for delta in deltas.values()),
+                'total_queries': (totals['total_queries'] or 0) + sum(delta[2] for delta in deltas.values())
+            }
         
-        # Total validations and queries
-        totals_result = execute_query("""
-            SELECT SUM(validations_completed) as total_validations,
-                   SUM(queries_executed) as total_queries
-            FROM leaderboard
-        """)
-        if totals_result:
-            stats['total_validations'] = totals_result[0]['total_validations'] or 0
-            stats['total_queries'] = totals_result[0]['total_queries'] or 0
-        else:
-            stats['total_validations'] = 0
-            stats['total_queries'] = 0
+        stats.update(read_with_pending(read_totals))
         
         # Average score
         if stats['total_teams'] > 0:
@@ -202,18 +243,17 @@ def get_leaderboard_stats():
             stats['average_score'] = 0
         
         # Top performer
-        top_team_result = execute_query("""
-            SELECT team_name, score FROM leaderboard 
-            ORDER BY score DESC 
-            LIMIT 1
-        """)
+        top_team_result = ranking_service.top_k('score', 1)
         if top_team_result:
-            stats['top_team'] = top_team_result[0]
+            stats['top_team'] = {
+                'team_name': top_team_result[0]['team_name'],
+                'score': top_team_result[0]['score']
+            }
         else:
             stats['top_team'] = None
         
         # Most active team (most validations + queries + recent activity weight)
-        most_active_result = execute_query("""
+        most_active_result = execute_read_query("""
             SELECT 
                 l.team_name, 
                 l.team_id,
@@ -249,7 +289,7 @@ def get_leaderboard_stats():
             stats['most_active_team'] = None
         
         # Recent activity (teams updated in last 24 hours)
-        recent_activity_result = execute_query("""
+        recent_activity_result = execute_read_query("""
             SELECT COUNT(*) as count 
             FROM leaderboard 
             WHERE last_updated >= datetime('now', '-24 hours')
@@ -272,7 +312,7 @@ def get_real_time_activity():
     """
     try:
         # Get teams with recent activity (last 24 hours)
-        recent_activity = execute_query("""
+        recent_activity = execute_read_query("""
             SELECT 
                 l.team_id,
                 l.team_name,
@@ -299,7 +339,7 @@ def get_real_time_activity():
         """)
         
         # Get most active team with enhanced calculation
-        most_active = execute_query("""
+        most_active = execute_read_query("""
             SELECT 
                 l.team_id,
                 l.team_name,
@@ -335,7 +375,7 @@ def get_real_time_activity():
             'success': True,
             'recent_activity': recent_activity,
             'most_active_team': most_active[0] if most_active else None,
-            'activity_timestamp': execute_query("SELECT datetime('now') as current_time")[0]['current_time']
+            'activity_timestamp': execute_read_query("SELECT datetime('now') as current_time")[0]['current_time']
         })
         
     except Exception as e:
@@ -366,6 +406,9 @@ def delete_team(team_id):
             DELETE FROM query_history WHERE team_id = ?
         """, (team_id,))
         
+        ranking_service.remove_team(team_id)
+        publish_event('team_deleted', {'team_id': team_id})
+        
         return jsonify({
             'success': True,
             'message': 'Team deleted successfully'
@@ -376,6 +419,7 @@ def delete_team(team_id):
         return jsonify({'error': f'Deletion error: {str(e)}'}), 500
 
 @leaderboard_bp.route('/rankings', methods=['GET'])
+@cached_response()
 def get_rankings_by_category():
     """
     Get rankings by different categories
@@ -383,40 +427,27 @@ def get_rankings_by_category():
     try:
         rankings = {}
         
-        # By total score
-        rankings['by_score'] = execute_query("""
-            SELECT team_name, score, ROW_NUMBER() OVER (ORDER BY score DESC) as rank
-            FROM leaderboard 
-            ORDER BY score DESC 
-            LIMIT 10
-        """)
-        
-        # By validations completed
-        rankings['by_validations'] = execute_query("""
-            SELECT team_name, validations_completed, 
-                   ROW_NUMBER() OVER (ORDER BY validations_completed DESC) as rank
-            FROM leaderboard 
-            ORDER BY validations_completed DESC 
-            LIMIT 10
-        """)
-        
-        # By queries executed
-        rankings['by_queries'] = execute_query("""
-            SELECT team_name, queries_executed,
-                   ROW_NUMBER() OVER (ORDER BY queries_executed DESC) as rank
-            FROM leaderboard 
-            ORDER BY queries_executed DESC 
-            LIMIT 10
-        """)
+        # By total score, validations completed and queries executed
+        for category, metric in (('by_score', 'score'),
+                                 ('by_validations', 'validations'),
+                                 ('by_queries', 'queries')):
+            column = RANKING_METRICS[metric][0]
+            rankings[category] = [
+                {'team_name': team['team_name'], column: team[column], 'rank': team['rank']}
+                for team in ranking_service.top_k(metric, 10)
+            ]
         
         # By recent activity (last updated) - include all team data for frontend compatibility
-        rankings['most_recent'] = execute_query("""
-            SELECT team_id, team_name, score, validations_completed, queries_executed, last_updated,
-                   ROW_NUMBER() OVER (ORDER BY last_updated DESC) as rank
-            FROM leaderboard 
-            ORDER BY last_updated DESC 
-            LIMIT 10
-        """)
+        rankings['most_recent'] = read_with_pending(lambda deltas: [
+            merge_pending(team, deltas)
+            for team in execute_read_query("""
+                SELECT team_id, team_name, score, validations_completed, queries_executed, last_updated,
+                       ROW_NUMBER() OVER (ORDER BY last_updated DESC) as rank
+                FROM leaderboard 
+                ORDER BY last_updated DESC 
+                LIMIT 10
+            """)
+        ])
         
         return jsonify({
             'success': True,
@@ -426,3 +457,33 @@ def get_rankings_by_category():
     except Exception as e:
         current_app.logger.error(f"Error getting rankings: {str(e)}")
         return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@leaderboard_bp.route('/stream', methods=['GET'])
+def stream_leaderboard_events():
+    """
+    Server-Sent Events stream of score changes, validations and queries.
+    Reconnecting clients send Last-Event-ID to replay missed events.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = event_bus.subscribe(last_event_id)
+    
+    def generate():
+        try:
+            yield f"retry: {SSE_RETRY_MILLISECONDS}\n\n"
+            while True:
+                event = subscription.next_event(timeout=SSE_HEARTBEAT_SECONDS)
+                if event is None:
+                    yield ": heartbeat\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(subscription)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
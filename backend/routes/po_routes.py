@@ -0,0 +1,44 @@
+from flask import Blueprint, request, jsonify, current_app
+from services.po_loader import po_loader, POLoadBusy, DEFAULT_CHUNK_SIZE, detect_format
+import io
+
+po_bp = Blueprint('purchase_orders', __name__)
+
+@po_bp.route('/import', methods=['POST'])
+def import_purchase_orders():
+    """
+    Bulk load purchase orders from a CSV or NDJSON export, uploaded as 'file'
+    or sent as the request body with ?format=csv|ndjson. Existing po_ids are
+    updated in place. Multi-million-row exports are better loaded with
+    python -m services.po_loader (uploads are capped by MAX_CONTENT_LENGTH).
+    """
+    try:
+        chunk_size = request.args.get('chunk_size', DEFAULT_CHUNK_SIZE, type=int)
+        defer_indexes = request.args.get('defer_indexes', 'false').lower() in ('1', 'true', 'yes')
+
+        if 'file' in request.files:
+            file = request.files['file']
+            if file.filename == '':
+                return jsonify({'error': 'No file selected'}), 400
+            data_format = request.args.get('format') or detect_format(file.filename)
+            stream = file.stream
+        else:
+            data_format = request.args.get('format')
+            if not data_format:
+                return jsonify({'error': 'No file provided (or format for a raw request body)'}), 400
+            stream = request.stream
+
+        report = po_loader.load(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''), data_format,
+                                chunk_size=chunk_size, defer_indexes=defer_indexes)
+        return jsonify({
+            'success': True,
+            'report': report
+        })
+
+    except POLoadBusy as e:
+        return jsonify({'error': str(e)}), 409
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error importing purchase orders: {str(e)}")
+        return jsonify({'error': f'Import error: {str(e)}'}), 500
@@ -1,7 +1,25 @@
-from flask import Blueprint, request, jsonify, current_app
+from flask import Blueprint, Response, request, jsonify, current_app, stream_with_context
 from services.query_engine import QueryEngine, execute_nl_query
-from models.db_setup import execute_query
+from models.db_setup import DATABASE_PATH, execute_read_query, governor_metadata, iter_query_rows, result_payload
+from models.read_pool import ReadPoolExhausted, get_read_pool
+from services.response_cache import cached_response
+from services.translation_cache import translation_cache
+from services.result_cache import query_result_cache
+from services.sql_translator import get_translator
+from services.sql_guard import sql_guard
+from services.plan_recorder import plan_recorder
+from services.index_advisor import advise
+from services.spend_cube import spend_cube
+import csv
+import io
+import json
 import os
+import zlib
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
 
 query_bp = Blueprint('queries', __name__)
 
@@ -18,6 +36,8 @@ def execute_natural_language_query():
         
         natural_query = data['query'].strip()
         team_id = data.get('team_id')  # Optional team ID for scoring
+        fresh = bool(data.get('fresh', False))  # Bypass the result cache
+        columnar = data.get('format') == 'columnar'  # Columns once, rows as arrays
         
         if not natural_query:
             return jsonify({'error': 'Empty query provided'}), 400
@@ -26,7 +46,7 @@ def execute_natural_language_query():
         openai_api_key = os.environ.get('OPENAI_API_KEY') or data.get('openai_api_key')
         
         # Execute the query
-        result = execute_nl_query(natural_query, team_id, openai_api_key)
+        result = execute_nl_query(natural_query, team_id, openai_api_key, fresh, columnar)
         
         return jsonify(result)
         
@@ -38,6 +58,7 @@ def execute_natural_language_query():
         }), 500
 
 @query_bp.route('/suggestions', methods=['GET'])
+@cached_response(versioned=False)
 def get_query_suggestions():
     """
     Get suggested queries for the UI
@@ -56,6 +77,7 @@ def get_query_suggestions():
         return jsonify({'error': f'Error: {str(e)}'}), 500
 
 @query_bp.route('/samples', methods=['GET'])
+@cached_response(versioned=False)
 def get_sample_queries():
     """
     Get sample queries with their SQL translations for demonstration
@@ -98,7 +120,7 @@ def get_query_history():
         base_query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
         params.extend([limit, offset])
         
-        history = execute_query(base_query, params)
+        history = execute_read_query(base_query, params)
         
         # Get total count
         count_query = "SELECT COUNT(*) as count FROM query_history"
@@ -107,7 +129,7 @@ def get_query_history():
             count_query += " WHERE team_id = ?"
             count_params.append(team_id)
         
-        total_count = execute_query(count_query, count_params)[0]['count']
+        total_count = execute_read_query(count_query, count_params)[0]['count']
         
         return jsonify({
             'success': True,
@@ -166,24 +188,32 @@ def execute_sql_directly():
         
         sql_query = data['sql'].strip()
         team_id = data.get('team_id')
+        fresh = bool(data.get('fresh', False))  # Bypass the result cache
+        max_rows = data.get('max_rows')  # Optional, capped by QUERY_MAX_ROWS
+        columnar = data.get('format') == 'columnar'  # Columns once, rows as arrays
         
         if not sql_query:
             return jsonify({'error': 'Empty SQL query provided'}), 400
         
-        # Basic security check - only allow SELECT statements
-        if not sql_query.upper().strip().startswith('SELECT'):
-            return jsonify({'error': 'Only SELECT statements are allowed'}), 400
-        
-        # Check for dangerous keywords
-        dangerous_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE', 'TRUNCATE']
-        sql_upper = sql_query.upper()
-        
-        for keyword in dangerous_keywords:
-            if keyword in sql_upper:
-                return jsonify({'error': f'Keyword "{keyword}" is not allowed'}), 400
-        
-        # Execute the query
-        results = execute_query(sql_query)
+        if max_rows is not None:
+            if isinstance(max_rows, str) and max_rows.strip().isdigit():
+                max_rows = int(max_rows)
+            if isinstance(max_rows, bool) or not isinstance(max_rows, int) or max_rows < 1:
+                return jsonify({'error': 'max_rows must be a positive integer'}), 400
+        
+        # Compile under a read-only authorizer: only SELECTs on queryable tables
+        allowed, reason = sql_guard.validate(sql_query)
+        if not allowed:
+            return jsonify({'error': reason}), 400
+        
+        # Execute the query under the execution governor (served from the
+        # result cache when its tables are unchanged)
+        execution, cache_status = query_result_cache.execute(
+            sql_query, bypass=fresh, max_rows=max_rows, columnar=columnar,
+            authorizer=sql_guard.authorizer(sql_query))
+        results = execution['results']
+        if cache_status != 'hit':
+            plan_recorder.record(sql_query, execution['elapsed_ms'], source='sql')
         
         # Update leaderboard if team_id provided
         if team_id:
@@ -193,10 +223,14 @@ def execute_sql_directly():
         return jsonify({
             'success': True,
             'sql_query': sql_query,
-            'results': results,
-            'result_count': len(results) if results else 0
+            **result_payload(execution),
+            'result_count': len(results) if results else 0,
+            'cache': cache_status,
+            **governor_metadata(execution)
         })
         
+    except ReadPoolExhausted as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
     except Exception as e:
         current_app.logger.error(f"Error executing SQL query: {str(e)}")
         return jsonify({
@@ -204,6 +238,140 @@ def execute_sql_directly():
             'error': f'SQL execution error: {str(e)}'
         }), 500
 
+@query_bp.route('/export', methods=['GET', 'POST'])
+def export_query_results():
+    """
+    Stream query results as NDJSON or CSV (?format=ndjson|csv).
+    Accepts either 'sql' or a natural language 'query'. Rows are read from the
+    cursor in batches and written straight into a chunked response, gzipped
+    when the client accepts it (or gzip=1 is passed).
+    """
+    try:
+        data = request.get_json(silent=True) or request.args
+        export_format = (data.get('format') or request.args.get('format') or 'ndjson').lower()
+        sql_query = (data.get('sql') or '').strip()
+        natural_query = (data.get('query') or '').strip()
+        
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'error': f'Unsupported format "{export_format}", use ndjson or csv'}), 400
+        
+        engine = QueryEngine(os.environ.get('OPENAI_API_KEY') or data.get('openai_api_key'))
+        
+        if not sql_query:
+            if not natural_query:
+                return jsonify({'error': 'No SQL or query provided'}), 400
+            translation = engine.translate_to_sql(natural_query)
+            if not translation['success']:
+                return jsonify(translation), 400
+            sql_query = translation['sql_query']
+        
+        allowed, reason = sql_guard.validate(sql_query)
+        if not allowed:
+            return jsonify({'error': reason}), 400
+        
+        # Run the statement now so SQL errors are reported before streaming starts
+        rows = iter_query_rows(sql_query, authorizer=sql_guard.authorizer(sql_query))
+        try:
+            columns = next(rows)
+        except Exception as e:
+            rows.close()
+            return jsonify({'success': False, 'error': f'SQL execution error: {str(e)}'}), 400
+        
+        body = _encode_csv(columns, rows) if export_format == 'csv' else _encode_ndjson(columns, rows)
+        
+        headers = {
+            'Content-Disposition': f'attachment; filename=export.{export_format}',
+            'X-Accel-Buffering': 'no'
+        }
+        gzip_requested = str(data.get('gzip') or request.args.get('gzip') or '').lower() in ('1', 'true', 'yes')
+        if gzip_requested or request.accept_encodings['gzip']:
+            body = _gzip_chunks(body)
+            headers['Content-Encoding'] = 'gzip'
+            headers['Vary'] = 'Accept-Encoding'
+        
+        return Response(stream_with_context(body), mimetype=EXPORT_FORMATS[export_format], headers=headers)
+        
+    except Exception as e:
+        current_app.logger.error(f"Error exporting query results: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Export error: {str(e)}'
+        }), 500
+
+def _encode_ndjson(columns, rows):
+    """Yield one newline-delimited JSON object per row, a batch per chunk"""
+    try:
+        for batch in rows:
+            yield ''.join(json.dumps(dict(zip(columns, row)), default=str) + '\n' for row in batch)
+    except Exception as e:
+        # Headers are already sent: report the failure in-band, then break off
+        # the chunked response so a client cannot take the body as complete
+        current_app.logger.error(f"Export aborted: {str(e)}")
+        yield json.dumps({'error': f'Export aborted: {str(e)}'}) + '\n'
+        raise
+
+def _encode_csv(columns, rows):
+    """Yield a CSV header and then one chunk of CSV lines per batch"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    
+    try:
+        for batch in rows:
+            writer.writerows(batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    except Exception as e:
+        # As for NDJSON: a trailer row naming the error, then an aborted response
+        current_app.logger.error(f"Export aborted: {str(e)}")
+        writer.writerow([f'#ERROR Export aborted: {str(e)}'])
+        yield buffer.getvalue()
+        raise
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def _gzip_chunks(chunks):
+    """Gzip a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            compressed = compressor.compress(chunk.encode('utf-8'))
+            if compressed:
+                yield compressed
+    except Exception:
+        # Deliver an error trailer that is still buffered, without a gzip footer
+        yield compressor.flush(zlib.Z_SYNC_FLUSH)
+        raise
+    yield compressor.flush()
+
+@query_bp.route('/index-advice', methods=['GET'])
+def get_index_advice():
+    """
+    Propose indexes for the slowest recurring query shapes in query_history.
+    With replay=1 candidates are also timed on a scratch copy of the
+    database, within the advisor's total replay budget.
+    """
+    try:
+        report = advise(
+            min_count=request.args.get('min_count', 2, type=int),
+            limit=min(request.args.get('limit', 10, type=int), 50),
+            replay=request.args.get('replay', '0').lower() in ('1', 'true', 'yes')
+        )
+        
+        return jsonify({
+            'success': True,
+            **report
+        })
+        
+    except Exception as e:
+        current_app.logger.error(f"Error building index advice: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': f'Index advisor error: {str(e)}'
+        }), 500
+
 @query_bp.route('/stats', methods=['GET'])
 def get_query_stats():
     """
@@ -213,15 +381,15 @@ def get_query_stats():
         stats = {}
         
         # Total queries executed
-        total_result = execute_query("SELECT COUNT(*) as count FROM query_history")
+        total_result = execute_read_query("SELECT COUNT(*) as count FROM query_history")
         stats['total_queries'] = total_result[0]['count'] if total_result else 0
         
         # Average execution time
-        avg_time_result = execute_query("SELECT AVG(execution_time) as avg_time FROM query_history")
+        avg_time_result = execute_read_query("SELECT AVG(execution_time) as avg_time FROM query_history")
         stats['average_execution_time'] = round(avg_time_result[0]['avg_time'] or 0, 3)
         
         # Recent activity (last 24 hours)
-        recent_result = execute_query("""
+        recent_result = execute_read_query("""
             SELECT COUNT(*) as count 
             FROM query_history 
             WHERE created_at >= datetime('now', '-24 hours')
@@ -229,7 +397,7 @@ def get_query_stats():
         stats['recent_queries'] = recent_result[0]['count'] if recent_result else 0
         
         # Most active teams
-        team_activity = execute_query("""
+        team_activity = execute_read_query("""
             SELECT team_id, COUNT(*) as query_count 
             FROM query_history 
             WHERE team_id IS NOT NULL 
@@ -240,7 +408,7 @@ def get_query_stats():
         stats['top_teams'] = team_activity
         
         # Common query patterns
-        common_patterns = execute_query("""
+        common_patterns = execute_read_query("""
             SELECT natural_language_query, COUNT(*) as frequency
             FROM query_history 
             GROUP BY LOWER(natural_language_query)
@@ -250,6 +418,17 @@ def get_query_stats():
         """)
         stats['common_queries'] = common_patterns
         
+        # Translation cache effectiveness
+        stats['translation_cache'] = translation_cache.get_stats()
+        stats['result_cache'] = query_result_cache.get_stats()
+        stats['sql_guard'] = sql_guard.get_stats()
+        stats['read_pool'] = get_read_pool(DATABASE_PATH).get_stats()
+        stats['spend_cube'] = spend_cube.get_stats()
+        
+        # GPT-4 upstream calls, coalescing and load shedding
+        translator = get_translator(os.environ.get('OPENAI_API_KEY'))
+        stats['translator'] = translator.get_stats() if translator else None
+        
         return jsonify({
             'success': True,
             'stats': stats
@@ -0,0 +1,181 @@
+from flask import Blueprint, request, jsonify, current_app
+from models.db_setup import execute_read_query
+from services.vendor_resolver import vendor_resolver
+from services.po_validator import POValidator
+
+vendor_bp = Blueprint('vendors', __name__)
+
+@vendor_bp.route('/', methods=['GET'])
+def list_vendors():
+    """
+    Get canonical vendors with their alias and PO counts
+    """
+    try:
+        vendor_resolver.sync()
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        offset = request.args.get('offset', 0, type=int)
+
+        vendors = execute_read_query("""
+            SELECT v.vendor_id, v.name, v.created_at,
+                   (SELECT COUNT(*) FROM vendor_aliases a WHERE a.vendor_id = v.vendor_id) as alias_count,
+                   (SELECT COUNT(*) FROM purchase_orders p WHERE p.vendor_id = v.vendor_id) as po_count
+            FROM vendors v
+            ORDER BY v.name
+            LIMIT ? OFFSET ?
+        """, (limit, offset))
+
+        return jsonify({
+            'success': True,
+            'vendors': vendors,
+            'count': len(vendors)
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error listing vendors: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@vendor_bp.route('/<int:vendor_id>', methods=['GET'])
+def get_vendor(vendor_id):
+    """
+    Get a canonical vendor and every spelling that resolves to it
+    """
+    try:
+        vendor_resolver.sync()
+        vendor = execute_read_query("SELECT * FROM vendors WHERE vendor_id = ?", (vendor_id,))
+        if not vendor:
+            return jsonify({'error': 'Vendor not found'}), 404
+
+        aliases = execute_read_query("""
+            SELECT alias, source, created_at FROM vendor_aliases
+            WHERE vendor_id = ?
+            ORDER BY source, alias
+        """, (vendor_id,))
+
+        return jsonify({
+            'success': True,
+            'vendor': vendor[0],
+            'aliases': aliases
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error getting vendor: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@vendor_bp.route('/<int:vendor_id>/aliases', methods=['POST'])
+def add_vendor_alias(vendor_id):
+    """
+    Map a vendor spelling to this vendor (re-pointing a learned or manual alias)
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if not data.get('alias'):
+            return jsonify({'error': 'No alias provided'}), 400
+
+        alias = vendor_resolver.add_alias(vendor_id, data['alias'])
+        return jsonify({
+            'success': True,
+            'vendor_id': vendor_id,
+            'alias': alias
+        }), 201
+
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error adding vendor alias: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@vendor_bp.route('/aliases/<path:alias>', methods=['DELETE'])
+def delete_vendor_alias(alias):
+    """
+    Remove a learned or manual vendor alias
+    """
+    try:
+        return jsonify({
+            'success': True,
+            'alias': vendor_resolver.remove_alias(alias)
+        })
+
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error deleting vendor alias: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@vendor_bp.route('/<int:vendor_id>/merge', methods=['POST'])
+def merge_vendor(vendor_id):
+    """
+    Merge another canonical vendor into this one (body: {"source_vendor_id": ...})
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        if data.get('source_vendor_id') is None:
+            return jsonify({'error': 'No source_vendor_id provided'}), 400
+
+        moved = vendor_resolver.merge(int(data['source_vendor_id']), vendor_id)
+        return jsonify({
+            'success': True,
+            'vendor_id': vendor_id,
+            'merged_vendor_id': int(data['source_vendor_id']),
+            'purchase_orders_moved': moved
+        })
+
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        current_app.logger.error(f"Error merging vendors: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
+
+@vendor_bp.route('/resolve', methods=['GET'])
+def resolve_vendor():
+    """
+    Resolve a vendor spelling to canonical vendors (?name=...)
+    """
+    try:
+        name = request.args.get('name', '')
+        if not name.strip():
+            return jsonify({'error': 'No vendor name provided'}), 400
+
+        threshold = request.args.get('threshold', POValidator().vendor_similarity_threshold, type=float)
+        exact = vendor_resolver.lookup(name)
+        scores = vendor_resolver.resolve(name, threshold)
+        vendors = {row['vendor_id']: row['name'] for row in execute_read_query(
+            f"SELECT vendor_id, name FROM vendors WHERE vendor_id IN ({', '.join('?' * len(scores))})",
+            list(scores)
+        )} if scores else {}
+
+        return jsonify({
+            'success': True,
+            'name': name,
+            'method': 'alias' if exact is not None else 'fuzzy',
+            'matches': sorted(({
+                'vendor_id': vendor_id,
+                'name': vendors.get(vendor_id),
+                'similarity': round(score, 2)
+            } for vendor_id, score in scores.items()), key=lambda match: -match['similarity'])
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error resolving vendor: {str(e)}")
+        return jsonify({'error': f'Resolution error: {str(e)}'}), 500
+
+@vendor_bp.route('/stats', methods=['GET'])
+def get_vendor_stats():
+    """
+    Get alias table size and exact-lookup hit rate
+    """
+    try:
+        vendor_resolver.sync()
+        return jsonify({
+            'success': True,
+            'stats': vendor_resolver.get_stats()
+        })
+
+    except Exception as e:
+        current_app.logger.error(f"Error getting vendor stats: {str(e)}")
+        return jsonify({'error': f'Database error: {str(e)}'}), 500
@@ -0,0 +1,253 @@
+from models.db_setup import get_db_connection, read_connection, bump_data_version
+import numpy as np
+import hashlib
+import json
+import os
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DUPLICATE_DETECTION = os.environ.get('DUPLICATE_DETECTION', '1').lower() not in ('0', 'false', 'no')
+# Estimated Jaccard similarity of text shingles at which invoices are flagged
+DUPLICATE_SIMILARITY_THRESHOLD = float(os.environ.get('DUPLICATE_SIMILARITY_THRESHOLD', 0.8))
+SHINGLE_SIZE = 4          # Bytes per shingle: short, so OCR noise touches few of them
+NUM_PERMUTATIONS = 128
+LSH_BANDS = 16            # 16 bands of 8 rows: pairs near 0.71 similarity become candidates
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+MAX_REPORTED_DUPLICATES = 5
+BACKFILL_BATCH_SIZE = 500
+
+# Multiply-shift hash family h(x) = ((a * x + b) mod 2**64) >> 32 over the
+# 32-bit shingles, wrapping in uint64 arithmetic. Fixed seed: signatures
+# are stored, so every process must use the same permutations.
+_rng = np.random.RandomState(20240901)
+_A = (_rng.randint(0, 2 ** 63, size=NUM_PERMUTATIONS, dtype=np.uint64) << np.uint64(1)) | np.uint64(1)
+_B = _rng.randint(0, 2 ** 63, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+def shingles(text):
+    """Distinct byte 4-grams of whitespace-normalized, lower-cased text, packed into uint64"""
+    data = np.frombuffer(' '.join((text or '').lower().split()).encode(), dtype=np.uint8).astype(np.uint64)
+    if len(data) < SHINGLE_SIZE:
+        return np.empty(0, dtype=np.uint64)
+    packed = np.zeros(len(data) - SHINGLE_SIZE + 1, dtype=np.uint64)
+    for offset in range(SHINGLE_SIZE):
+        packed = (packed << np.uint64(8)) | data[offset:len(data) - SHINGLE_SIZE + 1 + offset]
+    return np.unique(packed)
+
+def minhash(text):
+    """MinHash signature of the text's shingles, or None for text too short to shingle"""
+    ids = shingles(text)
+    if not len(ids):
+        return None
+    return ((_A[:, None] * ids + _B[:, None]) >> np.uint64(32)).min(axis=1)
+
+def band_buckets(signature):
+    """(band, bucket) of each LSH band: a signed 64-bit hash of its rows"""
+    return [(band, int.from_bytes(hashlib.blake2b(
+        signature[band * LSH_ROWS:(band + 1) * LSH_ROWS].tobytes(), digest_size=8
+    ).digest(), 'little', signed=True)) for band in range(LSH_BANDS)]
+
+class DuplicateDetector:
+    """
+    Near-duplicate invoice lookup. Each stored invoice keeps a MinHash
+    signature of its extracted text in invoice_signatures and one bucket per
+    LSH band in invoice_lsh_bands. A new invoice probes its LSH_BANDS
+    buckets on the band index (no pairwise comparison with the history) and
+    only the invoices sharing a bucket have their signatures compared.
+    Rescans, re-sends and re-numbered copies (INV-<timestamp> fallback
+    numbers) surface as possible_duplicate mismatches before approval.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.candidates = 0
+        self.flagged = 0
+        self.lookup_ms = 0.0
+        self.indexed = 0
+
+    def find(self, invoice_data, stored_id=None):
+        """
+        Stored invoices whose text is at least DUPLICATE_SIMILARITY_THRESHOLD
+        similar to this one, most similar first. For a new invoice a stored
+        one with the same number is always reported (same_number), whatever
+        its text, since saving would replace it. When re-validating stored
+        invoice stored_id, only invoices stored before it count: the first
+        copy is not a duplicate of a later re-send, nor of itself.
+        """
+        if not DUPLICATE_DETECTION:
+            return []
+        signature = minhash(invoice_data.get('raw_text'))
+        number = invoice_data.get('invoice_number') if stored_id is None else None
+        if signature is None and not number:
+            return []
+        started = time.perf_counter()
+        rows = []
+        with read_connection() as conn:
+            if signature is not None:
+                buckets = band_buckets(signature)
+                earlier_only = '' if stored_id is None else """
+                    AND s.invoice_id != ? AND EXISTS (
+                        SELECT 1 FROM invoices earlier
+                        WHERE earlier.invoice_id = s.invoice_id
+                        AND (earlier.created_at, earlier.rowid) < (SELECT created_at, rowid FROM invoices WHERE invoice_id = ?)
+                    )
+                """
+                # One primary-key probe per band (an OR of equalities; row-value IN scans)
+                rows = conn.execute(f"""
+                    SELECT s.invoice_id, s.total, s.signature FROM invoice_signatures s
+                    WHERE s.invoice_id IN (
+                        SELECT invoice_id FROM invoice_lsh_bands
+                        WHERE {' OR '.join(['(band = ? AND bucket = ?)'] * len(buckets))}
+                    ){earlier_only}
+                """, [value for bucket in buckets for value in bucket]
+                     + ([stored_id, stored_id] if stored_id is not None else [])).fetchall()
+            same_number = number and conn.execute("""
+                SELECT i.invoice_id, COALESCE(s.total, i.total), s.signature FROM invoices i
+                LEFT JOIN invoice_signatures s ON s.invoice_id = i.invoice_id
+                WHERE i.invoice_id = ?
+            """, (number,)).fetchone()
+
+        duplicates = []
+        if rows:
+            # Estimated Jaccard similarity: the share of equal MinHash values
+            stored = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.uint64).reshape(len(rows), -1)
+            similarities = (stored == signature).mean(axis=1)
+            for i in np.argsort(-similarities, kind='stable'):
+                if similarities[i] < DUPLICATE_SIMILARITY_THRESHOLD:
+                    break
+                duplicates.append({'invoice_id': rows[i][0], 'total': rows[i][1],
+                                   'similarity': round(float(similarities[i]), 3),
+                                   'same_number': rows[i][0] == number})
+        if same_number and not any(duplicate['same_number'] for duplicate in duplicates):
+            # A re-sent number whose text changed, or that has no text to compare
+            similarity = None
+            if signature is not None and same_number[2] is not None:
+                similarity = round(float((np.frombuffer(same_number[2], dtype=np.uint64) == signature).mean()), 3)
+            duplicates.insert(0, {'invoice_id': same_number[0], 'total': same_number[1],
+                                  'similarity': similarity, 'same_number': True})
+        with self._lock:
+            self.lookups += 1
+            self.candidates += len(rows)
+            self.flagged += 1 if duplicates else 0
+            self.lookup_ms += (time.perf_counter() - started) * 1000
+        return duplicates
+
+    def mismatches(self, invoice_data, stored_id=None):
+        """
+        possible_duplicate issues for validation: high severity when the
+        totals also agree, or when saving would replace a stored invoice
+        with the same number
+        """
+        issues = []
+        total = _amount(invoice_data.get('total'))
+        for duplicate in self.find(invoice_data, stored_id)[:MAX_REPORTED_DUPLICATES]:
+            same_total = (total is not None and duplicate['total'] is not None
+                          and abs(total - duplicate['total']) < 0.01)
+            similar = (f"{duplicate['similarity']:.0%} similar text" if duplicate['similarity'] is not None
+                       else 'text not compared')
+            if duplicate['same_number']:
+                message = (f"Invoice number {duplicate['invoice_id']} is already stored "
+                           f"({similar}{', same total' if same_total else ''}); saving replaces it")
+            else:
+                message = (f"Possible duplicate of invoice {duplicate['invoice_id']} "
+                           f"({similar}{', same total' if same_total else ''})")
+            issues.append({
+                'type': 'possible_duplicate',
+                'severity': 'high' if same_total or duplicate['same_number'] else 'medium',
+                'message': message,
+                'details': {
+                    'duplicate_invoice_id': duplicate['invoice_id'],
+                    'same_number': duplicate['same_number'],
+                    'similarity': duplicate['similarity'],
+                    'invoice_total': total,
+                    'duplicate_total': duplicate['total']
+                }
+            })
+        return issues
+
+    def add(self, invoice_id, invoice_data):
+        """Store (or replace) an invoice's signature and band buckets"""
+        signature = minhash(invoice_data.get('raw_text'))
+        if signature is None:
+            return False
+        conn = get_db_connection()
+        try:
+            self._store(conn, invoice_id, signature, _amount(invoice_data.get('total')))
+            conn.commit()
+        finally:
+            conn.close()
+        bump_data_version(['invoice_signatures', 'invoice_lsh_bands'], ['invoice_signatures', 'invoice_lsh_bands'])
+        with self._lock:
+            self.indexed += 1
+        return True
+
+    def backfill(self):
+        """Index stored invoices without a signature from the text kept in their validation result"""
+        if not DUPLICATE_DETECTION:
+            return 0
+        with read_connection() as conn:
+            rows = conn.execute("""
+                SELECT invoice_id, validation_result FROM invoices
+                WHERE invoice_id NOT IN (SELECT invoice_id FROM invoice_signatures)
+                AND validation_result LIKE '%"raw_text"%'
+            """).fetchall()
+        indexed = 0
+        conn = get_db_connection()
+        try:
+            for start in range(0, len(rows), BACKFILL_BATCH_SIZE):
+                for invoice_id, validation_result in rows[start:start + BACKFILL_BATCH_SIZE]:
+                    try:
+                        invoice_data = json.loads(validation_result).get('invoice_data') or {}
+                    except (TypeError, ValueError, AttributeError):
+                        continue
+                    signature = minhash(invoice_data.get('raw_text'))
+                    if signature is not None:
+                        self._store(conn, invoice_id, signature, _amount(invoice_data.get('total')))
+                        indexed += 1
+                conn.commit()
+        finally:
+            conn.close()
+        if indexed:
+            bump_data_version(['invoice_signatures', 'invoice_lsh_bands'])
+            logger.info(f"Indexed {indexed} stored invoices for duplicate detection")
+        with self._lock:
+            self.indexed += indexed
+        return indexed
+
+    @staticmethod
+    def _store(conn, invoice_id, signature, total):
+        """Write a signature and its band buckets, replacing the invoice's previous ones"""
+        conn.execute('DELETE FROM invoice_lsh_bands WHERE invoice_id = ?', (invoice_id,))
+        conn.execute('INSERT OR REPLACE INTO invoice_signatures (invoice_id, signature, total) VALUES (?, ?, ?)',
+                     (invoice_id, signature.tobytes(), total))
+        conn.executemany('INSERT OR IGNORE INTO invoice_lsh_bands (band, bucket, invoice_id) VALUES (?, ?, ?)',
+                         [(band, bucket, invoice_id) for band, bucket in band_buckets(signature)])
+
+    def get_stats(self):
+        """Get lookup counters and average lookup latency"""
+        with self._lock:
+            return {
+                'enabled': DUPLICATE_DETECTION,
+                'similarity_threshold': DUPLICATE_SIMILARITY_THRESHOLD,
+                'lsh_bands': LSH_BANDS,
+                'lsh_rows': LSH_ROWS,
+                'indexed': self.indexed,
+                'lookups': self.lookups,
+                'flagged': self.flagged,
+                'avg_candidates': round(self.candidates / self.lookups, 2) if self.lookups else 0.0,
+                'avg_lookup_ms': round(self.lookup_ms / self.lookups, 3) if self.lookups else 0.0
+            }
+
+def _amount(value):
+    """Invoice total as a float, or None when missing or unparseable"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+duplicate_detector = DuplicateDetector()
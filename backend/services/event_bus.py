@@ -0,0 +1,141 @@
+from collections import deque
+import json
+import queue
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Subscription:
+    """A single client's bounded view of the event stream"""
+
+    def __init__(self, max_queue_size):
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._lock = threading.Lock()
+        self.dropped_events = 0
+
+    def offer(self, event):
+        """
+        Queue an event without blocking the publisher.
+        A client that falls behind has its backlog replaced by a single
+        resync event so it refetches snapshots instead of stalling writers.
+        """
+        with self._lock:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self.dropped_events += self._queue.qsize() + 1
+                while True:
+                    try:
+                        self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                self._queue.put_nowait({
+                    'id': event['id'],
+                    'event': 'resync',
+                    'data': {'reason': 'client_lagging'}
+                })
+
+    def next_event(self, timeout):
+        """Wait for the next event; returns None on timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventBus:
+    """
+    In-process pub/sub bus for leaderboard and activity updates.
+    Recent events are kept in a bounded ring buffer so reconnecting clients
+    can replay what they missed using Last-Event-ID.
+    """
+
+    def __init__(self, buffer_size=1000, client_queue_size=200):
+        self.client_queue_size = client_queue_size
+        self._buffer = deque(maxlen=buffer_size)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def publish(self, event_type, data):
+        """Publish an event to all connected subscribers"""
+        with self._lock:
+            event = {'id': self._next_id, 'event': event_type, 'data': data}
+            self._next_id += 1
+            self._buffer.append(event)
+            subscribers = list(self._subscribers)
+
+        for subscription in subscribers:
+            subscription.offer(event)
+
+        return event['id']
+
+    def subscribe(self, last_event_id=None):
+        """
+        Register a new subscriber, replaying buffered events newer than
+        last_event_id. If the requested id has already been evicted from the
+        ring buffer, or was never issued by this bus (e.g. it predates a
+        restart, which starts ids again at 1), the client is told to resync
+        instead.
+        """
+        subscription = Subscription(self.client_queue_size)
+
+        with self._lock:
+            self._subscribers.add(subscription)
+
+            if last_event_id is not None:
+                oldest_id = self._buffer[0]['id'] if self._buffer else self._next_id
+                reason = None
+                try:
+                    last_event_id = int(last_event_id)
+                except (TypeError, ValueError):
+                    reason = 'unknown_event_id'
+                else:
+                    if last_event_id > self._next_id - 1:
+                        reason = 'unknown_event_id'
+                    elif last_event_id < oldest_id - 1:
+                        reason = 'replay_window_exceeded'
+
+                if reason:
+                    subscription.offer({
+                        'id': self._next_id - 1,
+                        'event': 'resync',
+                        'data': {'reason': reason}
+                    })
+                else:
+                    for event in self._buffer:
+                        if event['id'] > last_event_id:
+                            subscription.offer(event)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscriber"""
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def get_stats(self):
+        """Get bus statistics"""
+        with self._lock:
+            return {
+                'subscribers': len(self._subscribers),
+                'buffered_events': len(self._buffer),
+                'last_event_id': self._next_id - 1
+            }
+
+def format_sse(event):
+    """Format an event as a Server-Sent Events message"""
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+
+event_bus = EventBus()
+
+# Convenience function for write paths
+def publish_event(event_type, data):
+    """Publish an event, never letting a bus failure break the caller"""
+    try:
+        return event_bus.publish(event_type, data)
+    except Exception as e:
+        logger.error(f"Error publishing {event_type} event: {str(e)}")
+        return None
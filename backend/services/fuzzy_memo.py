@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from rapidfuzz import fuzz, process
+import os
+import threading
+
+# Memoized fuzzy lookups kept process-wide (0 disables)
+FUZZY_MEMO_SIZE = int(os.environ.get('FUZZY_MEMO_SIZE', 50000))
+
+def normalize_text(text):
+    """Memo key form of a string: lower-cased, whitespace-collapsed"""
+    return ' '.join((text or '').lower().split())
+
+class FuzzyMemo:
+    """
+    Process-wide LRU memo of one-to-many fuzzy lookups, keyed by normalized
+    (scorer, query, cutoff, choices version). Validators are created per
+    request, so an unseen vendor spelling would otherwise be matched against
+    every alias again on each upload (and twice per validation: candidate
+    retrieval, then scoring); with the memo a repeat costs a dict lookup.
+    Callers pass a version that changes whenever their choices do, so stale
+    results are never returned and simply age out.
+
+    Single pairs are not memoized: rapidfuzz scores a short pair faster than
+    a Python dict lookup finds it.
+    """
+
+    def __init__(self, max_entries=FUZZY_MEMO_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def extract(self, query, choices, version, score_cutoff=0, scorer=fuzz.ratio):
+        """
+        (index, score) of every choice scoring at least score_cutoff against
+        the query, best first. version identifies the choices list.
+        """
+        query = normalize_text(query)
+        key = (scorer, query, score_cutoff, version)
+        if self.max_entries:
+            with self._lock:
+                matches = self._entries.get(key)
+                if matches is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return matches
+
+        matches = tuple((index, float(score)) for _, score, index in process.extract(
+            query, choices, scorer=scorer, score_cutoff=score_cutoff, limit=None
+        ))
+        if self.max_entries:
+            with self._lock:
+                self.misses += 1
+                self._entries[key] = matches
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return matches
+
+    def get_stats(self):
+        """Get memo size and hit/miss statistics"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0
+            }
+
+fuzzy_memo = FuzzyMemo()
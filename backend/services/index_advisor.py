@@ -0,0 +1,348 @@
+from models.db_setup import read_connection
+from services.plan_recorder import query_shape, table_aliases
+import os
+import re
+import sqlite3
+import statistics
+import tempfile
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HISTORY_LIMIT = 5000          # Most recent query_history rows aggregated
+REPLAY_RUNS = 3               # Timed runs per query (median is used)
+REPLAY_TIME_BUDGET_MS = 10000     # Per timed run
+REPLAY_TOTAL_BUDGET_MS = 60000    # Per advise() call; later candidates are left untimed
+MAX_COVERING_COLUMNS = 5
+MIN_IMPROVEMENT = 0.1         # Indexes must cut replay time by at least 10%
+
+_IDENTIFIER = r'(?:"?(\w+)"?\.)?"?(\w+)"?'
+_EQUALITY_PATTERN = re.compile(_IDENTIFIER + r'\s*(?:=|\bIN\b|\bIS\b)', re.IGNORECASE)
+_RANGE_PATTERN = re.compile(_IDENTIFIER + r'\s*(?:<=|>=|<|>|\bBETWEEN\b|\bLIKE\b)', re.IGNORECASE)
+_JOIN_RIGHT_PATTERN = re.compile(r'=\s*' + _IDENTIFIER)
+_CLAUSE_PATTERN = re.compile(
+    r'\b(WHERE|ON|GROUP BY|ORDER BY|HAVING|LIMIT|UNION|JOIN)\b', re.IGNORECASE
+)
+
+def aggregate_query_shapes(min_count=2, limit=10, history_limit=HISTORY_LIMIT):
+    """
+    Group recent query_history by query shape and rank recurring shapes by
+    total execution time. Full-scan flags come from captured query plans.
+    """
+    with read_connection() as conn:
+        history = conn.execute("""
+            SELECT sql_query, execution_time
+            FROM query_history
+            ORDER BY created_at DESC
+            LIMIT ?
+        """, (history_limit,)).fetchall()
+        plans = conn.execute("""
+            SELECT query_shape, MAX(full_scan) AS full_scan,
+                   GROUP_CONCAT(full_scan_tables) AS full_scan_tables
+            FROM query_plans
+            GROUP BY query_shape
+        """).fetchall()
+
+    full_scans = {
+        row['query_shape']: sorted({table for table in (row['full_scan_tables'] or '').split(',') if table})
+        for row in plans if row['full_scan']
+    }
+
+    shapes = {}
+    for row in history:
+        shape = query_shape(row['sql_query'])
+        entry = shapes.setdefault(shape, {
+            'query_shape': shape,
+            'sample_sql': row['sql_query'],  # Most recent instance
+            'count': 0,
+            'total_time_ms': 0.0,
+            'max_time_ms': 0.0
+        })
+        time_ms = (row['execution_time'] or 0) * 1000
+        entry['count'] += 1
+        entry['total_time_ms'] += time_ms
+        entry['max_time_ms'] = max(entry['max_time_ms'], time_ms)
+
+    recurring = [entry for entry in shapes.values() if entry['count'] >= min_count]
+    recurring.sort(key=lambda entry: entry['total_time_ms'], reverse=True)
+
+    for entry in recurring:
+        entry['avg_time_ms'] = round(entry['total_time_ms'] / entry['count'], 3)
+        entry['total_time_ms'] = round(entry['total_time_ms'], 3)
+        entry['max_time_ms'] = round(entry['max_time_ms'], 3)
+        entry['full_scan_tables'] = full_scans.get(entry['query_shape'], [])
+    return recurring[:limit]
+
+def _columns_read(conn, sql_query):
+    """{table: [columns]} the statement reads, as reported by the authorizer"""
+    reads = {}
+
+    def track_reads(action, arg1, arg2, db_name, trigger_name):
+        if action == sqlite3.SQLITE_READ and arg1 and arg2:
+            columns = reads.setdefault(arg1, [])
+            if arg2 not in columns:
+                columns.append(arg2)
+        return sqlite3.SQLITE_OK
+
+    conn.set_authorizer(track_reads)
+    try:
+        conn.execute('EXPLAIN ' + sql_query).fetchall()
+    finally:
+        conn.set_authorizer(None)
+    return reads
+
+def _clauses(sql_query):
+    """Split a statement into (keyword, text) clauses"""
+    parts = _CLAUSE_PATTERN.split(sql_query)
+    return [(parts[i].upper(), parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+def candidate_indexes(conn, sql_query):
+    """
+    Propose indexes for one statement: equality columns first, then one
+    range column (or the GROUP BY/ORDER BY columns), plus a covering variant
+    that also carries the other columns the statement reads.
+    Returns a list of (table, columns) tuples.
+    """
+    reads = _columns_read(conn, sql_query)
+    aliases = table_aliases(sql_query)
+
+    def resolve(qualifier, column):
+        if qualifier:
+            table = aliases.get(qualifier.lower())
+            return (table, column) if table and column in reads.get(table, []) else None
+        owners = [table for table, columns in reads.items() if column in columns]
+        return (owners[0], column) if len(owners) == 1 else None
+
+    equality, ranges, ordering = {}, {}, {}
+    for keyword, text in _clauses(sql_query):
+        if keyword in ('WHERE', 'ON', 'HAVING'):
+            patterns = [(_EQUALITY_PATTERN, equality), (_RANGE_PATTERN, ranges)]
+            if keyword == 'ON':
+                # Both sides of a join condition are lookup keys
+                patterns.append((_JOIN_RIGHT_PATTERN, equality))
+            for pattern, target in patterns:
+                for qualifier, column in pattern.findall(text):
+                    resolved = resolve(qualifier, column)
+                    if resolved and resolved[1] not in target.setdefault(resolved[0], []):
+                        target[resolved[0]].append(resolved[1])
+        elif keyword in ('GROUP BY', 'ORDER BY'):
+            for qualifier, column in re.findall(_IDENTIFIER, text):
+                resolved = resolve(qualifier, column)
+                if resolved and resolved[1] not in ordering.setdefault(resolved[0], []):
+                    ordering[resolved[0]].append(resolved[1])
+
+    candidates = []
+    for table, columns in reads.items():
+        key = list(equality.get(table, []))
+        range_columns = [column for column in ranges.get(table, []) if column not in key]
+        if range_columns:
+            key.append(range_columns[0])
+        else:
+            key.extend(column for column in ordering.get(table, []) if column not in key)
+        if not key:
+            continue
+
+        candidates.append((table, tuple(key)))
+        covering = key + [column for column in columns if column not in key]
+        if len(covering) > len(key) and len(covering) <= MAX_COVERING_COLUMNS:
+            candidates.append((table, tuple(covering)))
+    return candidates
+
+def _existing_index_prefixes(conn):
+    """Column lists of indexes that already exist, per table"""
+    prefixes = {}
+    for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+        for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+            columns = tuple(row[2] for row in conn.execute(f'PRAGMA index_info("{index[1]}")'))
+            prefixes.setdefault(table, []).append(columns)
+    return prefixes
+
+def _timed_run(conn, sql_query, runs=REPLAY_RUNS, replay_deadline=None):
+    """
+    Median wall time in ms of fully executing a statement, or None when the
+    overall replay deadline cut the runs short
+    """
+    timings = []
+    for _ in range(runs):
+        deadline = time.monotonic() + REPLAY_TIME_BUDGET_MS / 1000.0
+        if replay_deadline is not None:
+            if time.monotonic() >= replay_deadline:
+                return None
+            deadline = min(deadline, replay_deadline)
+        conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 1000)
+        start = time.perf_counter()
+        try:
+            for _ in conn.execute(sql_query):
+                pass
+        except sqlite3.OperationalError:
+            pass  # Budget exceeded: the capped time is still comparable
+        finally:
+            conn.set_progress_handler(None, 0)
+        timings.append((time.perf_counter() - start) * 1000)
+    if replay_deadline is not None and time.monotonic() >= replay_deadline:
+        return None
+    return statistics.median(timings)
+
+def _create_index(conn, create_sql, replay_deadline):
+    """Build a candidate index on the scratch copy unless the replay deadline passes first"""
+    conn.set_progress_handler(lambda: 1 if time.monotonic() > replay_deadline else 0, 1000)
+    try:
+        conn.execute(create_sql)
+        return True
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.set_progress_handler(None, 0)
+
+def make_scratch_copy(path=None):
+    """Copy the live database to a scratch file with the online backup API"""
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix='index_advisor_', suffix='.db')
+        os.close(handle)
+    scratch = sqlite3.connect(path)
+    with read_connection() as conn:
+        conn.backup(scratch)
+    return scratch, path
+
+def advise(min_count=2, limit=10, replay=True, scratch_path=None, replay_budget_ms=REPLAY_TOTAL_BUDGET_MS):
+    """
+    Build the index advice report for the slowest recurring query shapes.
+    With replay=True every candidate index is created on a scratch copy of
+    the database and each affected query is timed with and without it, for
+    at most replay_budget_ms in total; candidates left over are reported
+    untimed and the report is marked replay_truncated.
+    """
+    shapes = aggregate_query_shapes(min_count=min_count, limit=limit)
+    report = {'query_shapes': shapes, 'recommendations': [], 'replayed': replay, 'replay_truncated': False}
+    if not shapes:
+        return report
+
+    keep_scratch = scratch_path is not None
+    if replay:
+        conn, scratch_path = make_scratch_copy(scratch_path)
+        replay_deadline = time.monotonic() + replay_budget_ms / 1000.0
+    else:
+        conn = None
+
+    try:
+        with read_connection() as live:
+            existing = _existing_index_prefixes(live)
+            candidates = {}
+            for shape in shapes:
+                try:
+                    proposed = candidate_indexes(live, shape['sample_sql'])
+                except sqlite3.Error as e:
+                    shape['error'] = str(e)
+                    continue
+                for table, columns in proposed:
+                    if any(prefix[:len(columns)] == columns for prefix in existing.get(table, [])):
+                        continue  # An existing index already leads with these columns
+                    candidates.setdefault((table, columns), []).append(shape)
+
+        if replay:
+            for shape in shapes:
+                if 'error' not in shape:
+                    baseline_ms = _timed_run(conn, shape['sample_sql'], replay_deadline=replay_deadline)
+                    if baseline_ms is None:
+                        report['replay_truncated'] = True
+                        break
+                    shape['baseline_ms'] = round(baseline_ms, 3)
+
+        for (table, columns), affected in candidates.items():
+            name = f"idx_{table}_{'_'.join(columns)}"
+            recommendation = {
+                'table': table,
+                'columns': list(columns),
+                'create_sql': f'CREATE INDEX {name} ON {table} ({", ".join(columns)})',
+                'query_shapes': [shape['query_shape'] for shape in affected],
+                'full_scan_fixed': any(table in shape['full_scan_tables'] for shape in affected)
+            }
+
+            if replay:
+                impacts = []
+                # Once the replay budget is spent, building the index is not worth it either
+                timed = [shape for shape in affected if 'baseline_ms' in shape] if not report['replay_truncated'] else []
+                if timed and not _create_index(conn, recommendation['create_sql'], replay_deadline):
+                    report['replay_truncated'] = True
+                    timed = []
+                for shape in timed:
+                    plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + shape['sample_sql'])]
+                    indexed_ms = _timed_run(conn, shape['sample_sql'], replay_deadline=replay_deadline)
+                    if indexed_ms is None:
+                        report['replay_truncated'] = True
+                        break
+                    impacts.append({
+                        'query_shape': shape['query_shape'],
+                        'uses_index': any(name in line for line in plan),
+                        'baseline_ms': shape['baseline_ms'],
+                        'indexed_ms': round(indexed_ms, 3),
+                        'estimated_saved_ms': round((shape['baseline_ms'] - indexed_ms) * shape['count'], 3)
+                    })
+                if timed:
+                    conn.execute(f'DROP INDEX {name}')
+
+                used = [impact for impact in impacts if impact['uses_index']]
+                recommendation['impact'] = impacts
+                recommendation['estimated_saved_ms'] = round(sum(impact['estimated_saved_ms'] for impact in used), 3)
+                recommendation['recommended'] = any(
+                    impact['baseline_ms'] > 0
+                    and impact['indexed_ms'] <= impact['baseline_ms'] * (1 - MIN_IMPROVEMENT)
+                    for impact in used
+                )
+            report['recommendations'].append(recommendation)
+
+        if replay:
+            report['recommendations'].sort(key=lambda rec: (rec['recommended'], rec['estimated_saved_ms']), reverse=True)
+        return report
+    finally:
+        if conn is not None:
+            conn.close()
+            if not keep_scratch:
+                os.remove(scratch_path)
+
+def _print_report(report):
+    """Human-readable advisor report for the CLI"""
+    print(f"Recurring query shapes: {len(report['query_shapes'])}")
+    print("=" * 70)
+    for shape in report['query_shapes']:
+        scans = f" full scan: {', '.join(shape['full_scan_tables'])}" if shape['full_scan_tables'] else ''
+        baseline = f" replay {shape['baseline_ms']}ms" if 'baseline_ms' in shape else ''
+        print(f"{shape['count']:>5}x avg {shape['avg_time_ms']}ms{baseline}{scans}")
+        print(f"       {shape['query_shape']}")
+
+    print("\nIndex candidates:")
+    print("=" * 70)
+    for rec in report['recommendations']:
+        verdict = ''
+        if report['replayed']:
+            verdict = 'RECOMMENDED ' if rec['recommended'] else 'no gain     '
+            verdict += f"saves ~{rec['estimated_saved_ms']}ms  "
+        print(f"{verdict}{rec['create_sql']}")
+        for impact in rec.get('impact', []):
+            print(f"    {impact['baseline_ms']}ms -> {impact['indexed_ms']}ms"
+                  f"{'' if impact['uses_index'] else ' (index not used)'}  {impact['query_shape'][:80]}")
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Propose indexes for slow recurring queries')
+    parser.add_argument('--min-count', type=int, default=2, help='Minimum occurrences of a query shape')
+    parser.add_argument('--limit', type=int, default=10, help='Number of query shapes to analyze')
+    parser.add_argument('--no-replay', action='store_true', help='Skip timing candidates on a scratch copy')
+    parser.add_argument('--scratch', help='Keep the scratch copy at this path')
+    parser.add_argument('--replay-budget-ms', type=int, default=REPLAY_TOTAL_BUDGET_MS,
+                        help='Total time allowed for timing candidates')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args()
+
+    result = advise(min_count=args.min_count, limit=args.limit,
+                    replay=not args.no_replay, scratch_path=args.scratch,
+                    replay_budget_ms=args.replay_budget_ms)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        _print_report(result)
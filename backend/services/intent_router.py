@@ -0,0 +1,525 @@
+from collections import defaultdict
+from math import log, sqrt
+from models.db_setup import execute_read_query, get_table_versions
+import re
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Confidence at or above which a question is answered locally even when GPT-4
+# is available (if the intent also accounts for every word of it), and the
+# minimum confidence to answer locally at all
+HIGH_CONFIDENCE = 0.75
+MIN_CONFIDENCE = 0.45
+
+# Negations the templates cannot express ("not approved", "excluding ABC")
+# would be answered as their opposite, so such questions are never routed
+_NEGATION_PATTERN = re.compile(
+    r"\b(?:not|no|non|never|none|neither|nor|without|except|excluding|exclude|excludes|besides|"
+    r"other\s+than|apart\s+from|aside\s+from)\b|n't\b",
+    re.IGNORECASE
+)
+
+# Words naming each table; an intent only answers questions about its own
+TABLE_WORDS = {
+    'invoices': {'invoice', 'bill'},
+    'purchase_orders': {'purchase', 'po', 'order'},
+    'leaderboard': {'leaderboard', 'team'}
+}
+
+# Filler a question may contain besides an intent's own vocabulary
+STOPWORDS = {
+    'a', 'an', 'the', 'of', 'for', 'from', 'in', 'on', 'at', 'by', 'to', 'with', 'me', 'us', 'we', 'our',
+    'i', 'my', 'you', 'show', 'give', 'get', 'find', 'display', 'what', 'which', 'is', 'are', 'was', 'were',
+    'be', 'been', 'do', 'does', 'did', 'have', 'has', 'had', 'all', 'each', 'every', 'per', 'please',
+    'can', 'could', 'there', 'status'
+}
+
+INVOICE_STATUSES = ('approved', 'rejected', 'pending')
+
+# Canned intents. Each has keyword groups (one word from every group should
+# appear), example phrasings for similarity scoring, and a SQL template with
+# {where} and {limit} slots filled from parameters found in the question.
+INTENTS = [
+    {
+        'name': 'spend_by_vendor',
+        'table': 'purchase_orders',
+        'keywords': [['spend', 'spending', 'spent', 'cost', 'expense'], ['vendor', 'supplier']],
+        'examples': [
+            'total spend per vendor',
+            'show me total spend per vendor this quarter',
+            'top vendors by spend',
+            'what are the top 10 vendors by spending',
+            'how much did we spend with each vendor'
+        ],
+        'sql': 'SELECT vendor, SUM(total) as total_spend FROM purchase_orders{where} GROUP BY vendor ORDER BY total_spend DESC{limit}',
+        'filters': ['date', 'vendor', 'amount'],
+        'top_default': 10
+    },
+    {
+        'name': 'leaderboard',
+        'table': 'leaderboard',
+        'keywords': [['leaderboard', 'ranking', 'rank', 'standing', 'team', 'score']],
+        'examples': [
+            'show me the leaderboard',
+            'show me the current leaderboard',
+            'top teams',
+            'team rankings by score'
+        ],
+        'sql': 'SELECT team_name, score, validations_completed, queries_executed FROM leaderboard ORDER BY score DESC{limit}',
+        'filters': []
+    },
+    {
+        'name': 'team_validations',
+        'table': 'leaderboard',
+        'keywords': [['team'], ['validation', 'validated', 'validate']],
+        'examples': [
+            'which team has completed the most validations',
+            'teams by validations completed',
+            'most validations by team'
+        ],
+        'sql': 'SELECT team_name, validations_completed FROM leaderboard ORDER BY validations_completed DESC{limit}',
+        'filters': []
+    },
+    {
+        'name': 'team_queries',
+        'table': 'leaderboard',
+        'keywords': [['team'], ['query', 'queries', 'question']],
+        'examples': [
+            'which team has executed the most queries',
+            'teams by queries executed',
+            'most queries by team'
+        ],
+        'sql': 'SELECT team_name, queries_executed FROM leaderboard ORDER BY queries_executed DESC{limit}',
+        'filters': []
+    },
+    {
+        'name': 'recent_invoices',
+        'table': 'invoices',
+        'keywords': [['invoice', 'bill'], ['recent', 'latest', 'newest', 'last']],
+        'examples': [
+            'what are the recent invoices',
+            'show me the latest invoices',
+            'recent invoices'
+        ],
+        'sql': 'SELECT invoice_id, vendor, total, date FROM invoices{where} ORDER BY created_at DESC{limit}',
+        'filters': ['date', 'vendor', 'amount', 'status'],
+        'default_limit': 10
+    },
+    {
+        'name': 'invoices_in_period',
+        'table': 'invoices',
+        'keywords': [['invoice', 'bill']],
+        'examples': [
+            'show me invoices from last month',
+            'invoices this year',
+            'list invoices over $1000',
+            'invoices from abc electronics',
+            'list invoices with status pending'
+        ],
+        'sql': 'SELECT invoice_id, vendor, item, total, date, status FROM invoices{where} ORDER BY date DESC{limit}',
+        'filters': ['date', 'vendor', 'amount', 'status'],
+        'requires_filter': True
+    },
+    {
+        'name': 'invoice_status_breakdown',
+        'table': 'invoices',
+        'keywords': [['invoice', 'bill'], ['status', 'approved', 'rejected', 'pending', 'breakdown']],
+        'examples': [
+            'how many invoices were approved',
+            'invoice status breakdown',
+            'count of invoices by status',
+            'how many invoices are rejected or pending'
+        ],
+        'sql': 'SELECT status, COUNT(*) as count FROM invoices{where} GROUP BY status ORDER BY count DESC',
+        'filters': ['date', 'vendor', 'status']
+    },
+    {
+        'name': 'invoice_totals',
+        'table': 'invoices',
+        'keywords': [['invoice', 'bill'], ['total', 'sum', 'count', 'many', 'number', 'value']],
+        'examples': [
+            'total of invoices from last month',
+            'how many invoices do we have',
+            'total value of invoices',
+            'number of invoices'
+        ],
+        'sql': 'SELECT COUNT(*) as invoice_count, SUM(total) as total_value FROM invoices{where}',
+        'filters': ['date', 'vendor', 'amount', 'status']
+    },
+    {
+        'name': 'average_invoice_value',
+        'table': 'invoices',
+        'keywords': [['average', 'avg', 'mean'], ['invoice', 'bill']],
+        'examples': [
+            'what is the average invoice value',
+            'average invoice amount',
+            'mean invoice total'
+        ],
+        'sql': 'SELECT AVG(total) as average_invoice_value FROM invoices{where}',
+        'filters': ['date', 'vendor', 'status']
+    },
+    {
+        'name': 'purchase_order_totals',
+        'table': 'purchase_orders',
+        'keywords': [['purchase', 'po'], ['total', 'count', 'many', 'number', 'value']],
+        'examples': [
+            'total purchase orders',
+            'how many purchase orders do we have',
+            'total value of purchase orders',
+            'number of purchase orders'
+        ],
+        'sql': 'SELECT COUNT(*) as total_pos, SUM(total) as total_value FROM purchase_orders{where}',
+        'filters': ['date', 'vendor']
+    },
+    {
+        'name': 'large_purchase_orders',
+        'table': 'purchase_orders',
+        'keywords': [['purchase', 'po', 'order'], ['over', 'above', 'exceeding', 'under', 'below', 'greater', 'less']],
+        'examples': [
+            'show me all purchase orders over $5000',
+            'purchase orders above 1000',
+            'orders below $100'
+        ],
+        'sql': 'SELECT po_id, vendor, item, qty, unit_price, total, date FROM purchase_orders{where} ORDER BY total DESC{limit}',
+        'filters': ['date', 'vendor', 'amount'],
+        'requires_filter': True
+    },
+    {
+        'name': 'average_order_value',
+        'table': 'purchase_orders',
+        'keywords': [['average', 'avg', 'mean'], ['order', 'po', 'purchase', 'value']],
+        'examples': [
+            'what is the average order value',
+            'what is the average purchase order value',
+            'average po value'
+        ],
+        'sql': 'SELECT AVG(total) as average_order_value FROM purchase_orders{where}',
+        'filters': ['date', 'vendor']
+    },
+    {
+        'name': 'vendor_order_count',
+        'table': 'purchase_orders',
+        'keywords': [['vendor', 'supplier'], ['count', 'many', 'number', 'order']],
+        'examples': [
+            'how many orders does each vendor have',
+            'vendor order count',
+            'number of orders per vendor'
+        ],
+        'sql': 'SELECT vendor, COUNT(*) as order_count FROM purchase_orders{where} GROUP BY vendor ORDER BY order_count DESC{limit}',
+        'filters': ['date', 'amount']
+    },
+    {
+        'name': 'top_items',
+        'table': 'purchase_orders',
+        'keywords': [['item', 'product', 'buy', 'bought', 'purchased'], ['most', 'frequent', 'frequently', 'top', 'popular', 'common']],
+        'examples': [
+            'what items do we buy most frequently',
+            'most purchased items',
+            'top items by quantity'
+        ],
+        'sql': 'SELECT item, COUNT(*) as order_count, SUM(qty) as total_qty FROM purchase_orders{where} GROUP BY item ORDER BY order_count DESC{limit}',
+        'filters': ['date', 'vendor'],
+        'top_default': 10
+    }
+]
+
+_MONTH_NAMES = ['january', 'february', 'march', 'april', 'may', 'june', 'july',
+                'august', 'september', 'october', 'november', 'december']
+
+def _tokenize(text):
+    """Lowercase word tokens with a crude plural strip"""
+    tokens = set()
+    for word in re.findall(r"[a-z0-9$]+", text.lower()):
+        tokens.add(word)
+        if len(word) > 3 and word.endswith('s'):
+            tokens.add(word[:-1])
+    return tokens
+
+def _char_ngrams(text, n=3):
+    """Character n-grams of the whitespace-collapsed text"""
+    text = ' ' + ' '.join(re.findall(r"[a-z0-9$]+", text.lower())) + ' '
+    return [text[i:i + n] for i in range(len(text) - n + 1)]
+
+def _quote(value):
+    """Render a string as a SQL literal"""
+    return "'" + str(value).replace("'", "''") + "'"
+
+class IntentRouter:
+    """
+    Local NL-to-SQL router.
+    A keyword inverted index selects candidate intents, which are ranked by
+    keyword-group coverage and char-trigram TF-IDF similarity to example
+    phrasings. Parameters (date range, vendor, amount, status, top-N) are
+    extracted from the question and rendered into the intent's SQL template.
+    Questions with a negation, about another table, or with a parameter the
+    template has no slot for are not routed; a match is 'complete' when the
+    intent's vocabulary accounts for every other word of the question.
+    """
+
+    def __init__(self, intents=None):
+        self.intents = intents or INTENTS
+        self._keyword_index = defaultdict(set)
+        for i, intent in enumerate(self.intents):
+            for group in intent['keywords']:
+                for keyword in group:
+                    self._keyword_index[keyword].add(i)
+
+        # IDF over all example phrasings
+        example_ngrams = [(i, _char_ngrams(example)) for i, intent in enumerate(self.intents)
+                          for example in intent['examples']]
+        document_frequency = defaultdict(int)
+        for _, ngrams in example_ngrams:
+            for ngram in set(ngrams):
+                document_frequency[ngram] += 1
+        total = len(example_ngrams)
+        self._idf = {ngram: log((1 + total) / (1 + count)) + 1 for ngram, count in document_frequency.items()}
+        self._default_idf = log(1 + total) + 1
+
+        self._example_vectors = defaultdict(list)
+        for i, ngrams in example_ngrams:
+            self._example_vectors[i].append(self._vectorize(ngrams))
+
+        # Words each intent understands: its keywords and its examples minus
+        # their parameter phrases (a date or amount is a parameter, not vocabulary)
+        self._vocabulary = {}
+        for intent in self.intents:
+            words = [keyword for group in intent['keywords'] for keyword in group]
+            for example in intent['examples']:
+                words.extend(_tokenize(self._extract(example, match_vendors=False)[1]))
+            self._vocabulary[intent['name']] = {word for word in _tokenize(' '.join(words))
+                                                if not any(c.isdigit() for c in word)}
+
+        self._vendors = []
+        self._vendors_version = None
+        self._lock = threading.Lock()
+
+    def _vectorize(self, ngrams):
+        """L2-normalized TF-IDF vector as a dict"""
+        counts = defaultdict(int)
+        for ngram in ngrams:
+            counts[ngram] += 1
+        vector = {ngram: count * self._idf.get(ngram, self._default_idf) for ngram, count in counts.items()}
+        norm = sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {ngram: weight / norm for ngram, weight in vector.items()}
+
+    def rank(self, natural_query, limit=3):
+        """Rank candidate intents for a question, best first"""
+        tokens = _tokenize(natural_query)
+        candidates = set()
+        for token in tokens:
+            candidates |= self._keyword_index.get(token, set())
+        if not candidates:
+            return []
+
+        query_vector = self._vectorize(_char_ngrams(natural_query))
+        ranked = []
+        for i in candidates:
+            intent = self.intents[i]
+            groups_hit = sum(1 for group in intent['keywords'] if tokens.intersection(group))
+            coverage = groups_hit / len(intent['keywords'])
+            similarity = max(
+                sum(weight * example.get(ngram, 0.0) for ngram, weight in query_vector.items())
+                for example in self._example_vectors[i]
+            )
+            # Small bonus for more specific intents (more keyword groups matched)
+            confidence = min(1.0, 0.5 * coverage + 0.5 * similarity + 0.03 * (groups_hit - 1))
+            ranked.append({'intent': intent, 'confidence': round(confidence, 3)})
+
+        ranked.sort(key=lambda candidate: candidate['confidence'], reverse=True)
+        return ranked[:limit]
+
+    def route(self, natural_query, min_confidence=MIN_CONFIDENCE):
+        """
+        Translate a question with the best-ranked intent that can express it,
+        preferring one that accounts for the whole question.
+        Returns a dict with sql_query, intent, confidence, parameters and
+        complete, or None.
+        """
+        if _NEGATION_PATTERN.search(natural_query):
+            return None
+        params, remainder = self._extract(natural_query)
+        tokens = _tokenize(natural_query)
+        tables = {table for table, words in TABLE_WORDS.items() if tokens & words}
+
+        best = None
+        for candidate in self.rank(natural_query):
+            if candidate['confidence'] < min_confidence:
+                break
+            intent = candidate['intent']
+            if tables and intent['table'] not in tables:
+                continue
+            # A filter or limit the template has no slot for would be dropped
+            if any(name not in intent['filters'] for name in params if name != 'top_n'):
+                continue
+            if 'top_n' in params and '{limit}' not in intent['sql']:
+                continue
+            if intent.get('requires_filter') and not any(name != 'top_n' for name in params):
+                continue
+            match = {
+                'sql_query': self._render(intent, params, natural_query),
+                'intent': intent['name'],
+                'confidence': candidate['confidence'],
+                'parameters': params,
+                'complete': self._explains(intent, remainder)
+            }
+            if match['complete']:
+                return match
+            best = best or match
+
+        return best
+
+    def _explains(self, intent, remainder):
+        """Whether every word left after parameter extraction is the intent's vocabulary or filler"""
+        vocabulary = self._vocabulary[intent['name']]
+        for word in re.findall(r"[a-z0-9$]+", remainder):
+            if word in vocabulary or word in STOPWORDS:
+                continue
+            if len(word) > 3 and word.endswith('s') and (word[:-1] in vocabulary or word[:-1] in STOPWORDS):
+                continue
+            return False
+        return True
+
+    def _render(self, intent, params, natural_query):
+        """Fill an intent's SQL template from extracted parameters"""
+        conditions = []
+        if 'date' in params:
+            conditions.extend(params['date'])
+        if 'vendor' in params:
+            conditions.append(f"vendor = {_quote(params['vendor'])}")
+        if 'amount' in params:
+            operator, amount = params['amount']
+            conditions.append(f"total {operator} {amount}")
+        if 'status' in params:
+            statuses = params['status']
+            conditions.append(f"status = {_quote(statuses[0])}" if len(statuses) == 1
+                              else f"status IN ({', '.join(_quote(status) for status in statuses)})")
+
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        limit_value = params.get('top_n') or intent.get('default_limit')
+        if not limit_value and intent.get('top_default') and re.search(r'\btop\b', natural_query, re.IGNORECASE):
+            limit_value = intent['top_default']
+        limit = f' LIMIT {int(limit_value)}' if limit_value else ''
+
+        return intent['sql'].format(where=where, limit=limit)
+
+    def extract_parameters(self, natural_query):
+        """Pull date range, vendor, amount, status and top-N parameters out of a question"""
+        return self._extract(natural_query)[0]
+
+    def _extract(self, natural_query, match_vendors=True):
+        """(parameters, the lower-cased question with each parameter's phrase blanked out)"""
+        text = natural_query.lower()
+        params = {}
+        spans = []
+
+        top_match = re.search(
+            r'\b(?:top|first|best|last|latest|newest|recent)\s+(\d{1,4})\b(?!\s+(?:day|week|month|year)s?\b)', text)
+        if top_match:
+            params['top_n'] = int(top_match.group(1))
+            spans.append(top_match.span())
+
+        date_conditions, date_span = self._extract_date_range(text)
+        if date_conditions:
+            params['date'] = date_conditions
+            spans.append(date_span)
+
+        amount_match = re.search(
+            r'\b(over|above|more than|greater than|exceeding|under|below|less than)\s+\$?\s*([\d,]+(?:\.\d+)?)', text)
+        if amount_match:
+            operator = '>' if amount_match.group(1) in ('over', 'above', 'more than', 'greater than', 'exceeding') else '<'
+            params['amount'] = (operator, float(amount_match.group(2).replace(',', '')))
+            spans.append(amount_match.span())
+
+        statuses = []
+        for status_match in re.finditer(r'\b(' + '|'.join(INVOICE_STATUSES) + r')\b(?:\s+or\b)?', text):
+            if status_match.group(1) not in statuses:
+                statuses.append(status_match.group(1))
+            spans.append(status_match.span())
+        if statuses:
+            params['status'] = statuses
+
+        vendor = self._match_vendor(text) if match_vendors else None
+        if vendor:
+            params['vendor'] = vendor
+            start = text.find(vendor.lower())
+            spans.append((start, start + len(vendor)))
+
+        for start, end in spans:
+            text = text[:start] + ' ' * (end - start) + text[end:]
+        return params, text
+
+    def _extract_date_range(self, text):
+        """
+        Translate relative and absolute date phrases into SQL conditions on
+        date. Returns (conditions, span of the phrase) or ([], None).
+        """
+        match = re.search(r'\b(?:last|past|previous)\s+(\d{1,4})\s+(day|week|month|year)s?\b', text)
+        if match:
+            count, unit = int(match.group(1)), match.group(2)
+            if unit == 'week':
+                count, unit = count * 7, 'day'
+            return [f"date >= date('now', '-{count} {unit}s')"], match.span()
+
+        match = re.search(r'\bbetween\s+(\d{4}-\d{2}-\d{2})\s+and\s+(\d{4}-\d{2}-\d{2})\b', text)
+        if match:
+            return [f"date >= '{match.group(1)}'", f"date <= '{match.group(2)}'"], match.span()
+
+        relative_ranges = [
+            (r'\b(?:this|current)\s+quarter\b', ["date >= date('now', '-3 months')"]),
+            (r'\blast\s+month\b', ["date >= date('now', 'start of month', '-1 month')",
+                                    "date < date('now', 'start of month')"]),
+            (r'\b(?:this|current)\s+month\b', ["date >= date('now', 'start of month')"]),
+            (r'\blast\s+year\b', ["date >= date('now', 'start of year', '-1 year')",
+                                   "date < date('now', 'start of year')"]),
+            (r'\b(?:this|current)\s+year\b', ["date >= date('now', 'start of year')"]),
+            (r'\b(?:this|last|past)\s+week\b', ["date >= date('now', '-7 days')"]),
+            (r'\btoday\b', ["date = date('now')"])
+        ]
+        for pattern, conditions in relative_ranges:
+            match = re.search(pattern, text)
+            if match:
+                return conditions, match.span()
+
+        match = re.search(r'\b(?:in|during)\s+(' + '|'.join(_MONTH_NAMES) + r')\s+(\d{4})\b', text)
+        if match:
+            month = _MONTH_NAMES.index(match.group(1)) + 1
+            start = f"{match.group(2)}-{month:02d}-01"
+            return [f"date >= '{start}'", f"date < date('{start}', '+1 month')"], match.span()
+
+        match = re.search(r'\b(?:in|during|for)\s+(\d{4})\b', text)
+        if match:
+            year = int(match.group(1))
+            return [f"date >= '{year}-01-01'", f"date < '{year + 1}-01-01'"], match.span()
+
+        return [], None
+
+    def _match_vendor(self, text):
+        """Find the longest known vendor name mentioned in the question"""
+        vendors = self._get_known_vendors()
+        best = None
+        for vendor in vendors:
+            if vendor.lower() in text and (best is None or len(vendor) > len(best)):
+                best = vendor
+        return best
+
+    def _get_known_vendors(self):
+        """Distinct vendor names, reloaded when purchase_orders changes"""
+        version = get_table_versions(['purchase_orders'])
+        if self._vendors_version != version:
+            with self._lock:
+                if self._vendors_version != version:
+                    try:
+                        rows = execute_read_query("SELECT DISTINCT vendor FROM purchase_orders")
+                        self._vendors = [row['vendor'] for row in rows if row['vendor'] and len(row['vendor']) > 2]
+                    except Exception as e:
+                        logger.error(f"Error loading vendor names: {str(e)}")
+                        self._vendors = []
+                    self._vendors_version = version
+        return self._vendors
+
+intent_router = IntentRouter()
@@ -0,0 +1,163 @@
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+import numpy as np
+import os
+import time
+
+LINE_MATCH_TIME_BUDGET_MS = float(os.environ.get('LINE_MATCH_TIME_BUDGET_MS', 200))
+
+# Cost weights: item name dissimilarity dominates, then relative qty and
+# unit price deltas (each capped at 1)
+ITEM_WEIGHT = 1.0
+QTY_WEIGHT = 0.3
+PRICE_WEIGHT = 0.3
+INFEASIBLE = 1e6   # Cost of pairs below the item similarity threshold
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+def build_cost_matrix(invoice_lines, po_lines, item_threshold):
+    """
+    Cost of assigning each invoice line (rows) to each PO line (columns),
+    plus the item similarity matrix. Pairs whose item similarity is below
+    item_threshold cost INFEASIBLE.
+    """
+    invoice_items = [(line.get('item') or '').lower() for line in invoice_lines]
+    po_items = [(line.get('item') or '').lower() for line in po_lines]
+    similarity = cdist(invoice_items, po_items, scorer=fuzz.ratio, dtype=np.float64, workers=-1)
+
+    invoice_qty = np.array([_number(line.get('qty')) for line in invoice_lines])[:, None]
+    invoice_price = np.array([_number(line.get('unit_price')) for line in invoice_lines])[:, None]
+    po_qty = np.array([_number(line.get('qty')) for line in po_lines])[None, :]
+    po_price = np.array([_number(line.get('unit_price')) for line in po_lines])[None, :]
+
+    qty_delta = np.minimum(np.abs(invoice_qty - po_qty) / np.maximum(po_qty, 1), 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        price_delta = np.where(po_price > 0, np.abs(invoice_price - po_price) / po_price, 1)
+    price_delta = np.minimum(price_delta, 1)
+
+    cost = ITEM_WEIGHT * (1 - similarity / 100) + QTY_WEIGHT * qty_delta + PRICE_WEIGHT * price_delta
+    cost[similarity < item_threshold] = INFEASIBLE
+    return cost, similarity
+
+def solve_assignment(cost, deadline=None):
+    """
+    Minimum-cost one-to-one assignment (Hungarian method with potentials,
+    O(n^2 m), inner steps vectorized over columns). Works on rectangular
+    matrices; returns (rows, columns) index arrays, or None if the deadline
+    (a time.monotonic() value) passes first.
+    """
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+
+    # 1-indexed with a dummy row/column 0, as in the textbook formulation
+    padded = np.zeros((n + 1, m + 1))
+    padded[1:, 1:] = cost
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    owner = np.zeros(m + 1, dtype=np.int64)   # Row assigned to each column (0 = none)
+    way = np.zeros(m + 1, dtype=np.int64)
+
+    for row in range(1, n + 1):
+        if deadline is not None and time.monotonic() > deadline:
+            return None
+        owner[0] = row
+        column = 0
+        min_reduced = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current_row = owner[column]
+            free = ~used
+            free[0] = False
+            reduced = padded[current_row] - u[current_row] - v
+            better = free & (reduced < min_reduced)
+            min_reduced[better] = reduced[better]
+            way[better] = column
+
+            candidates = np.where(free, min_reduced, np.inf)
+            next_column = int(np.argmin(candidates))
+            delta = candidates[next_column]
+
+            used_columns = np.nonzero(used)[0]
+            u[owner[used_columns]] += delta
+            v[used_columns] -= delta
+            min_reduced[free] -= delta
+
+            column = next_column
+            if owner[column] == 0:
+                break
+
+        # Flip the alternating path back to the root
+        while column:
+            previous = way[column]
+            owner[column] = owner[previous]
+            column = previous
+
+    columns = np.nonzero(owner[1:])[0]
+    rows = owner[1:][columns] - 1
+    if transposed:
+        rows, columns = columns, rows
+    order = np.argsort(rows)
+    return rows[order], columns[order]
+
+def greedy_assignment(cost):
+    """Cheapest-pair-first one-to-one assignment (the over-budget fallback)"""
+    rows, columns = [], []
+    used_rows, used_columns = set(), set()
+    limit = min(cost.shape)
+    for flat in np.argsort(cost, axis=None, kind='stable'):
+        row, column = divmod(int(flat), cost.shape[1])
+        if row in used_rows or column in used_columns:
+            continue
+        used_rows.add(row)
+        used_columns.add(column)
+        rows.append(row)
+        columns.append(column)
+        if len(rows) == limit:
+            break
+    order = np.argsort(rows)
+    return np.array(rows, dtype=np.int64)[order], np.array(columns, dtype=np.int64)[order]
+
+def match_lines(invoice_lines, po_lines, item_threshold, time_budget_ms=LINE_MATCH_TIME_BUDGET_MS):
+    """
+    Globally assign invoice lines to PO lines one-to-one by minimum total
+    cost (item similarity, qty and unit price deltas). Falls back to greedy
+    assignment when the optimal solve would exceed the time budget.
+    Returns {'pairs': [(line_index, po_index, item_similarity, cost)],
+    'unmatched_lines': [line_index], 'method', 'elapsed_ms'}.
+    """
+    start = time.monotonic()
+    if not invoice_lines or not po_lines:
+        return {'pairs': [], 'unmatched_lines': list(range(len(invoice_lines))),
+                'method': 'none', 'elapsed_ms': 0.0}
+
+    cost, similarity = build_cost_matrix(invoice_lines, po_lines, item_threshold)
+    feasible_rows = np.nonzero((cost < INFEASIBLE).any(axis=1))[0]
+    feasible_columns = np.nonzero((cost < INFEASIBLE).any(axis=0))[0]
+
+    method = 'optimal'
+    rows = columns = np.array([], dtype=np.int64)
+    if len(feasible_rows):
+        # Lines and PO lines with no feasible partner do not take part
+        reduced = cost[np.ix_(feasible_rows, feasible_columns)]
+        solved = solve_assignment(reduced, deadline=start + time_budget_ms / 1000.0)
+        if solved is None:
+            method = 'greedy'
+            solved = greedy_assignment(reduced)
+        rows, columns = feasible_rows[solved[0]], feasible_columns[solved[1]]
+
+    pairs = [(int(row), int(column), float(similarity[row, column]), float(cost[row, column]))
+             for row, column in zip(rows, columns) if cost[row, column] < INFEASIBLE]
+    assigned = {pair[0] for pair in pairs}
+    return {
+        'pairs': pairs,
+        'unmatched_lines': [i for i in range(len(invoice_lines)) if i not in assigned],
+        'method': method,
+        'elapsed_ms': round((time.monotonic() - start) * 1000, 3)
+    }
@@ -0,0 +1,123 @@
+from models.db_setup import execute_query, read_connection
+from services.result_cache import normalize_sql, _QUOTED_PATTERN
+import json
+import os
+import random
+import re
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PLAN_SAMPLE_RATE = float(os.environ.get('PLAN_SAMPLE_RATE', 0.1))
+PLAN_SLOW_QUERY_MS = float(os.environ.get('PLAN_SLOW_QUERY_MS', 250))
+
+_NUMBER_PATTERN = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_PATTERN = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_TABLE_ALIAS_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?(?!(?:WHERE|JOIN|INNER|LEFT|RIGHT|CROSS|NATURAL|ON|USING|GROUP|ORDER|LIMIT|UNION)\b)(\w+))?',
+    re.IGNORECASE
+)
+_FULL_SCAN_PATTERN = re.compile(r'^SCAN (?:TABLE )?"?(\w+)"?(?!.*\bUSING (?:COVERING )?INDEX\b)')
+
+def query_shape(sql_query):
+    """
+    Normalize a statement to its shape: literals become ?, IN lists collapse
+    and keywords are upper-cased, so the same query with different values
+    aggregates together.
+    """
+    parts = _QUOTED_PATTERN.split(normalize_sql(sql_query))
+    shaped = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            # Quoted identifiers stay, string literals become parameters
+            shaped.append('?' if part.startswith("'") else part)
+        else:
+            shaped.append(_NUMBER_PATTERN.sub('?', part).upper())
+    return _IN_LIST_PATTERN.sub('IN (?)', ''.join(shaped))
+
+def table_aliases(sql_query):
+    """Map table names and their aliases in FROM/JOIN clauses to table names"""
+    aliases = {}
+    for table, alias in _TABLE_ALIAS_PATTERN.findall(sql_query):
+        aliases[table.lower()] = table
+        if alias:
+            aliases[alias.lower()] = table
+    return aliases
+
+def explain_plan(sql_query, params=None):
+    """
+    Get (plan_lines, full_scan_tables) for a statement from EXPLAIN QUERY PLAN.
+    A full scan is a SCAN of a real table that uses no index.
+    """
+    with read_connection() as conn:
+        rows = conn.execute('EXPLAIN QUERY PLAN ' + sql_query, params or ()).fetchall()
+        known_tables = {row[0].lower(): row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"
+        )}
+
+    aliases = table_aliases(sql_query)
+    plan_lines = []
+    full_scans = []
+    for row in rows:
+        detail = row[3]
+        plan_lines.append(detail)
+        match = _FULL_SCAN_PATTERN.match(detail)
+        if match:
+            name = match.group(1).lower()
+            table = aliases.get(name) or known_tables.get(name)
+            if table and table.lower() in known_tables and table not in full_scans:
+                full_scans.append(table)
+    return plan_lines, full_scans
+
+class PlanRecorder:
+    """
+    Samples executed statements' query plans into the query_plans table.
+    Slow statements and shapes not seen before in this process are always
+    captured; the rest at PLAN_SAMPLE_RATE.
+    """
+
+    def __init__(self, sample_rate=PLAN_SAMPLE_RATE, slow_query_ms=PLAN_SLOW_QUERY_MS):
+        self.sample_rate = sample_rate
+        self.slow_query_ms = slow_query_ms
+        self._seen_shapes = set()
+        self._lock = threading.Lock()
+
+    def record(self, sql_query, execution_time_ms, source='nl'):
+        """Maybe capture the plan for an executed statement; returns the plan row or None"""
+        shape = query_shape(sql_query)
+        with self._lock:
+            first_seen = shape not in self._seen_shapes
+            if first_seen:
+                self._seen_shapes.add(shape)
+
+        if not (first_seen or execution_time_ms >= self.slow_query_ms or random.random() < self.sample_rate):
+            return None
+
+        try:
+            plan_lines, full_scans = explain_plan(sql_query)
+            plan = {
+                'query_shape': shape,
+                'sql_query': sql_query,
+                'plan': plan_lines,
+                'full_scan_tables': full_scans,
+                'execution_time_ms': round(execution_time_ms, 3),
+                'source': source
+            }
+            execute_query("""
+                INSERT INTO query_plans
+                (query_shape, sql_query, plan, full_scan, full_scan_tables, execution_time_ms, source)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (shape, sql_query, json.dumps(plan_lines), 1 if full_scans else 0,
+                  ','.join(full_scans), plan['execution_time_ms'], source))
+
+            if full_scans:
+                logger.info(f"Full table scan on {', '.join(full_scans)} ({execution_time_ms:.1f}ms): {shape}")
+            return plan
+        except Exception as e:
+            logger.error(f"Error capturing query plan: {str(e)}")
+            return None
+
+plan_recorder = PlanRecorder()
@@ -0,0 +1,282 @@
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+from models.db_setup import read_connection, get_table_versions, get_table_rewrites
+from services.vendor_resolver import vendor_resolver
+from services.po_prefilter import po_prefilter
+import numpy as np
+import os
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PO_CANDIDATE_RETRIEVAL = os.environ.get('PO_CANDIDATE_RETRIEVAL', '1').lower() not in ('0', 'false', 'no')
+PO_CANDIDATE_LIMIT = int(os.environ.get('PO_CANDIDATE_LIMIT', 50))       # Candidates per invoice line
+PO_CANDIDATE_POOL = PO_CANDIDATE_LIMIT * 10                               # Trigram hits re-ranked per line
+PO_EXHAUSTIVE_ROWS = int(os.environ.get('PO_EXHAUSTIVE_ROWS', 5000))     # Score everything below this
+# Trigrams in more than this share of PO items (up to a fixed cap) are too
+# common to narrow anything and are not read
+TRIGRAM_COMMON_FRACTION = 0.02
+TRIGRAM_DOCLIST_CAP = 20000
+MAX_QUERY_TRIGRAMS = 32
+
+def trigrams(text):
+    """Distinct lower-cased character trigrams, as the FTS5 trigram tokenizer sees them"""
+    text = (text or '').lower()
+    seen = []
+    for i in range(len(text) - 2):
+        gram = text[i:i + 3]
+        if gram not in seen:
+            seen.append(gram)
+    return seen
+
+class POCandidateIndex:
+    """
+    Fetches a small candidate set of PO rows for an invoice before the
+    validator scores anything. Vendors are blocked first to the canonical
+    vendors the invoice vendor resolves to (at the validator's vendor
+    threshold, so nothing scorable is lost); when those vendors hold more
+    than PO_EXHAUSTIVE_ROWS rows, each invoice line reads the
+    purchase_orders_fts doclists of its rare item trigrams, keeps the hits
+    under those vendors (an in-memory rowid -> vendor map), and re-ranks the
+    rows sharing the most trigrams down to PO_CANDIDATE_LIMIT. Lines made
+    only of common trigrams score the vendors' items straight from the
+    covering (vendor, item) index instead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._vendor_codes = {}                        # vendor -> code
+        self._vendor_names = []                        # code -> vendor
+        self._vendor_counts = []                       # code -> rows
+        self._row_vendors = np.empty(0, dtype=np.int32)  # rowid -> code (-1 for no row)
+        self._common_trigrams = set()
+        self._total_rows = 0
+        self._last_rowid = 0
+        self._version = None
+        self._rewrites = None
+        self.lookups = 0
+        self.exhaustive = 0
+        self.retrieved = 0
+        self.scanned = 0
+
+    def retrieves(self):
+        """Whether the PO table is large enough for candidate retrieval"""
+        if not PO_CANDIDATE_RETRIEVAL:
+            return False
+        self._refresh_vendors()
+        return self._total_rows > PO_EXHAUSTIVE_ROWS
+
+    def refresh(self):
+        """Load PO table changes now (e.g. after a bulk load) rather than on the next lookup"""
+        self._refresh_vendors()
+
+    def candidate_pos(self, invoice_data, vendor_threshold, bounds=None, trace=None):
+        """
+        PO rows worth scoring for this invoice (newest first), or None when
+        the whole table should be scored (retrieval off or table small).
+        bounds are po_prefilter bounds: the date window narrows the vendor
+        block through the (vendor, date) index, the amount band the rows.
+        """
+        if not self.retrieves():
+            return None
+
+        self.lookups += 1
+        invoice_vendor = (invoice_data.get('vendor') or '').strip().lower()
+        if not invoice_vendor:
+            return []   # Item similarity alone cannot reach the match score floor
+        vendor_ids = vendor_resolver.resolve(invoice_vendor, vendor_threshold)
+        with self._lock:
+            codes = [code for code, vendor_id in enumerate(vendor_resolver.lookup_many(self._vendor_names))
+                     if vendor_id in vendor_ids]
+            vendors = [self._vendor_names[code] for code in codes]
+            vendor_rows = sum(self._vendor_counts[code] for code in codes)
+            row_vendors = self._row_vendors
+            vendor_mask = np.zeros(len(self._vendor_names), dtype=bool)
+            vendor_mask[codes] = True
+        if not vendor_rows:
+            return []
+
+        bounds = bounds or {}
+        date_conditions, date_params = po_prefilter.conditions(bounds, ['date'])
+        amount_conditions, amount_params = po_prefilter.conditions(bounds, ['amount'])
+        vendor_filter = ' AND '.join([f"vendor IN ({', '.join('?' * len(vendors))})"] + date_conditions)
+        vendor_params = vendors + date_params
+        with read_connection() as conn:
+            if vendor_rows <= PO_EXHAUSTIVE_ROWS:
+                self.exhaustive += 1
+                rows = [dict(row) for row in conn.execute(f"""
+                    SELECT * FROM purchase_orders WHERE {vendor_filter} ORDER BY date DESC
+                """, vendor_params)]
+                if date_conditions:
+                    po_prefilter.record('date', vendor_rows, len(rows), trace)
+                return po_prefilter.apply(rows, bounds, ['amount'], trace)
+
+            allowed = None   # Sorted rowids of the vendors inside the date window
+            if date_conditions:
+                allowed = np.array([row[0] for row in conn.execute(
+                    f'SELECT rowid FROM purchase_orders WHERE {vendor_filter}', vendor_params
+                )], dtype=np.int64)
+                allowed.sort()
+                po_prefilter.record('date', vendor_rows, len(allowed), trace)
+
+            vendor_items = None   # (rowids, items) of the vendors, loaded only if a line needs it
+            rowids = set()
+            for line in invoice_data.get('line_items', []):
+                item = (line.get('item') or '').lower()
+                if not item:
+                    continue
+                line_rowids = self._line_candidates(conn, item, row_vendors, vendor_mask, allowed,
+                                                    amount_conditions, amount_params, trace)
+                if line_rowids is None:
+                    if vendor_items is None:
+                        vendor_items = self._vendor_items(conn, vendor_filter, vendor_params,
+                                                          amount_conditions, amount_params, trace)
+                        self.scanned += 1
+                    line_rowids = self._top_by_similarity(item, *vendor_items)
+                rowids.update(line_rowids)
+            if not rowids:
+                # No item to go on: the vendors' most recent POs
+                if allowed is None:
+                    allowed = np.flatnonzero((row_vendors >= 0) & vendor_mask[np.maximum(row_vendors, 0)])
+                rowids.update(int(rowid) for rowid in allowed[-PO_CANDIDATE_LIMIT:])
+
+            self.retrieved += 1
+            rows = [dict(row) for row in self._fetch(conn, 'SELECT * FROM purchase_orders', sorted(rowids))]
+        rows.sort(key=lambda row: row['date'], reverse=True)
+        return rows
+
+    def _line_candidates(self, conn, item, row_vendors, vendor_mask, allowed=None,
+                         amount_conditions=(), amount_params=(), trace=None):
+        """
+        Top rowids under the blocked vendors for one line: rows sharing the
+        most rare item trigrams, re-ranked by similarity. None when the rare
+        trigrams hit fewer than PO_CANDIDATE_LIMIT rows of those vendors.
+        allowed limits hits to the vendors' rows in the date window, and the
+        amount conditions are checked on the re-ranked pool.
+        """
+        cap = min(TRIGRAM_DOCLIST_CAP, max(PO_CANDIDATE_POOL, int(self._total_rows * TRIGRAM_COMMON_FRACTION)))
+        doclists = []
+        for gram in trigrams(item)[:MAX_QUERY_TRIGRAMS]:
+            if gram in self._common_trigrams:
+                continue
+            rowids = np.array([row[0] for row in conn.execute(
+                'SELECT rowid FROM purchase_orders_fts WHERE purchase_orders_fts MATCH ? LIMIT ?',
+                ('item : "' + gram.replace('"', '""') + '"', cap + 1)
+            )], dtype=np.int64)
+            if len(rowids) > cap:
+                self._common_trigrams.add(gram)
+            else:
+                doclists.append(rowids)
+        if not doclists:
+            return None
+
+        hits = np.concatenate(doclists)
+        hits = hits[hits < len(row_vendors)]   # Rows newer than the vendor map
+        codes = row_vendors[hits]
+        hits = hits[(codes >= 0) & vendor_mask[np.maximum(codes, 0)]]
+        if allowed is not None:
+            hits = hits[np.isin(hits, allowed)]
+        rowids, counts = np.unique(hits, return_counts=True)
+        if len(rowids) < PO_CANDIDATE_LIMIT:
+            return None   # Too few hits to fill the candidate set
+        pool = [int(rowid) for rowid in rowids[np.argsort(-counts, kind='stable')[:PO_CANDIDATE_POOL]]]
+        pool_rows = self._fetch(conn, 'SELECT rowid, item FROM purchase_orders', pool, amount_conditions, amount_params)
+        if amount_conditions:
+            po_prefilter.record('amount', len(pool), len(pool_rows), trace)
+        return self._top_by_similarity(item, [row[0] for row in pool_rows], [row[1] for row in pool_rows])
+
+    def _vendor_items(self, conn, vendor_filter, vendor_params, amount_conditions=(), amount_params=(), trace=None):
+        """(rowids, items) of the blocked vendors (in the date window and amount band, if any)"""
+        rows = conn.execute(f"""
+            SELECT rowid, item FROM purchase_orders WHERE {' AND '.join([vendor_filter, *amount_conditions])}
+        """, [*vendor_params, *amount_params]).fetchall()
+        if amount_conditions:
+            po_prefilter.record('amount', conn.execute(
+                f'SELECT COUNT(*) FROM purchase_orders WHERE {vendor_filter}', vendor_params
+            ).fetchone()[0], len(rows), trace)
+        return [row[0] for row in rows], [row[1] for row in rows]
+
+    @staticmethod
+    def _top_by_similarity(item, rowids, items):
+        """The PO_CANDIDATE_LIMIT rowids whose items are most similar to the line"""
+        if not items:
+            return []
+        scores = cdist([item], [text.lower() for text in items], scorer=fuzz.ratio,
+                       dtype=np.float64, workers=-1)[0]
+        return [rowids[i] for i in np.argsort(-scores, kind='stable')[:PO_CANDIDATE_LIMIT]]
+
+    @staticmethod
+    def _fetch(conn, select, rowids, conditions=(), params=()):
+        """Rows by rowid (and any extra conditions), in batches below SQLite's parameter limit"""
+        rows = []
+        for start in range(0, len(rowids), 500):
+            batch = rowids[start:start + 500]
+            where = ' AND '.join([f"rowid IN ({', '.join('?' * len(batch))})", *conditions])
+            rows.extend(conn.execute(f'{select} WHERE {where}', [*batch, *params]))
+        return rows
+
+    def _refresh_vendors(self):
+        """Keep the rowid -> vendor map current: appends load incrementally, rewrites reload"""
+        version = get_table_versions(['purchase_orders'])
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            start = time.monotonic()
+            rewrites = get_table_rewrites('purchase_orders')
+            if rewrites != self._rewrites:
+                self._vendor_codes = {}
+                self._vendor_names = []
+                self._vendor_counts = []
+                self._row_vendors = np.empty(0, dtype=np.int32)
+                self._common_trigrams = set()
+                self._total_rows = 0
+                self._last_rowid = 0
+            with read_connection() as conn:
+                groups = conn.execute("""
+                    SELECT vendor, MAX(rowid), group_concat(rowid) FROM purchase_orders
+                    WHERE rowid > ?
+                    GROUP BY vendor
+                """, (self._last_rowid,)).fetchall()
+            if groups:
+                last_rowid = max(group[1] for group in groups)
+                row_vendors = np.full(last_rowid + 1, -1, dtype=np.int32)
+                row_vendors[:len(self._row_vendors)] = self._row_vendors
+                for vendor, _, rowids in groups:
+                    code = self._vendor_codes.get(vendor)
+                    if code is None:
+                        code = self._vendor_codes[vendor] = len(self._vendor_names)
+                        self._vendor_names.append(vendor)
+                        self._vendor_counts.append(0)
+                    rowids = np.array(rowids.split(','), dtype=np.int64)
+                    row_vendors[rowids] = code
+                    self._vendor_counts[code] += len(rowids)
+                    self._total_rows += len(rowids)
+                self._row_vendors = row_vendors
+                self._last_rowid = last_rowid
+            self._version = version
+            self._rewrites = rewrites
+            elapsed = time.monotonic() - start
+            if elapsed > 0.1:
+                logger.info(f"PO vendor index refreshed: {len(self._vendor_names)} vendors, "
+                            f"{self._total_rows} rows in {elapsed:.2f}s")
+
+    def get_stats(self):
+        """Get retrieval counters"""
+        return {
+            'enabled': PO_CANDIDATE_RETRIEVAL,
+            'vendors': len(self._vendor_names),
+            'rows': self._total_rows,
+            'lookups': self.lookups,
+            'exhaustive_vendor_scans': self.exhaustive,
+            'trigram_retrievals': self.retrieved,
+            'vendor_item_scans': self.scanned,
+            'common_trigrams': len(self._common_trigrams)
+        }
+
+po_candidate_index = POCandidateIndex()
@@ -0,0 +1,264 @@
+from models.db_setup import get_db_connection, bump_data_version, create_po_indexes, drop_po_indexes, PO_LOADS
+from services.vendor_resolver import vendor_resolver
+from services.po_candidates import po_candidate_index
+from services.spend_cube import spend_cube, SPEND_CUBE_ENABLED
+from services.revalidation import revalidation_worker
+from datetime import datetime
+import csv
+import json
+import os
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000           # Rows per executemany upsert
+TRANSACTION_CHUNKS = 20              # Chunks per committed transaction
+MAX_REPORTED_ERRORS = 20
+FORMATS = {'.csv': 'csv', '.ndjson': 'ndjson', '.jsonl': 'ndjson'}
+REQUIRED_FIELDS = ('po_id', 'vendor', 'item', 'qty', 'unit_price', 'date')
+
+# Upsert on po_id that leaves unchanged rows alone (so a nightly full export
+# only writes what changed) and keeps the rowid, which purchase_orders_fts
+# and the in-memory PO indexes are keyed on (REPLACE would delete and
+# re-insert). A changed vendor name drops vendor_id for the resolver to
+# reassign.
+_UPSERT_SQL = """
+    INSERT INTO purchase_orders (po_id, vendor, item, qty, unit_price, total, date)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (po_id) DO UPDATE SET
+        vendor = excluded.vendor, item = excluded.item, qty = excluded.qty,
+        unit_price = excluded.unit_price, total = excluded.total, date = excluded.date,
+        vendor_id = CASE WHEN vendor = excluded.vendor THEN vendor_id END
+    WHERE vendor IS NOT excluded.vendor OR item IS NOT excluded.item OR qty IS NOT excluded.qty
+        OR unit_price IS NOT excluded.unit_price OR total IS NOT excluded.total OR date IS NOT excluded.date
+"""
+
+class POLoadBusy(RuntimeError):
+    """Raised when a bulk PO load is already in progress"""
+
+def detect_format(filename):
+    """Import format from a file name's extension"""
+    extension = os.path.splitext(filename or '')[1].lower()
+    if extension not in FORMATS:
+        raise ValueError(f"Unsupported PO export '{filename}': expected one of {', '.join(FORMATS)}")
+    return FORMATS[extension]
+
+def parse_po(record):
+    """purchase_orders row from one exported record (total defaults to qty * unit_price)"""
+    try:
+        po_id = str(record['po_id'] or '').strip()
+        vendor = ' '.join(str(record['vendor'] or '').split())
+        item = str(record['item'] or '').strip()
+        qty = int(float(record['qty']))
+        unit_price = float(record['unit_price'])
+        total = record.get('total')
+        total = float(total) if total not in (None, '') else round(qty * unit_price, 2)
+        date = str(record['date'] or '').strip()[:10]
+        # fromisoformat alone would also take YYYYMMDD
+        valid_date = len(date) == 10 and date[4] == '-' and date[7] == '-' and datetime.fromisoformat(date)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise ValueError(_record_error(record))
+    if not (po_id and vendor and item and valid_date):
+        raise ValueError(_record_error(record))
+    return po_id, vendor, item, qty, unit_price, total, date
+
+def _record_error(record):
+    """Why a record could not be loaded"""
+    if not isinstance(record, dict):
+        return 'Record is not an object'
+    missing = [field for field in REQUIRED_FIELDS if str(record.get(field) or '').strip() == '']
+    if missing:
+        return f"Missing {', '.join(missing)}"
+    for field in ('qty', 'unit_price', 'total'):
+        try:
+            float(record[field]) if record.get(field) not in (None, '') else None
+        except (TypeError, ValueError):
+            return f"{field} '{record[field]}' is not a number"
+    return f"Date '{record['date']}' is not YYYY-MM-DD"
+
+class POLoader:
+    """
+    Bulk loader for ERP purchase-order exports. Streams CSV or NDJSON,
+    upserts DEFAULT_CHUNK_SIZE rows per executemany and commits every
+    TRANSACTION_CHUNKS chunks. With defer_indexes the secondary indexes and
+    full-text sync triggers are dropped for the load and rebuilt once at the
+    end. Afterwards canonical vendors are assigned and the in-memory PO
+    indexes (candidate retrieval, spend cube) and invoice re-validation are
+    refreshed once, instead of once per row. The write versions it bumps are
+    shared through the database, so a running server catches up the same
+    way after a load from the CLI.
+    """
+
+    def __init__(self):
+        self._load_lock = threading.Lock()
+        self.loads = 0
+        self.last_report = None
+
+    def load(self, stream, data_format, chunk_size=DEFAULT_CHUNK_SIZE, defer_indexes=False, refresh=True):
+        """
+        Load a text stream of PO records and return a report with row counts
+        and rows per second. refresh=False skips the in-memory refresh (for
+        the CLI, whose process holds no indexes; servers pick the load up
+        from the shared write versions).
+        """
+        if data_format not in FORMATS.values():
+            raise ValueError(f"Unsupported format '{data_format}': expected csv or ndjson")
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be positive')
+        if not self._load_lock.acquire(blocking=False):
+            raise POLoadBusy('A purchase order load is already in progress')
+        try:
+            return self._load(stream, data_format, chunk_size, defer_indexes, refresh)
+        finally:
+            self._load_lock.release()
+
+    def _load(self, stream, data_format, chunk_size, defer_indexes, refresh):
+        start = time.monotonic()
+        report = {
+            'format': data_format,
+            'rows_read': 0,
+            'inserted': 0,
+            'updated': 0,
+            'unchanged': 0,
+            'rejected': 0,
+            'errors': [],
+            'chunks': 0,
+            'deferred_indexes': defer_indexes
+        }
+        conn = get_db_connection()
+        try:
+            before = conn.execute('SELECT COUNT(*) FROM purchase_orders').fetchone()[0]
+            if defer_indexes:
+                drop_po_indexes(conn.cursor())
+                conn.commit()
+            changed = 0
+            try:
+                chunk = []
+                for line_number, record in self._records(stream, data_format):
+                    report['rows_read'] += 1
+                    try:
+                        chunk.append(parse_po(record))
+                    except ValueError as e:
+                        report['rejected'] += 1
+                        if len(report['errors']) < MAX_REPORTED_ERRORS:
+                            report['errors'].append({'line': line_number, 'error': str(e)})
+                    if len(chunk) >= chunk_size:
+                        changed += self._upsert(conn, chunk, report, start)
+                        chunk = []
+                if chunk:
+                    changed += self._upsert(conn, chunk, report, start)
+                conn.commit()
+            except BaseException:
+                conn.rollback()
+                if report['chunks'] >= TRANSACTION_CHUNKS:
+                    # Earlier transactions stay committed
+                    bump_data_version(['purchase_orders', PO_LOADS], ['purchase_orders'])
+                raise
+            finally:
+                loaded_at = time.monotonic()
+                if defer_indexes:
+                    # Rows loaded while the triggers were gone are indexed here
+                    conn.execute("INSERT INTO purchase_orders_fts (purchase_orders_fts) VALUES ('rebuild')")
+                    create_po_indexes(conn.cursor())
+                    conn.commit()
+                report['index_seconds'] = round(time.monotonic() - loaded_at, 2)
+
+            report['inserted'] = conn.execute('SELECT COUNT(*) FROM purchase_orders').fetchone()[0] - before
+            report['updated'] = changed - report['inserted']
+            report['unchanged'] = report['rows_read'] - report['rejected'] - changed
+        finally:
+            conn.close()
+
+        if changed:
+            # Updated rows keep their rowid but may change vendor or item.
+            # The versions are shared, so a server's caches and PO indexes
+            # catch up with a CLI load too, and its re-validation worker
+            # notices the PO_LOADS bump.
+            bump_data_version(['purchase_orders', PO_LOADS], ['purchase_orders'] if report['updated'] else None)
+            vendor_resolver.sync()
+            if refresh:
+                self._refresh()
+
+        elapsed = time.monotonic() - start
+        report['elapsed_seconds'] = round(elapsed, 2)
+        report['rows_per_second'] = round(report['rows_read'] / elapsed) if elapsed else 0
+        self.loads += 1
+        self.last_report = report
+        logger.info(f"PO load: {report['rows_read']} rows in {elapsed:.1f}s ({report['rows_per_second']}/s), "
+                    f"{report['inserted']} inserted, {report['updated']} updated, "
+                    f"{report['unchanged']} unchanged, {report['rejected']} rejected")
+        return report
+
+    @staticmethod
+    def _records(stream, data_format):
+        """(line number, record dict) for each record in the stream"""
+        if data_format == 'csv':
+            reader = csv.DictReader(stream)
+            missing = [field for field in REQUIRED_FIELDS if field not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"CSV header is missing {', '.join(missing)}")
+            for record in reader:
+                yield reader.line_num, record
+            return
+        for line_number, line in enumerate(stream, start=1):
+            if line.strip():
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError:
+                    yield line_number, None   # Rejected by parse_po
+
+    @staticmethod
+    def _upsert(conn, chunk, report, start):
+        """Upsert one chunk, committing every TRANSACTION_CHUNKS chunks; returns rows written"""
+        changed = conn.executemany(_UPSERT_SQL, chunk).rowcount
+        report['chunks'] += 1
+        if report['chunks'] % TRANSACTION_CHUNKS == 0:
+            conn.commit()
+        elapsed = time.monotonic() - start
+        logger.info(f"PO load: {report['rows_read']} rows read "
+                    f"({report['rows_read'] / elapsed if elapsed else 0:.0f}/s)")
+        return changed
+
+    @staticmethod
+    def _refresh():
+        """Bring the in-memory PO indexes up to date once and re-validate open invoices"""
+        po_candidate_index.refresh()
+        if SPEND_CUBE_ENABLED:
+            spend_cube.sync()
+        revalidation_worker.pos_reloaded()
+
+po_loader = POLoader()
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    from models.db_setup import init_db
+
+    parser = argparse.ArgumentParser(description='Bulk load purchase orders from an ERP export')
+    parser.add_argument('path', help="CSV or NDJSON export ('-' reads standard input)")
+    parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                        help='Export format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows per upsert batch')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='Drop secondary indexes during the load and rebuild them at the end')
+    parser.add_argument('--json', action='store_true', help='Print the load report as JSON')
+    args = parser.parse_args()
+
+    init_db()
+    data_format = args.format or detect_format(args.path)
+    if args.path == '-':
+        result = po_loader.load(sys.stdin, data_format, args.chunk_size, args.defer_indexes, refresh=False)
+    else:
+        with open(args.path, newline='', encoding='utf-8-sig') as export:
+            result = po_loader.load(export, data_format, args.chunk_size, args.defer_indexes, refresh=False)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Loaded {result['rows_read']} rows in {result['elapsed_seconds']}s "
+              f"({result['rows_per_second']} rows/s): {result['inserted']} inserted, "
+              f"{result['updated']} updated, {result['unchanged']} unchanged, {result['rejected']} rejected")
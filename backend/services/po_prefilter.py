@@ -0,0 +1,149 @@
+from models.db_setup import read_connection
+from datetime import datetime, timedelta
+import os
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# How far back from the invoice date a PO may be dated (0 disables the filter)
+PO_DATE_WINDOW_DAYS = int(os.environ.get('PO_DATE_WINDOW_DAYS', 730))
+# POs dated shortly after the invoice stay candidates (flagged by date_warning)
+PO_DATE_GRACE_DAYS = int(os.environ.get('PO_DATE_GRACE_DAYS', 30))
+# PO line totals considered, as a +/- percentage around the invoice's line
+# totals and overall total (0 disables; partial deliveries need a wide band)
+PO_AMOUNT_BAND_PERCENTAGE = float(os.environ.get('PO_AMOUNT_BAND_PERCENTAGE', 0))
+FILTERS = ('date', 'amount')
+FILTER_COLUMNS = {'date': 'date', 'amount': 'total'}
+
+class POPrefilter:
+    """
+    Pre-filters that bound the POs an invoice is validated against before
+    any fuzzy scoring: a date window ending shortly after the invoice date
+    (a range scan on purchase_orders(date), or (vendor, date) once vendors
+    are blocked) and an optional amount band on PO line totals. Counts rows
+    in and out of each filter so the shrinkage shows up in
+    /api/invoices/validation-metrics.
+    """
+
+    def __init__(self, date_window_days=PO_DATE_WINDOW_DAYS, date_grace_days=PO_DATE_GRACE_DAYS,
+                 amount_band_percentage=PO_AMOUNT_BAND_PERCENTAGE):
+        self.date_window_days = date_window_days
+        self.date_grace_days = date_grace_days
+        self.amount_band_percentage = amount_band_percentage
+        self._lock = threading.Lock()
+        self._metrics = {name: {'validations': 0, 'rows_in': 0, 'rows_out': 0} for name in FILTERS}
+        self.validations = 0
+
+    def bounds(self, invoice_data):
+        """Inclusive (low, high) per filter for this invoice, None where a filter does not apply"""
+        bounds = {'date': None, 'amount': None}
+        if self.date_window_days > 0:
+            try:
+                invoice_date = datetime.strptime(str(invoice_data.get('date') or ''), '%Y-%m-%d')
+                bounds['date'] = ((invoice_date - timedelta(days=self.date_window_days)).strftime('%Y-%m-%d'),
+                                  (invoice_date + timedelta(days=self.date_grace_days)).strftime('%Y-%m-%d'))
+            except ValueError:
+                pass  # No usable invoice date: every PO date stays a candidate
+
+        if self.amount_band_percentage > 0:
+            amounts = []
+            for item in invoice_data.get('line_items', []):
+                try:
+                    amounts.append(float(item.get('total')))
+                except (TypeError, ValueError):
+                    pass
+            try:
+                amounts.append(float(invoice_data.get('total')))
+            except (TypeError, ValueError):
+                pass
+            amounts = [amount for amount in amounts if amount > 0]
+            if amounts:
+                band = self.amount_band_percentage / 100
+                bounds['amount'] = (round(min(amounts) * (1 - band), 2), round(max(amounts) * (1 + band), 2))
+        return bounds
+
+    def conditions(self, bounds, filters=FILTERS):
+        """SQL range conditions and parameters for the bounded filters"""
+        conditions = []
+        params = []
+        for name in filters:
+            if bounds.get(name):
+                conditions.append(f'{FILTER_COLUMNS[name]} BETWEEN ? AND ?')
+                params.extend(bounds[name])
+        return conditions, params
+
+    def apply(self, rows, bounds, filters=FILTERS, trace=None):
+        """Filter already-fetched PO rows in memory, recording each filter's shrinkage"""
+        for name in filters:
+            if not bounds.get(name):
+                continue
+            low, high = bounds[name]
+            column = FILTER_COLUMNS[name]
+            kept = [row for row in rows if row[column] is not None and low <= row[column] <= high]
+            self.record(name, len(rows), len(kept), trace)
+            rows = kept
+        return rows
+
+    def fetch_all(self, bounds, trace=None):
+        """
+        Every PO inside the bounds, newest first, and the unfiltered PO count.
+        The date window is an index range scan; the amount band is checked on
+        the rows it returns.
+        """
+        conditions, params = self.conditions(bounds, ['date'])
+        with read_connection() as conn:
+            total = conn.execute('SELECT COUNT(*) FROM purchase_orders').fetchone()[0]
+            rows = [dict(row) for row in conn.execute(f"""
+                SELECT * FROM purchase_orders
+                {'WHERE ' + ' AND '.join(conditions) if conditions else ''}
+                ORDER BY date DESC
+            """, params)]
+        if conditions:
+            self.record('date', total, len(rows), trace)
+        return self.apply(rows, bounds, ['amount'], trace), total
+
+    def record(self, name, rows_in, rows_out, trace=None):
+        """Count one filter pass (trace collects the same numbers for a single validation)"""
+        with self._lock:
+            metrics = self._metrics[name]
+            metrics['validations'] += 1
+            metrics['rows_in'] += rows_in
+            metrics['rows_out'] += rows_out
+        if trace is not None:
+            step = trace.setdefault(name, {'rows_in': 0, 'rows_out': 0})
+            step['rows_in'] += rows_in
+            step['rows_out'] += rows_out
+
+    def count_validation(self):
+        """Count a validation that went through the filters"""
+        with self._lock:
+            self.validations += 1
+
+    def get_metrics(self):
+        """Configuration and cumulative shrinkage of each filter"""
+        with self._lock:
+            filters = {}
+            for name, metrics in self._metrics.items():
+                filters[name] = dict(metrics)
+                filters[name]['shrink_percentage'] = (
+                    round((1 - metrics['rows_out'] / metrics['rows_in']) * 100, 2) if metrics['rows_in'] else 0.0
+                )
+            validations = self.validations
+        filters['date'].update({
+            'enabled': self.date_window_days > 0,
+            'window_days': self.date_window_days,
+            'grace_days': self.date_grace_days
+        })
+        filters['amount'].update({
+            'enabled': self.amount_band_percentage > 0,
+            'band_percentage': self.amount_band_percentage
+        })
+        return {
+            'validations': validations,
+            'filters': filters
+        }
+
+po_prefilter = POPrefilter()
@@ -1,5 +1,11 @@
 from rapidfuzz import fuzz, process
-from models.db_setup import execute_query
+from rapidfuzz.process import cdist
+from services.line_matcher import match_lines
+from services.po_candidates import po_candidate_index
+from services.po_prefilter import po_prefilter
+from services.duplicate_detector import duplicate_detector
+from services.vendor_resolver import vendor_resolver, normalize_vendor
+import numpy as np
 import json
 import logging
 from datetime import datetime
@@ -13,23 +19,37 @@ class POValidator:
         self.vendor_similarity_threshold = 80
         self.item_similarity_threshold = 75
         self.price_tolerance_percentage = 5  # 5% tolerance for price differences
+        self.max_candidate_po_lines = 500     # PO lines considered for line assignment
     
-    def validate_invoice_against_pos(self, invoice_data):
+    def validate_invoice_against_pos(self, invoice_data, pos=None, stored_id=None):
         """
         Validate an invoice against all purchase orders in the database
+        (or the given PO rows, to share one fetch across many invoices).
+        stored_id is the invoice's own id when re-validating a stored one.
         Returns a comprehensive validation report
         """
         try:
-            # Get all purchase orders from database
-            pos = execute_query("SELECT * FROM purchase_orders ORDER BY date DESC")
+            # Bound candidates by invoice date (and amount band, if enabled),
+            # narrow large PO tables to trigram-retrieved candidates first,
+            # otherwise get every purchase order inside the bounds
+            bounds = po_prefilter.bounds(invoice_data)
+            trace = {}
+            if pos is not None:
+                pos = po_prefilter.apply(pos, bounds, trace=trace)
+            else:
+                pos = po_candidate_index.candidate_pos(invoice_data, self.vendor_similarity_threshold,
+                                                       bounds, trace)
+            if pos is None:
+                pos, po_count = po_prefilter.fetch_all(bounds, trace)
             
-            if not pos:
-                return {
-                    'status': 'error',
-                    'message': 'No purchase orders found in database',
-                    'matches': [],
-                    'mismatches': []
-                }
+                if not po_count:
+                    return {
+                        'status': 'error',
+                        'message': 'No purchase orders found in database',
+                        'matches': [],
+                        'mismatches': []
+                    }
+            po_prefilter.count_validation()
             
             # Find potential matches
             matches = self._find_potential_matches(invoice_data, pos)
@@ -37,8 +57,13 @@ class POValidator:
             # Perform detailed validation
             validation_result = self._perform_detailed_validation(invoice_data, matches, pos)
             
+            # Flag likely duplicate payments of stored invoices before approval
+            # (of earlier ones only, when re-validating a stored invoice)
+            validation_result['mismatches'].extend(duplicate_detector.mismatches(invoice_data, stored_id))
+            
             # Generate summary
             validation_result['summary'] = self._generate_validation_summary(validation_result)
+            validation_result['candidate_filters'] = {'bounds': bounds, 'rows': trace}
             
             return validation_result
             
@@ -53,56 +78,51 @@ class POValidator:
     
     def _find_potential_matches(self, invoice_data, pos):
         """Find potential PO matches based on vendor and item similarity"""
-        potential_matches = []
-        
         invoice_vendor = (invoice_data.get('vendor') or '').strip()
         invoice_items = invoice_data.get('line_items', [])
+        item_names = [(item.get('item') or '').strip().lower() for item in invoice_items]
+        item_names = [name for name in item_names if name]
         
-        for po in pos:
-            match_score = 0
-            match_details = {
-                'po_id': po['po_id'],
-                'po_vendor': po['vendor'],
-                'po_item': po['item'],
-                'vendor_similarity': 0,
-                'item_similarity': 0,
-                'overall_score': 0,
-                'po_data': dict(po)
-            }
-            
-            # Check vendor similarity
-            if invoice_vendor:
-                vendor_similarity = fuzz.ratio(invoice_vendor.lower(), po['vendor'].lower())
-                match_details['vendor_similarity'] = vendor_similarity
-                
-                if vendor_similarity >= self.vendor_similarity_threshold:
-                    match_score += vendor_similarity * 0.6  # Vendor match is 60% of score
-            
-            # Check item similarity
-            best_item_similarity = 0
-            for invoice_item in invoice_items:
-                item_name = (invoice_item.get('item') or '').strip()
-                if item_name:
-                    item_similarity = fuzz.ratio(item_name.lower(), po['item'].lower())
-                    best_item_similarity = max(best_item_similarity, item_similarity)
-            
-            match_details['item_similarity'] = best_item_similarity
-            if best_item_similarity >= self.item_similarity_threshold:
-                match_score += best_item_similarity * 0.4  # Item match is 40% of score
-            
-            match_details['overall_score'] = match_score
-            
-            # Only include matches above a certain threshold
-            if match_score >= 50:  # Minimum 50% overall match
-                potential_matches.append(match_details)
+        # Vendor similarity per canonical vendor (an alias hit is exact), so
+        # each distinct PO vendor costs a dict lookup rather than a fuzzy match
+        vendor_similarity = np.zeros(len(pos))
+        if invoice_vendor:
+            vendor_scores = vendor_resolver.resolve(invoice_vendor, self.vendor_similarity_threshold)
+            names = list({po['vendor'] for po in pos})
+            by_name = {}
+            for name, vendor_id in zip(names, vendor_resolver.lookup_many(names)):
+                # Names without an alias yet are compared directly
+                by_name[name] = (vendor_scores.get(vendor_id, 0.0) if vendor_id is not None
+                                 else fuzz.ratio(normalize_vendor(invoice_vendor), normalize_vendor(name)))
+            vendor_similarity = np.array([by_name[po['vendor']] for po in pos], dtype=np.float64)
+        
+        # Similarity of the best invoice item to every PO at once
+        item_similarity = np.zeros(len(pos))
+        if item_names:
+            item_similarity = cdist(item_names, [po['item'].lower() for po in pos],
+                                    scorer=fuzz.ratio, dtype=np.float64, workers=-1).max(axis=0)
+        
+        # Vendor match is 60% of score, item match 40%, each only above its threshold
+        match_scores = (np.where(vendor_similarity >= self.vendor_similarity_threshold, vendor_similarity * 0.6, 0)
+                        + np.where(item_similarity >= self.item_similarity_threshold, item_similarity * 0.4, 0))
         
-        # Sort by overall score descending
-        potential_matches.sort(key=lambda x: x['overall_score'], reverse=True)
+        # Only include matches above a certain threshold (minimum 50% overall match),
+        # sorted by overall score descending
+        candidates = np.nonzero(match_scores >= 50)[0]
+        candidates = candidates[np.argsort(-match_scores[candidates], kind='stable')]
         
-        return potential_matches
+        return [{
+            'po_id': pos[i]['po_id'],
+            'po_vendor': pos[i]['vendor'],
+            'po_item': pos[i]['item'],
+            'vendor_similarity': float(vendor_similarity[i]),
+            'item_similarity': float(item_similarity[i]),
+            'overall_score': float(match_scores[i]),
+            'po_data': dict(pos[i])
+        } for i in candidates]
     
     def _perform_detailed_validation(self, invoice_data, matches, all_pos):
-        """Perform detailed validation against the best matches"""
+        """Assign invoice lines to the matched PO lines and validate each pair"""
         validation_result = {
             'status': 'processed',
             'invoice_data': invoice_data,
@@ -124,24 +144,61 @@ class POValidator:
             })
             return validation_result
         
-        # Validate against the best matches
-        for i, match in enumerate(matches[:3]):  # Check top 3 matches
-            po_data = match['po_data']
-            match_validation = self._validate_against_single_po(invoice_data, po_data, match)
+        invoice_items = invoice_data.get('line_items', [])
+        if not invoice_items:
+            # Nothing to assign: validate against the best match only
+            match_validation = self._validate_against_single_po(invoice_data, matches[0]['po_data'], matches[0])
+            validation_result['mismatches'].extend(match_validation['issues'])
+            validation_result['best_match'] = match_validation
+            return validation_result
+        
+        # Globally cheapest one-to-one assignment of invoice lines to PO lines
+        candidates = matches[:self.max_candidate_po_lines]
+        assignment = match_lines(invoice_items, [match['po_data'] for match in candidates],
+                                 self.item_similarity_threshold)
+        validation_result['line_assignment'] = {
+            'method': assignment['method'],
+            'assigned_lines': len(assignment['pairs']),
+            'unmatched_lines': len(assignment['unmatched_lines']),
+            'elapsed_ms': assignment['elapsed_ms']
+        }
+        
+        # Validate each assigned pair, best-scoring PO lines first
+        for line_index, po_index, _, _ in sorted(assignment['pairs'], key=lambda pair: pair[1]):
+            match = candidates[po_index]
+            match_validation = self._validate_against_single_po(
+                invoice_data, match['po_data'], match, invoice_items[line_index]
+            )
+            match_validation['line_index'] = line_index
             
             if match_validation['is_valid']:
                 validation_result['matches'].append(match_validation)
-            else:
-                validation_result['mismatches'].extend(match_validation['issues'])
+            validation_result['mismatches'].extend(match_validation['issues'])
             
-            # Only process the best match in detail
-            if i == 0:
+            if 'best_match' not in validation_result:
                 validation_result['best_match'] = match_validation
         
+        for line_index in assignment['unmatched_lines']:
+            invoice_item = invoice_items[line_index]
+            validation_result['mismatches'].append({
+                'type': 'unmatched_line',
+                'severity': 'medium',
+                'message': f'No purchase order line found for invoice line "{invoice_item.get("item")}"',
+                'details': {
+                    'line_index': line_index,
+                    'item': invoice_item.get('item'),
+                    'qty': invoice_item.get('qty'),
+                    'unit_price': invoice_item.get('unit_price')
+                }
+            })
+        
         return validation_result
     
-    def _validate_against_single_po(self, invoice_data, po_data, match_info):
-        """Validate invoice against a single purchase order"""
+    def _validate_against_single_po(self, invoice_data, po_data, match_info, invoice_item=None):
+        """
+        Validate invoice against a single purchase order
+        (against one assigned invoice line when invoice_item is given)
+        """
         validation = {
             'po_id': po_data['po_id'],
             'match_score': match_info['overall_score'],
@@ -173,7 +230,7 @@ class POValidator:
         po_total = po_data['total']
         
         item_found = False
-        for invoice_item in invoice_items:
+        for invoice_item in ([invoice_item] if invoice_item is not None else invoice_items):
             item_similarity = fuzz.ratio(invoice_item.get('item', '').lower(), po_item.lower())
             
             if item_similarity >= self.item_similarity_threshold:
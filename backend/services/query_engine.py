@@ -1,10 +1,18 @@
-from openai import OpenAI
 import re
 import json
 import logging
 import os
 from datetime import datetime
-from models.db_setup import execute_query, get_db_connection
+from models.db_setup import execute_query, get_db_connection, governor_metadata, result_payload
+from services.event_bus import publish_event
+from services.translation_cache import translation_cache
+from services.schema_introspector import schema_introspector
+from services.result_cache import query_result_cache
+from services.intent_router import intent_router, HIGH_CONFIDENCE
+from services.sql_translator import get_translator
+from services.sql_guard import sql_guard
+from services.plan_recorder import plan_recorder
+from services.spend_cube import spend_cube
 import sqlite3
 
 # Configure logging
@@ -14,55 +22,37 @@ logger = logging.getLogger(__name__)
 class QueryEngine:
     def __init__(self, openai_api_key=None):
         self.openai_api_key = openai_api_key or os.getenv('OPENAI_API_KEY')
-        self.openai_client = None
-        
-        if self.openai_api_key:
-            try:
-                self.openai_client = OpenAI(api_key=self.openai_api_key)
-            except Exception as e:
-                logger.warning(f"Failed to initialize OpenAI client: {e}")
-                self.openai_client = None
-        
-        # Database schema information for GPT context
-        self.schema_info = {
-            "purchase_orders": {
-                "columns": ["po_id", "vendor", "item", "qty", "unit_price", "total", "date", "created_at"],
-                "description": "Contains purchase order records with vendor, item details, quantities, prices and dates"
-            },
-            "invoices": {
-                "columns": ["invoice_id", "vendor", "item", "qty", "unit_price", "total", "date", "po_id", "status", "validation_result", "created_at"],
-                "description": "Contains invoice records with vendor, item details, and validation status"
-            },
-            "leaderboard": {
-                "columns": ["team_id", "team_name", "score", "validations_completed", "queries_executed", "last_updated"],
-                "description": "Contains team performance metrics and scores"
-            },
-            "query_history": {
-                "columns": ["id", "natural_language_query", "sql_query", "execution_time", "result_count", "team_id", "created_at"],
-                "description": "Contains history of natural language queries and their SQL translations"
-            }
-        }
-        
-        # Common query patterns for fallback
-        self.fallback_patterns = {
-            r'total.*spend.*vendor.*quarter': 'SELECT vendor, SUM(total) as total_spend FROM purchase_orders WHERE date >= date("now", "-3 months") GROUP BY vendor ORDER BY total_spend DESC',
-            r'top.*vendor.*spend': 'SELECT vendor, SUM(total) as total_spend FROM purchase_orders GROUP BY vendor ORDER BY total_spend DESC LIMIT 10',
-            r'leaderboard|top.*team': 'SELECT team_name, score, validations_completed, queries_executed FROM leaderboard ORDER BY score DESC',
-            r'recent.*invoice': 'SELECT invoice_id, vendor, total, date FROM invoices ORDER BY created_at DESC LIMIT 10',
-            r'total.*purchase.*order': 'SELECT COUNT(*) as total_pos, SUM(total) as total_value FROM purchase_orders',
-            r'average.*order.*value': 'SELECT AVG(total) as average_order_value FROM purchase_orders',
-            r'vendor.*count': 'SELECT vendor, COUNT(*) as order_count FROM purchase_orders GROUP BY vendor ORDER BY order_count DESC'
-        }
+        # Shared per API key: one client, connection pool and concurrency limit
+        self.translator = get_translator(self.openai_api_key)
     
     def translate_to_sql(self, natural_query, team_id=None):
         """
         Translate natural language query to SQL using GPT-4 or fallback patterns
         """
         try:
-            # First try GPT-4 if client is available
-            if self.openai_client:
+            # Reuse a previous translation of the same question if we have one
+            translation_cache.ensure_loaded(schema_introspector.structure_hash(), self._validate_sql_query)
+            sql_query = translation_cache.get(natural_query)
+            if sql_query:
+                return {
+                    'success': True,
+                    'sql_query': sql_query,
+                    'method': 'cache',
+                    'natural_query': natural_query
+                }
+            
+            # Answer locally only when the intent router is confident and its
+            # template accounts for the whole question; anything else goes to
+            # GPT-4 first and uses the local match as the offline fallback
+            intent_match = intent_router.route(natural_query)
+            if intent_match and intent_match['complete'] and intent_match['confidence'] >= HIGH_CONFIDENCE:
+                return self._intent_result(natural_query, intent_match)
+            
+            # Then try GPT-4 if client is available
+            if self.translator:
                 sql_query = self._translate_with_gpt4(natural_query)
                 if sql_query:
+                    translation_cache.set(natural_query, sql_query)
                     return {
                         'success': True,
                         'sql_query': sql_query,
@@ -70,15 +60,9 @@ class QueryEngine:
                         'natural_query': natural_query
                     }
             
-            # Fallback to pattern matching
-            sql_query = self._translate_with_patterns(natural_query)
-            if sql_query:
-                return {
-                    'success': True,
-                    'sql_query': sql_query,
-                    'method': 'pattern_matching',
-                    'natural_query': natural_query
-                }
+            # Fall back to a lower-confidence local match
+            if intent_match:
+                return self._intent_result(natural_query, intent_match)
             
             # If no translation found, return a helpful error
             return {
@@ -100,91 +84,45 @@ class QueryEngine:
             }
     
     def _translate_with_gpt4(self, natural_query):
-        """Translate using GPT-4 API"""
-        try:
-            if not self.openai_client:
-                return None
-                
-            schema_description = self._get_schema_description()
-            
-            prompt = f"""
-You are a SQL expert. Convert the following natural language query to SQL.
-
-Database Schema:
-{schema_description}
-
-Rules:
-1. Only use SELECT statements
-2. Use proper SQLite syntax
-3. Return only the SQL query, no explanations
-4. Use appropriate JOINs when needed
-5. Include proper GROUP BY and ORDER BY clauses
-6. Use date functions like date('now', '-3 months') for relative dates
-
-Natural Language Query: {natural_query}
-
-SQL Query:"""
-
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a SQL expert that converts natural language to SQL queries."},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=200,
-                temperature=0.1
-            )
-            
-            sql_query = response.choices[0].message.content.strip()
-            
-            # Clean up the response
-            sql_query = re.sub(r'^```sql\s*', '', sql_query)
-            sql_query = re.sub(r'\s*```$', '', sql_query)
-            sql_query = sql_query.strip()
-            
-            # Basic validation
-            if self._validate_sql_query(sql_query):
-                return sql_query
-            else:
-                logger.warning(f"Generated SQL failed validation: {sql_query}")
-                return None
-                
-        except Exception as e:
-            logger.error(f"GPT-4 translation error: {str(e)}")
+        """Translate using GPT-4 API (coalesced, rate-limited and shed under load)"""
+        if not self.translator:
             return None
-    
-    def _translate_with_patterns(self, natural_query):
-        """Translate using predefined patterns"""
-        query_lower = natural_query.lower()
         
-        for pattern, sql in self.fallback_patterns.items():
-            if re.search(pattern, query_lower):
-                return sql
+        sql_query, status = self.translator.translate(natural_query, self._get_schema_description())
+        if not sql_query:
+            if status == 'shed':
+                logger.info(f"GPT-4 call shed for query: {natural_query}")
+            return None
         
-        return None
+        # Basic validation
+        if self._validate_sql_query(sql_query):
+            return sql_query
+        else:
+            logger.warning(f"Generated SQL failed validation: {sql_query}")
+            return None
+    
+    def _intent_result(self, natural_query, intent_match):
+        """Build a translation result from a local intent router match"""
+        return {
+            'success': True,
+            'sql_query': intent_match['sql_query'],
+            'method': 'intent_router',
+            'intent': intent_match['intent'],
+            'confidence': intent_match['confidence'],
+            'parameters': intent_match['parameters'],
+            'natural_query': natural_query
+        }
     
     def _validate_sql_query(self, sql_query):
-        """Basic validation of SQL query"""
-        if not sql_query:
-            return False
-        
-        # Must be a SELECT statement
-        if not sql_query.strip().upper().startswith('SELECT'):
-            return False
-        
-        # Check for potentially dangerous operations
-        dangerous_keywords = ['DROP', 'DELETE', 'UPDATE', 'INSERT', 'ALTER', 'CREATE', 'TRUNCATE']
-        query_upper = sql_query.upper()
-        
-        for keyword in dangerous_keywords:
-            if keyword in query_upper:
-                return False
-        
-        return True
+        """Check SQL is a read-only SELECT over queryable tables (authorizer-based)"""
+        allowed, _ = sql_guard.validate(sql_query)
+        return allowed
     
-    def execute_natural_language_query(self, natural_query, team_id=None):
+    def execute_natural_language_query(self, natural_query, team_id=None, fresh=False, columnar=False):
         """
         Execute a natural language query end-to-end
+        Set fresh=True to bypass the query result cache and columnar=True to
+        return column names/types once with rows as arrays
         """
         start_time = datetime.now()
         
@@ -197,8 +135,21 @@ SQL Query:"""
             
             sql_query = translation_result['sql_query']
             
-            # Execute SQL query
-            results = execute_query(sql_query)
+            # Aggregate intents are answered from the in-memory spend cube
+            execution = None
+            if translation_result['method'] == 'intent_router':
+                execution = spend_cube.answer(translation_result['intent'], translation_result['parameters'],
+                                              sql_query, columnar=columnar)
+                cache_status = 'cube'
+            
+            # Otherwise execute SQL under the execution governor (served from
+            # the result cache when its tables are unchanged)
+            if execution is None:
+                execution, cache_status = query_result_cache.execute(
+                    sql_query, bypass=fresh, columnar=columnar, authorizer=sql_guard.authorizer(sql_query))
+            results = execution['results']
+            if cache_status not in ('hit', 'cube'):
+                plan_recorder.record(sql_query, execution['elapsed_ms'], source=translation_result['method'])
             
             # Calculate execution time
             execution_time = (datetime.now() - start_time).total_seconds()
@@ -215,10 +166,12 @@ SQL Query:"""
                 'success': True,
                 'natural_query': natural_query,
                 'sql_query': sql_query,
-                'results': results,
+                **result_payload(execution),
                 'result_count': len(results) if results else 0,
                 'execution_time': execution_time,
-                'method': translation_result['method']
+                'method': translation_result['method'],
+                'cache': cache_status,
+                **governor_metadata(execution)
             }
             
         except Exception as e:
@@ -238,19 +191,18 @@ SQL Query:"""
                    VALUES (?, ?, ?, ?, ?)""",
                 (natural_query, sql_query, execution_time, result_count, team_id)
             )
+            publish_event('query', {
+                'team_id': team_id,
+                'natural_query': natural_query,
+                'result_count': result_count,
+                'execution_time': execution_time
+            })
         except Exception as e:
             logger.error(f"Error saving query history: {str(e)}")
     
     def _get_schema_description(self):
-        """Get formatted schema description for GPT prompt"""
-        schema_text = "Database Tables:\n\n"
-        
-        for table_name, info in self.schema_info.items():
-            schema_text += f"Table: {table_name}\n"
-            schema_text += f"Description: {info['description']}\n"
-            schema_text += f"Columns: {', '.join(info['columns'])}\n\n"
-        
-        return schema_text
+        """Get the schema description for the GPT prompt (live, cached per schema version)"""
+        return schema_introspector.describe()
     
     def get_query_suggestions(self):
         """Get suggested queries for the UI"""
@@ -285,7 +237,7 @@ SQL Query:"""
         ]
 
 # Convenience function for external use
-def execute_nl_query(natural_query, team_id=None, openai_api_key=None):
+def execute_nl_query(natural_query, team_id=None, openai_api_key=None, fresh=False, columnar=False):
     """Execute a natural language query"""
     engine = QueryEngine(openai_api_key)
-    return engine.execute_natural_language_query(natural_query, team_id)
+    return engine.execute_natural_language_query(natural_query, team_id, fresh, columnar)
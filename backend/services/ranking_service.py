@@ -0,0 +1,249 @@
+from math import log
+from random import random
+from datetime import datetime, timezone
+from models.db_setup import execute_query
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Sort columns per ranking metric, all descending (ties broken by team_id)
+RANKING_METRICS = {
+    'score': ('score', 'validations_completed'),
+    'validations': ('validations_completed',),
+    'queries': ('queries_executed',)
+}
+
+class _Node:
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, levels):
+        self.value = value
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+class OrderStatisticList:
+    """
+    Indexable skiplist of comparable values kept in ascending order.
+    Insert, remove, select-by-index and rank-of-value are O(log n) expected.
+    """
+
+    MAX_LEVELS = 25  # Enough for ~30M entries
+
+    def __init__(self):
+        self.size = 0
+        self.head = _Node(None, self.MAX_LEVELS)
+
+    def __len__(self):
+        return self.size
+
+    def insert(self, value):
+        """Insert a value"""
+        chain = [None] * self.MAX_LEVELS
+        steps_at_level = [0] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].value <= value:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = min(self.MAX_LEVELS, 1 - int(log(1.0 - random(), 2.0)))
+        new_node = _Node(value, levels)
+        steps = 0
+        for level in range(levels):
+            prev_node = chain[level]
+            new_node.next[level] = prev_node.next[level]
+            prev_node.next[level] = new_node
+            new_node.width[level] = prev_node.width[level] - steps
+            prev_node.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.MAX_LEVELS):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        """Remove a value; raises KeyError if it is not present"""
+        chain = [None] * self.MAX_LEVELS
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].value < value:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        if target is None or target.value != value:
+            raise KeyError(value)
+
+        for level in range(len(target.next)):
+            prev_node = chain[level]
+            prev_node.width[level] += target.width[level] - 1
+            prev_node.next[level] = target.next[level]
+        for level in range(len(target.next), self.MAX_LEVELS):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, value):
+        """Get the 0-based position of a value (count of smaller values)"""
+        position = 0
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.next[level].value < value:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def slice(self, start, stop):
+        """Get values at positions [start, stop)"""
+        start = max(start, 0)
+        stop = min(stop, self.size)
+        if start >= stop:
+            return []
+
+        # Walk down to the node just before position start
+        remaining = start
+        node = self.head
+        for level in reversed(range(self.MAX_LEVELS)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+
+        values = []
+        for _ in range(stop - start):
+            node = node.next[0]
+            values.append(node.value)
+        return values
+
+class RankingService:
+    """
+    In-memory team rankings with one sorted index per metric.
+    Rebuilt from SQLite on startup and kept current by the leaderboard write
+    path, so top-K, rank-of-team and neighbors queries never sort the table.
+    The indexes are per process.
+    """
+
+    def __init__(self):
+        self._teams = {}
+        self._indexes = {metric: OrderStatisticList() for metric in RANKING_METRICS}
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    def _sort_key(self, metric, team):
+        return tuple(-team[column] for column in RANKING_METRICS[metric]) + (team['team_id'],)
+
+    def rebuild(self):
+        """Reload all teams from the database, including pending buffered increments"""
+        from models.leaderboard_writer import read_with_pending, merge_pending
+
+        teams = read_with_pending(lambda deltas: [
+            merge_pending(team, deltas)
+            for team in execute_query("""
+                SELECT team_id, team_name, score, validations_completed,
+                       queries_executed, last_updated
+                FROM leaderboard
+            """)
+        ])
+
+        with self._lock:
+            self._teams = {}
+            self._indexes = {metric: OrderStatisticList() for metric in RANKING_METRICS}
+            for team in teams:
+                self._add(team)
+            self.loaded = True
+
+        logger.info(f"Ranking indexes rebuilt for {len(teams)} teams")
+        return len(teams)
+
+    def ensure_loaded(self):
+        """Build the indexes on first use"""
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self.rebuild()
+
+    def _add(self, team):
+        self._teams[team['team_id']] = team
+        for metric, index in self._indexes.items():
+            index.insert(self._sort_key(metric, team))
+
+    def _remove(self, team_id):
+        team = self._teams.pop(team_id, None)
+        if team is not None:
+            for metric, index in self._indexes.items():
+                index.remove(self._sort_key(metric, team))
+        return team
+
+    def upsert_team(self, team):
+        """Add or replace a team row"""
+        if not self.loaded:
+            return
+        with self._lock:
+            self._remove(team['team_id'])
+            self._add(dict(team))
+
+    def remove_team(self, team_id):
+        """Remove a team"""
+        if not self.loaded:
+            return
+        with self._lock:
+            self._remove(team_id)
+
+    def apply_delta(self, team_id, validation_increment=0, query_increment=0, score_increment=0):
+        """Apply counter increments to a team, re-positioning it in every index"""
+        if not self.loaded:
+            return False
+        with self._lock:
+            team = self._remove(team_id)
+            if team is None:
+                return False
+            team['score'] += score_increment
+            team['validations_completed'] += validation_increment
+            team['queries_executed'] += query_increment
+            team['last_updated'] = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            self._add(team)
+            return True
+
+    def top_k(self, metric, k, offset=0):
+        """Get the top k teams for a metric, each with its 1-based rank"""
+        if k < 0 or offset < 0:
+            raise ValueError('k and offset must not be negative')
+        self.ensure_loaded()
+        with self._lock:
+            keys = self._indexes[metric].slice(offset, offset + k)
+            return [dict(self._teams[key[-1]], rank=offset + i + 1) for i, key in enumerate(keys)]
+
+    def rank_of(self, metric, team_id):
+        """Get a team's 1-based rank for a metric, or None if unknown"""
+        self.ensure_loaded()
+        with self._lock:
+            team = self._teams.get(team_id)
+            if team is None:
+                return None
+            return self._indexes[metric].rank(self._sort_key(metric, team)) + 1
+
+    def neighbors(self, metric, team_id, radius=2):
+        """Get the teams ranked around a team (radius places above and below)"""
+        self.ensure_loaded()
+        with self._lock:
+            rank = self.rank_of(metric, team_id)
+            if rank is None:
+                return None
+            start = max(rank - 1 - radius, 0)
+            return self.top_k(metric, rank - start + radius, offset=start)
+
+    def get_team(self, team_id):
+        """Get a copy of a team's in-memory row"""
+        self.ensure_loaded()
+        with self._lock:
+            team = self._teams.get(team_id)
+            return dict(team) if team else None
+
+    def team_count(self):
+        """Get the number of ranked teams"""
+        self.ensure_loaded()
+        with self._lock:
+            return len(self._teams)
+
+ranking_service = RankingService()
@@ -0,0 +1,405 @@
+from rapidfuzz import fuzz
+from rapidfuzz.process import cdist
+from models.db_setup import get_db_connection, read_connection, bump_data_version
+from services.po_validator import POValidator
+from collections import Counter, defaultdict
+import numpy as np
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50000
+MIN_MATCH_SCORE = 50       # Same overall-score floor as per-upload matching
+SCOPES = {
+    'open': "AND status IS NOT 'approved'",
+    'all': ''
+}
+RESUMABLE_STATUSES = ('running', 'failed', 'interrupted')
+
+# One chunk of invoices (by rowid range) is matched and checked in a single
+# statement: candidates come from joining the run's key map to the PO copy,
+# the best one per invoice is picked with ROW_NUMBER() (linked PO first, then
+# match score, then the closest PO dated on or before the invoice), and the
+# quantity, unit price and total tolerance checks are plain column arithmetic.
+_CHUNK_SQL = """
+    INSERT OR REPLACE INTO reconciliation_results
+    (run_id, invoice_id, po_id, linked_po_id, match_method, vendor_similarity, item_similarity,
+     qty_match, price_difference_pct, total_difference_pct, date_warning, status)
+    WITH chunk AS (
+        SELECT invoice_id, lower(trim(vendor)) AS vendor_key, lower(trim(item)) AS item_key,
+               qty, unit_price, total, date, po_id
+        FROM invoices
+        WHERE rowid > :cursor AND rowid <= :chunk_end {scope}
+    ),
+    candidates AS (
+        SELECT c.invoice_id, p.po_id, p.qty AS po_qty, p.unit_price AS po_unit_price, p.date AS po_date,
+               k.vendor_similarity, k.item_similarity,
+               CASE WHEN p.po_id = c.po_id THEN 'linked'
+                    WHEN k.score = 100 THEN 'exact'
+                    ELSE 'fuzzy' END AS match_method,
+               ROW_NUMBER() OVER (
+                   PARTITION BY c.invoice_id
+                   ORDER BY p.po_id IS c.po_id DESC, k.score DESC, p.date <= c.date DESC,
+                            abs(julianday(c.date) - julianday(p.date)), p.po_id
+               ) AS rank
+        FROM chunk c
+        JOIN recon_key_map k ON k.inv_vendor_key = c.vendor_key AND k.inv_item_key = c.item_key
+        JOIN recon_po p ON p.vendor_key = k.po_vendor_key AND p.item_key = k.po_item_key
+    ),
+    checked AS (
+        SELECT c.invoice_id, m.po_id, c.po_id AS linked_po_id, m.match_method,
+               m.vendor_similarity, m.item_similarity,
+               c.qty = m.po_qty AS qty_match,
+               CASE WHEN m.po_unit_price > 0
+                    THEN abs(c.unit_price - m.po_unit_price) * 100.0 / m.po_unit_price
+                    WHEN m.po_id IS NOT NULL THEN 100 END AS price_difference_pct,
+               CASE WHEN c.qty * m.po_unit_price > 0
+                    THEN abs(c.total - c.qty * m.po_unit_price) * 100.0 / (c.qty * m.po_unit_price)
+                    WHEN m.po_id IS NOT NULL THEN 100 END AS total_difference_pct,
+               c.date < m.po_date AS date_warning
+        FROM chunk c
+        LEFT JOIN candidates m ON m.invoice_id = c.invoice_id AND m.rank = 1
+    )
+    SELECT :run_id, invoice_id, po_id, linked_po_id, match_method, vendor_similarity, item_similarity,
+           qty_match, round(price_difference_pct, 2), round(total_difference_pct, 2), date_warning,
+           CASE WHEN po_id IS NULL THEN 'unmatched'
+                WHEN vendor_similarity >= :vendor_threshold
+                     AND item_similarity >= :item_threshold
+                     AND qty_match
+                     AND price_difference_pct <= :tolerance
+                     AND total_difference_pct <= :tolerance
+                     AND (linked_po_id IS NULL OR linked_po_id = po_id)
+                THEN 'matched'
+                ELSE 'discrepancy' END
+    FROM checked
+    RETURNING status
+"""
+
+class ReconciliationBusy(RuntimeError):
+    """Raised when a reconciliation run is already in progress"""
+
+class ReconciliationEngine:
+    """
+    Reconciles the whole invoice book against purchase orders in batch.
+    Invoice and PO (vendor, item) keys are matched once per run: exact keys
+    directly, the rest with vendor-blocked rapidfuzz similarity matrices using
+    POValidator's thresholds and score weights. Invoices are then processed in
+    rowid chunks, each one INSERT ... SELECT that joins candidates, picks the
+    best PO and applies the tolerance checks. Each chunk commits together with
+    the run's cursor, so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, validator=None):
+        self.validator = validator or POValidator()
+        self._run_lock = threading.Lock()
+        self.active_run_id = None
+
+    def start_run(self, scope='open', chunk_size=DEFAULT_CHUNK_SIZE, price_tolerance_percentage=None):
+        """Create a run over the invoices in scope; returns its run_id"""
+        if scope not in SCOPES:
+            raise ValueError(f"Unknown scope '{scope}' (expected one of: {', '.join(SCOPES)})")
+        # LIMIT 0 would end the run at once and a negative LIMIT is unbounded
+        if isinstance(chunk_size, bool) or not isinstance(chunk_size, int) or chunk_size < 1:
+            raise ValueError('chunk_size must be a positive integer')
+        if price_tolerance_percentage is None:
+            price_tolerance_percentage = self.validator.price_tolerance_percentage
+
+        conn = get_db_connection()
+        try:
+            total = conn.execute(f'SELECT COUNT(*) FROM invoices WHERE 1 {SCOPES[scope]}').fetchone()[0]
+            cursor = conn.execute("""
+                INSERT INTO reconciliation_runs (scope, price_tolerance_percentage, chunk_size, total_invoices)
+                VALUES (?, ?, ?, ?)
+            """, (scope, float(price_tolerance_percentage), chunk_size, total))
+            conn.commit()
+            bump_data_version(['reconciliation_runs'])
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def find_resumable_run(self):
+        """Get the latest run that did not complete, or None"""
+        with read_connection() as conn:
+            row = conn.execute(f"""
+                SELECT run_id FROM reconciliation_runs
+                WHERE status IN ({', '.join('?' * len(RESUMABLE_STATUSES))})
+                ORDER BY run_id DESC LIMIT 1
+            """, RESUMABLE_STATUSES).fetchone()
+        return row[0] if row else None
+
+    def run(self, scope='open', chunk_size=DEFAULT_CHUNK_SIZE, price_tolerance_percentage=None,
+            resume=False, progress=None):
+        """
+        Run (or resume) a reconciliation in the calling thread.
+        resume may be True for the latest unfinished run or a run_id.
+        Returns the finished run record.
+        """
+        if not self._run_lock.acquire(blocking=False):
+            raise ReconciliationBusy(f'Reconciliation run {self.active_run_id} is in progress')
+        try:
+            run_id = self._resolve_run(scope, chunk_size, price_tolerance_percentage, resume)
+            return self._execute(run_id, progress)
+        finally:
+            self._run_lock.release()
+
+    def start_background(self, scope='open', chunk_size=DEFAULT_CHUNK_SIZE, price_tolerance_percentage=None,
+                         resume=False):
+        """Start (or resume) a run in a background thread; returns its run_id"""
+        if not self._run_lock.acquire(blocking=False):
+            raise ReconciliationBusy(f'Reconciliation run {self.active_run_id} is in progress')
+        try:
+            run_id = self._resolve_run(scope, chunk_size, price_tolerance_percentage, resume)
+        except Exception:
+            self._run_lock.release()
+            raise
+
+        def work():
+            try:
+                self._execute(run_id)
+            except Exception:
+                pass  # Already recorded on the run
+            finally:
+                self._run_lock.release()
+
+        threading.Thread(target=work, name=f'reconciliation-{run_id}', daemon=True).start()
+        return run_id
+
+    def _resolve_run(self, scope, chunk_size, price_tolerance_percentage, resume):
+        """run_id to execute: a resumed one or a new run"""
+        if resume is True:
+            run_id = self.find_resumable_run()
+            if run_id is None:
+                raise ValueError('No unfinished reconciliation run to resume')
+            return run_id
+        if resume:
+            run = self.get_run(int(resume))
+            if run is None or run['status'] not in RESUMABLE_STATUSES:
+                raise ValueError(f'Reconciliation run {resume} cannot be resumed')
+            return run['run_id']
+        return self.start_run(scope, chunk_size, price_tolerance_percentage)
+
+    def _execute(self, run_id, progress=None):
+        """Process a run's remaining chunks"""
+        self.active_run_id = run_id
+        conn = get_db_connection()
+        try:
+            run = dict(conn.execute('SELECT * FROM reconciliation_runs WHERE run_id = ?', (run_id,)).fetchone())
+            conn.execute("UPDATE reconciliation_runs SET status = 'running', error = NULL WHERE run_id = ?", (run_id,))
+            conn.commit()
+            bump_data_version(['reconciliation_runs'], ['reconciliation_runs'])
+
+            scope = SCOPES[run['scope']]
+            cursor = run['last_invoice_rowid']
+            processed = run['processed_invoices']
+            logger.info(f"Reconciliation run {run_id}: {run['total_invoices'] - processed} invoices to go "
+                        f"(scope {run['scope']}, tolerance {run['price_tolerance_percentage']}%)")
+
+            start = time.monotonic()
+            self._prepare_keys(conn, cursor, scope)
+            logger.info(f"Reconciliation run {run_id}: keys matched in {time.monotonic() - start:.1f}s")
+
+            statement = _CHUNK_SQL.format(scope=scope)
+            started_with = processed
+            while True:
+                chunk_end, chunk_count = conn.execute(f"""
+                    SELECT MAX(rowid), COUNT(*) FROM (
+                        SELECT rowid FROM invoices WHERE rowid > ? {scope} ORDER BY rowid LIMIT ?
+                    )
+                """, (cursor, run['chunk_size'])).fetchone()
+                if not chunk_count:
+                    break
+
+                statuses = Counter(row[0] for row in conn.execute(statement, {
+                    'run_id': run_id,
+                    'cursor': cursor,
+                    'chunk_end': chunk_end,
+                    'vendor_threshold': self.validator.vendor_similarity_threshold,
+                    'item_threshold': self.validator.item_similarity_threshold,
+                    'tolerance': run['price_tolerance_percentage']
+                }).fetchall())
+                cursor = chunk_end
+                processed += chunk_count
+                conn.execute("""
+                    UPDATE reconciliation_runs
+                    SET last_invoice_rowid = ?, processed_invoices = ?,
+                        matched = matched + ?, discrepancies = discrepancies + ?, unmatched = unmatched + ?,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE run_id = ?
+                """, (cursor, processed, statuses['matched'], statuses['discrepancy'], statuses['unmatched'], run_id))
+                conn.commit()
+                bump_data_version(['reconciliation_runs', 'reconciliation_results'], ['reconciliation_runs'])
+
+                elapsed = time.monotonic() - start
+                rate = (processed - started_with) / elapsed if elapsed else 0
+                remaining = max(run['total_invoices'] - processed, 0)
+                logger.info(f"Reconciliation run {run_id}: {processed}/{run['total_invoices']} invoices "
+                            f"({rate:.0f}/s, ~{remaining / rate if rate else 0:.0f}s left)")
+                if progress:
+                    progress(processed, run['total_invoices'])
+
+            conn.execute("""
+                UPDATE reconciliation_runs
+                SET status = 'completed', total_invoices = MAX(total_invoices, processed_invoices),
+                    updated_at = CURRENT_TIMESTAMP, finished_at = CURRENT_TIMESTAMP
+                WHERE run_id = ?
+            """, (run_id,))
+            conn.commit()
+            bump_data_version(['reconciliation_runs'], ['reconciliation_runs'])
+            logger.info(f"Reconciliation run {run_id} completed in {time.monotonic() - start:.1f}s")
+            return self.get_run(run_id)
+
+        except BaseException as e:
+            conn.rollback()
+            status = 'interrupted' if isinstance(e, KeyboardInterrupt) else 'failed'
+            conn.execute("""
+                UPDATE reconciliation_runs SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE run_id = ?
+            """, (status, str(e) or type(e).__name__, run_id))
+            conn.commit()
+            bump_data_version(['reconciliation_runs'], ['reconciliation_runs'])
+            logger.error(f"Reconciliation run {run_id} {status}: {str(e) or type(e).__name__}")
+            raise
+        finally:
+            self.active_run_id = None
+            conn.close()
+
+    def _prepare_keys(self, conn, cursor, scope):
+        """
+        Build the run's temp tables: recon_po (POs by normalized vendor/item
+        key) and recon_key_map (each remaining invoice key -> best PO key).
+        """
+        conn.executescript("""
+            DROP TABLE IF EXISTS temp.recon_po;
+            DROP TABLE IF EXISTS temp.recon_key_map;
+            CREATE TEMP TABLE recon_po AS
+                SELECT po_id, lower(trim(vendor)) AS vendor_key, lower(trim(item)) AS item_key,
+                       qty, unit_price, date
+                FROM purchase_orders;
+            CREATE INDEX temp.idx_recon_po_key ON recon_po (vendor_key, item_key);
+            CREATE TEMP TABLE recon_key_map (
+                inv_vendor_key TEXT, inv_item_key TEXT,
+                po_vendor_key TEXT, po_item_key TEXT,
+                vendor_similarity REAL, item_similarity REAL, score REAL,
+                PRIMARY KEY (inv_vendor_key, inv_item_key)
+            );
+        """)
+
+        po_keys = set(conn.execute('SELECT DISTINCT vendor_key, item_key FROM recon_po').fetchall())
+        invoice_keys = conn.execute(f"""
+            SELECT DISTINCT lower(trim(vendor)), lower(trim(item)) FROM invoices WHERE rowid > ? {scope}
+        """, (cursor,)).fetchall()
+
+        mappings = [(vendor, item, vendor, item, 100, 100, 100)
+                    for vendor, item in invoice_keys if (vendor, item) in po_keys]
+        unmatched = [(vendor, item) for vendor, item in invoice_keys if (vendor, item) not in po_keys]
+        mappings.extend(self._fuzzy_key_map(unmatched, po_keys))
+
+        conn.executemany('INSERT INTO recon_key_map VALUES (?, ?, ?, ?, ?, ?, ?)', mappings)
+
+    def _fuzzy_key_map(self, invoice_keys, po_keys):
+        """
+        Best PO key per invoice key by the per-upload score (vendor 60%, item
+        40%, each only above its threshold). Since item similarity alone cannot
+        reach the score floor, candidates are blocked by vendor: one vendor
+        similarity matrix, then one item matrix per invoice vendor against the
+        items of its similar PO vendors.
+        """
+        if not invoice_keys or not po_keys:
+            return []
+        vendor_threshold = self.validator.vendor_similarity_threshold
+        item_threshold = self.validator.item_similarity_threshold
+
+        po_items = defaultdict(list)
+        for vendor, item in po_keys:
+            po_items[vendor].append(item)
+        po_vendors = list(po_items)
+
+        invoice_items = defaultdict(list)
+        for vendor, item in invoice_keys:
+            invoice_items[vendor].append(item)
+        invoice_vendors = list(invoice_items)
+
+        vendor_scores = cdist(invoice_vendors, po_vendors, scorer=fuzz.ratio, dtype=np.uint8, workers=-1)
+        mappings = []
+        for row, vendor in enumerate(invoice_vendors):
+            similar = np.nonzero(vendor_scores[row] >= vendor_threshold)[0]
+            if not len(similar):
+                continue
+            candidate_vendors = []
+            candidate_items = []
+            candidate_vendor_scores = []
+            for column in similar:
+                items = po_items[po_vendors[column]]
+                candidate_vendors.extend([po_vendors[column]] * len(items))
+                candidate_items.extend(items)
+                candidate_vendor_scores.extend([vendor_scores[row, column]] * len(items))
+            candidate_vendor_scores = np.array(candidate_vendor_scores, dtype=np.float64)
+
+            items = invoice_items[vendor]
+            item_scores = cdist(items, candidate_items, scorer=fuzz.ratio, dtype=np.uint8, workers=-1)
+            scores = candidate_vendor_scores * 0.6 + np.where(item_scores >= item_threshold, item_scores * 0.4, 0)
+            best = scores.argmax(axis=1)
+            for i, item in enumerate(items):
+                column = best[i]
+                if scores[i, column] >= MIN_MATCH_SCORE:
+                    mappings.append((vendor, item, candidate_vendors[column], candidate_items[column],
+                                     float(candidate_vendor_scores[column]), float(item_scores[i, column]),
+                                     round(float(scores[i, column]), 2)))
+        return mappings
+
+    def get_run(self, run_id):
+        """Get a run record with its progress, or None"""
+        with read_connection() as conn:
+            row = conn.execute('SELECT * FROM reconciliation_runs WHERE run_id = ?', (run_id,)).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run['progress'] = round(run['processed_invoices'] / run['total_invoices'], 4) if run['total_invoices'] else 1.0
+        return run
+
+    def list_runs(self, limit=20):
+        """Get the most recent runs"""
+        with read_connection() as conn:
+            return [dict(row) for row in conn.execute(
+                'SELECT * FROM reconciliation_runs ORDER BY run_id DESC LIMIT ?', (limit,)
+            )]
+
+    def get_results(self, run_id, status=None, limit=100, offset=0):
+        """Get a page of a run's per-invoice results, optionally by status"""
+        with read_connection() as conn:
+            return [dict(row) for row in conn.execute(f"""
+                SELECT * FROM reconciliation_results
+                WHERE run_id = ? {'AND status = ?' if status else ''}
+                ORDER BY invoice_id
+                LIMIT ? OFFSET ?
+            """, (run_id, status, limit, offset) if status else (run_id, limit, offset))]
+
+reconciliation_engine = ReconciliationEngine()
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='Reconcile invoices against purchase orders in batch')
+    parser.add_argument('--scope', choices=list(SCOPES), default='open',
+                        help="Invoices to reconcile: not yet approved ('open') or all")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Invoices per committed chunk')
+    parser.add_argument('--tolerance', type=float, help='Price tolerance percentage (default: validator setting)')
+    parser.add_argument('--resume', nargs='?', const=True, default=False, metavar='RUN_ID',
+                        help='Resume the latest unfinished run (or the given one)')
+    parser.add_argument('--json', action='store_true', help='Print the finished run as JSON')
+    args = parser.parse_args()
+
+    resume = args.resume if args.resume is True or args.resume is False else int(args.resume)
+    result = reconciliation_engine.run(scope=args.scope, chunk_size=args.chunk_size,
+                                       price_tolerance_percentage=args.tolerance, resume=resume)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"Run {result['run_id']} {result['status']}: {result['processed_invoices']} invoices, "
+              f"{result['matched']} matched, {result['discrepancies']} with discrepancies, "
+              f"{result['unmatched']} unmatched")
@@ -0,0 +1,127 @@
+from collections import OrderedDict
+from functools import wraps
+from flask import request, make_response
+from models.db_setup import get_data_version
+import hashlib
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    In-process cache of rendered GET responses.
+    Entries are keyed by route and query args and are only valid for the
+    data version they were rendered at.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        """Get a cached entry if it is still valid for the given data version"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expired = entry['expires_at'] is not None and entry['expires_at'] < time.monotonic()
+            if entry['version'] != version or expired:
+                del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def set(self, key, version, body, mimetype, max_age=None):
+        """Store a rendered response body and return the cache entry"""
+        entry = {
+            'version': version,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'body': body,
+            'mimetype': mimetype,
+            'expires_at': time.monotonic() + max_age if max_age else None
+        }
+
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return entry
+
+    def clear(self):
+        """Drop all cached entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self):
+        """Get cache hit/miss statistics"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0
+            }
+
+response_cache = ResponseCache()
+
+def _make_cache_key():
+    """Build a cache key from the request path and sorted query args"""
+    args = sorted(request.args.items(multi=True))
+    return request.path + '?' + '&'.join(f'{k}={v}' for k, v in args)
+
+def _cached_to_response(entry, cache_status):
+    """Turn a cache entry into a response, or a 304 if the client already has it"""
+    if request.if_none_match.contains_weak(entry['etag']):
+        response = make_response('', 304)
+    else:
+        response = make_response(entry['body'])
+        response.mimetype = entry['mimetype']
+
+    response.set_etag(entry['etag'])
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Cache'] = cache_status
+    return response
+
+def cached_response(versioned=True, max_age=None):
+    """
+    Cache a GET view's successful responses until the data version changes.
+
+    versioned=False is for views whose output does not depend on the database.
+    max_age (seconds) bounds staleness for views that use time windows such as
+    datetime('now', '-24 hours').
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = _make_cache_key()
+            # Read the version before running the view so a concurrent write
+            # can only make the stored entry look stale, never fresh
+            version = get_data_version() if versioned else 0
+
+            entry = response_cache.get(key, version)
+            if entry is not None:
+                return _cached_to_response(entry, 'HIT')
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+
+            entry = response_cache.set(key, version, response.get_data(), response.mimetype, max_age)
+            return _cached_to_response(entry, 'MISS')
+        return wrapper
+    return decorator
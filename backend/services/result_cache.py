@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from models.db_setup import execute_governed_query, get_data_version, get_table_versions
+import re
+import sqlite3
+import sys
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Quoted SQL literals/identifiers, which must be kept byte-for-byte
+_QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|`(?:[^`]|``)*`|\[[^\]]*\])")
+
+# Comments outside quotes; an unterminated block comment runs to the end, as in SQLite
+_COMMENT_PATTERN = re.compile(r"--[^\n]*|/\*.*?(?:\*/|\Z)", re.DOTALL)
+_TOKEN_PATTERN = re.compile(f"({_QUOTED_PATTERN.pattern[1:-1]}|{_COMMENT_PATTERN.pattern})", re.DOTALL)
+
+# Results that depend on the clock are only reused for a short time
+_TIME_DEPENDENT_PATTERN = re.compile(r"'now'|\"now\"|\bcurrent_(?:date|time|timestamp)\b|\brandom\s*\(", re.IGNORECASE)
+TIME_DEPENDENT_TTL_SECONDS = 60
+
+def strip_sql_comments(sql_query):
+    """Replace -- and /* */ comments outside quoted literals with a space"""
+    return ''.join(
+        ' ' if i % 2 and _COMMENT_PATTERN.fullmatch(part) else part
+        for i, part in enumerate(_TOKEN_PATTERN.split(sql_query))
+    )
+
+def normalize_sql(sql_query):
+    """Strip comments, collapse whitespace outside quoted literals and drop a trailing semicolon"""
+    parts = _QUOTED_PATTERN.split(strip_sql_comments(sql_query).strip().rstrip(';').strip())
+    return ''.join(part if i % 2 else re.sub(r'\s+', ' ', part) for i, part in enumerate(parts))
+
+def _estimate_size(result):
+    """Rough in-memory size of a governed query result in bytes"""
+    rows = result['results']
+    size = sys.getsizeof(rows)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in (row.values() if isinstance(row, dict) else row):
+            size += sys.getsizeof(value)
+    return size
+
+class QueryResultCache:
+    """
+    Cache of SELECT results keyed by normalized SQL text.
+    Each entry remembers which tables the statement read and their write
+    versions, so it is served only while none of those tables has changed.
+    Bounded by an approximate memory budget with LRU eviction.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 8
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def execute(self, sql_query, bypass=False, max_rows=None, columnar=False, authorizer=None):
+        """
+        Run a SELECT through the cache under the execution governor, with
+        an optional sqlite3 authorizer enforced while it executes.
+        Returns (result, cache_status) where result is the governed result
+        dict and cache_status is 'hit', 'miss' or 'bypass'.
+        """
+        key = (normalize_sql(sql_query), max_rows, columnar)
+
+        if not bypass:
+            with self._lock:
+                entry = self._entries.get(key)
+                if (entry is not None
+                        and get_table_versions(entry['tables']) == entry['versions']
+                        and (entry['expires_at'] is None or entry['expires_at'] > time.monotonic())):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry['result'], 'hit'
+                self.misses += 1
+
+        tables = set()
+
+        def track_reads(action, arg1, arg2, db_name, trigger_name):
+            if authorizer:
+                verdict = authorizer(action, arg1, arg2, db_name, trigger_name)
+                if verdict != sqlite3.SQLITE_OK:
+                    return verdict
+            if action == sqlite3.SQLITE_READ and arg1:
+                tables.add(arg1)
+            return sqlite3.SQLITE_OK
+
+        version_before = get_data_version()
+        result = execute_governed_query(sql_query, max_rows=max_rows, authorizer=track_reads, columnar=columnar)
+
+        # Only cache complete reads that no write overlapped
+        if not result['timed_out'] and get_data_version() == version_before:
+            self._store(key, result, tables)
+
+        return result, 'bypass' if bypass else 'miss'
+
+    def _store(self, key, result, tables):
+        """Store a result set, evicting least recently used entries over budget"""
+        size = _estimate_size(result)
+        if size > self.max_entry_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old['size']
+
+            self._entries[key] = {
+                'result': result,
+                'tables': tables,
+                'versions': get_table_versions(tables),
+                'size': size,
+                'expires_at': (time.monotonic() + TIME_DEPENDENT_TTL_SECONDS
+                               if _TIME_DEPENDENT_PATTERN.search(key[0]) else None)
+            }
+            self.total_bytes += size
+
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= evicted['size']
+
+    def clear(self):
+        """Drop all cached results"""
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self):
+        """Get cache hit/miss and memory statistics"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0
+            }
+
+query_result_cache = QueryResultCache()
@@ -0,0 +1,375 @@
+from rapidfuzz import fuzz, process
+from models.db_setup import get_db_connection, execute_query, read_connection, bump_data_version, get_table_versions, PO_LOADS
+from services.po_validator import POValidator
+from services.po_candidates import po_candidate_index
+from services.vendor_resolver import vendor_resolver
+from services.event_bus import publish_event
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Stored outcomes a PO change can still improve
+REVALIDATE_STATUSES = ('pending', 'rejected', 'no_po_match')
+REVALIDATION_ENABLED = os.environ.get('REVALIDATION', '1').lower() not in ('0', 'false', 'no')
+REVALIDATION_DELAY_MS = int(os.environ.get('REVALIDATION_DELAY_MS', 500))
+REVALIDATION_BATCH_SIZE = 200
+# How often to check for bulk PO loads made by other processes (the loader CLI)
+PO_LOAD_POLL_SECONDS = float(os.environ.get('PO_LOAD_POLL_SECONDS', 5))
+
+def normalize_key(text):
+    """Lower-cased, whitespace-collapsed vendor or item key"""
+    return ' '.join((text or '').lower().split())
+
+def stored_invoice_data(row):
+    """Invoice data to re-validate: the parsed upload if stored, else the saved line"""
+    try:
+        invoice_data = json.loads(row['validation_result'] or '{}').get('invoice_data')
+    except (TypeError, ValueError, AttributeError):
+        invoice_data = None
+    if invoice_data:
+        return invoice_data
+    return {
+        'invoice_number': row['invoice_id'],
+        'vendor': row['vendor'],
+        'date': row['date'],
+        'line_items': [{
+            'item': row['item'],
+            'qty': row['qty'],
+            'unit_price': row['unit_price'],
+            'total': row['total']
+        }]
+    }
+
+def matched_po_id(validation_result):
+    """PO an invoice is linked to after validation (same rule as the upload route)"""
+    if validation_result.get('matches'):
+        return validation_result['matches'][0]['po_id']
+    if validation_result.get('best_match'):
+        return validation_result['best_match']['po_id']
+    return None
+
+class RevalidationIndex:
+    """
+    Dependency index from normalized vendor and item keys to the stored
+    invoices (pending, rejected or unmatched) that a PO change could affect.
+    A PO only becomes a candidate when its vendor is similar (or an alias of
+    the same canonical vendor), and can only clear an item_not_found
+    rejection when its item is similar too, so the affected set is invoices
+    under similar vendors with a similar item.
+    """
+
+    def __init__(self, validator=None):
+        self.validator = validator or POValidator()
+        self._lock = threading.Lock()
+        self._by_vendor = {}      # vendor_key -> {item_key -> {invoice_id}}
+        self._invoice_keys = {}   # invoice_id -> (vendor_key, item_keys)
+        self.built = False
+
+    def rebuild(self):
+        """Load the index from the stored invoices"""
+        start = time.monotonic()
+        with read_connection() as conn:
+            rows = conn.execute(f"""
+                SELECT invoice_id, vendor, item, qty, unit_price, total, date, validation_result
+                FROM invoices
+                WHERE status IN ({', '.join('?' * len(REVALIDATE_STATUSES))})
+            """, REVALIDATE_STATUSES).fetchall()
+
+        with self._lock:
+            self._by_vendor = {}
+            self._invoice_keys = {}
+            for row in rows:
+                invoice_data = stored_invoice_data(row)
+                items = [item.get('item') for item in invoice_data.get('line_items', [])] or [row['item']]
+                self._add(row['invoice_id'], row['vendor'], items)
+            self.built = True
+        logger.info(f"Revalidation index built with {len(rows)} invoices in {time.monotonic() - start:.2f}s")
+
+    def track(self, invoice_id, vendor, items, status):
+        """Record an invoice's current keys and status (indexed only while it can improve)"""
+        with self._lock:
+            self._remove(invoice_id)
+            if status in REVALIDATE_STATUSES:
+                self._add(invoice_id, vendor, items)
+
+    def affected(self, vendor, item):
+        """Invoice ids a PO with this vendor and item could change the outcome of"""
+        vendor_key = normalize_key(vendor)
+        item_key = normalize_key(item)
+        invoice_ids = set()
+        po_vendor_id = vendor_resolver.lookup(vendor_key)
+        with self._lock:
+            vendor_keys = list(self._by_vendor)
+            similar_vendors = {similar_vendor for similar_vendor, _, _ in process.extract(
+                vendor_key, vendor_keys, scorer=fuzz.ratio,
+                score_cutoff=self.validator.vendor_similarity_threshold, limit=None
+            )}
+            if po_vendor_id is not None:
+                # Spellings aliased to the PO's vendor match it however they are spelled
+                similar_vendors.update(key for key, vendor_id in zip(
+                    vendor_keys, vendor_resolver.lookup_many(vendor_keys)) if vendor_id == po_vendor_id)
+            for similar_vendor in similar_vendors:
+                items = self._by_vendor[similar_vendor]
+                for similar_item, _, _ in process.extract(
+                    item_key, list(items), scorer=fuzz.ratio,
+                    score_cutoff=self.validator.item_similarity_threshold, limit=None
+                ):
+                    invoice_ids.update(items[similar_item])
+        return invoice_ids
+
+    def size(self):
+        """Number of indexed invoices"""
+        return len(self._invoice_keys)
+
+    def invoice_ids(self):
+        """Ids of every indexed invoice"""
+        with self._lock:
+            return set(self._invoice_keys)
+
+    def _add(self, invoice_id, vendor, items):
+        vendor_key = normalize_key(vendor)
+        item_keys = {normalize_key(item) for item in items if item}
+        by_item = self._by_vendor.setdefault(vendor_key, {})
+        for item_key in item_keys:
+            by_item.setdefault(item_key, set()).add(invoice_id)
+        self._invoice_keys[invoice_id] = (vendor_key, item_keys)
+
+    def _remove(self, invoice_id):
+        keys = self._invoice_keys.pop(invoice_id, None)
+        if keys is None:
+            return
+        vendor_key, item_keys = keys
+        by_item = self._by_vendor.get(vendor_key, {})
+        for item_key in item_keys:
+            invoice_ids = by_item.get(item_key)
+            if invoice_ids is not None:
+                invoice_ids.discard(invoice_id)
+                if not invoice_ids:
+                    del by_item[item_key]
+        if not by_item:
+            self._by_vendor.pop(vendor_key, None)
+
+class RevalidationWorker:
+    """
+    Background re-validation of invoices affected by PO inserts and updates.
+    Changed PO keys are queued and coalesced for REVALIDATION_DELAY_MS, then
+    resolved through the index; each affected invoice is re-validated once
+    per batch against its retrieved PO candidates (or one shared PO fetch
+    for small tables), and its stored status, validation_result and po_id
+    are updated in one transaction.
+    """
+
+    def __init__(self, index, validator=None, delay_ms=REVALIDATION_DELAY_MS, batch_size=REVALIDATION_BATCH_SIZE):
+        self.index = index
+        self.validator = validator or index.validator
+        self.delay = delay_ms / 1000.0
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending_keys = {}       # (vendor, item) -> invoice ids to skip
+        self._pending_invoices = set()
+        self._revalidate_all = False
+        self._po_loads = None
+        self._wakeup = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._stopped = False
+        self._thread = None
+        self.po_changes = 0
+        self.coalesced = 0
+        self.revalidated = 0
+        self.status_changes = 0
+
+    def start(self):
+        """Build the index and start the background thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='invoice-revalidation', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the background thread (queued work is dropped; statuses converge on the next change)"""
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def po_changed(self, vendor, item, exclude=None):
+        """
+        Queue re-validation for invoices a new or corrected PO can affect.
+        exclude skips an invoice (e.g. the upload the PO was created from).
+        """
+        if not REVALIDATION_ENABLED:
+            return
+        key = (vendor or '', item or '')
+        excluded = {exclude} if exclude else set()
+        with self._lock:
+            self.po_changes += 1
+            if key in self._pending_keys:
+                self.coalesced += 1
+                self._pending_keys[key] &= excluded
+            else:
+                self._pending_keys[key] = excluded
+            self._idle.clear()
+        self._wakeup.set()
+
+    def pos_reloaded(self):
+        """
+        Queue every indexed invoice after a bulk PO load (resolving each
+        changed PO key separately would cost more than re-validating them all)
+        """
+        if not REVALIDATION_ENABLED:
+            return
+        with self._lock:
+            self._po_loads = get_table_versions([PO_LOADS])
+            self._revalidate_all = True
+            self._idle.clear()
+        self._wakeup.set()
+
+    def _check_po_loads(self):
+        """Queue everything when a bulk PO load committed since the last check (in any process)"""
+        try:
+            loads = get_table_versions([PO_LOADS])
+        except sqlite3.Error as e:
+            logger.error(f"Error checking for PO loads: {str(e)}")
+            return False
+        with self._lock:
+            if self._po_loads is None or self._po_loads == loads:
+                self._po_loads = loads
+                return False
+            self._po_loads = loads
+            self._revalidate_all = True
+            self._idle.clear()
+        return True
+
+    def wait_idle(self, timeout=None):
+        """Block until queued changes are processed; returns False on timeout"""
+        return self._idle.wait(timeout)
+
+    def _run(self):
+        """Background loop: coalesce queued changes, then re-validate in batches"""
+        try:
+            self.index.rebuild()
+        except Exception as e:
+            logger.error(f"Error building revalidation index: {str(e)}")
+        self._check_po_loads()
+
+        while not self._stopped:
+            woken = self._wakeup.wait(PO_LOAD_POLL_SECONDS)
+            if self._stopped:
+                break
+            if not self._check_po_loads() and not woken:
+                continue
+            # Let bursts (e.g. several line items from one upload) coalesce
+            time.sleep(self.delay)
+            self._wakeup.clear()
+            try:
+                self._process()
+            except Exception as e:
+                logger.error(f"Error revalidating invoices: {str(e)}")
+            with self._lock:
+                if not self._pending_keys and not self._pending_invoices and not self._revalidate_all:
+                    self._idle.set()
+
+    def _process(self):
+        """Resolve queued PO keys to invoices and re-validate them"""
+        if not self.index.built:
+            self.index.rebuild()
+
+        with self._lock:
+            keys, self._pending_keys = self._pending_keys, {}
+            if self._revalidate_all:
+                self._revalidate_all = False
+                self._pending_invoices |= self.index.invoice_ids()
+        for (vendor, item), excluded in keys.items():
+            affected = self.index.affected(vendor, item) - excluded
+            with self._lock:
+                self.coalesced += len(affected & self._pending_invoices)
+                self._pending_invoices |= affected
+
+        while True:
+            with self._lock:
+                batch = [self._pending_invoices.pop()
+                         for _ in range(min(self.batch_size, len(self._pending_invoices)))]
+            if not batch:
+                break
+            self._revalidate(batch)
+
+    def _revalidate(self, invoice_ids):
+        """Re-validate a batch of invoices against one fetch of the POs"""
+        rows = execute_query(f"""
+            SELECT invoice_id, vendor, item, qty, unit_price, total, date, status, validation_result
+            FROM invoices
+            WHERE invoice_id IN ({', '.join('?' * len(invoice_ids))})
+        """, invoice_ids)
+        # Large tables: each invoice retrieves its own candidates; otherwise
+        # one fetch of the POs is shared (and date-filtered per invoice)
+        pos = None if po_candidate_index.retrieves() else execute_query(
+            "SELECT * FROM purchase_orders ORDER BY date DESC"
+        )
+
+        updates = []
+        changes = []
+        for row in rows:
+            if row['status'] not in REVALIDATE_STATUSES:
+                continue
+            invoice_data = stored_invoice_data(row)
+            validation_result = self.validator.validate_invoice_against_pos(invoice_data, pos, row['invoice_id'])
+            if validation_result.get('status') == 'error':
+                continue
+            status = validation_result.get('summary', {}).get('status', 'pending')
+            updates.append((status, matched_po_id(validation_result), json.dumps(validation_result),
+                            row['invoice_id'], *REVALIDATE_STATUSES))
+            changes.append((row, invoice_data, validation_result, status))
+
+        if not updates:
+            return
+        conn = get_db_connection()
+        try:
+            conn.executemany(f"""
+                UPDATE invoices SET status = ?, po_id = ?, validation_result = ?
+                WHERE invoice_id = ? AND status IN ({', '.join('?' * len(REVALIDATE_STATUSES))})
+            """, updates)
+            conn.commit()
+        finally:
+            conn.close()
+        bump_data_version(['invoices'], ['invoices'])
+
+        for row, invoice_data, validation_result, status in changes:
+            vendor_resolver.learn(invoice_data.get('vendor'), validation_result)
+            items = [item.get('item') for item in invoice_data.get('line_items', [])] or [row['item']]
+            self.index.track(row['invoice_id'], row['vendor'], items, status)
+            if status != row['status']:
+                self.status_changes += 1
+                publish_event('revalidation', {
+                    'invoice_id': row['invoice_id'],
+                    'vendor': row['vendor'],
+                    'previous_status': row['status'],
+                    'status': status
+                })
+        self.revalidated += len(updates)
+        logger.info(f"Revalidated {len(updates)} invoices after PO changes")
+
+    def get_stats(self):
+        """Get queue and index counters"""
+        with self._lock:
+            pending = len(self._pending_keys) + len(self._pending_invoices)
+        return {
+            'enabled': REVALIDATION_ENABLED,
+            'indexed_invoices': self.index.size(),
+            'pending': pending,
+            'po_changes': self.po_changes,
+            'coalesced': self.coalesced,
+            'revalidated': self.revalidated,
+            'status_changes': self.status_changes
+        }
+
+revalidation_index = RevalidationIndex()
+revalidation_worker = RevalidationWorker(revalidation_index)
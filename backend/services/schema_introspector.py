@@ -0,0 +1,186 @@
+from models.db_setup import read_connection
+from services.sql_guard import QUERYABLE_TABLES
+from services.translation_cache import schema_hash
+import os
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# What each table holds, most useful first (trimming drops tables from the
+# end); columns always come from the live schema
+TABLE_DESCRIPTIONS = {
+    'purchase_orders': 'Purchase order lines with vendor, item, quantity, prices and order date',
+    'invoices': 'Invoice lines with vendor, item details, matched po_id and validation status',
+    'leaderboard': 'Team performance metrics and scores',
+    'query_history': 'History of natural language queries and their SQL translations'
+}
+
+SCHEMA_TOKEN_BUDGET = int(os.environ.get('SCHEMA_TOKEN_BUDGET', 600))
+SCHEMA_STATS_TTL_SECONDS = int(os.environ.get('SCHEMA_STATS_TTL_SECONDS', 600))
+STATS_SAMPLE_ROWS = 5000   # Rows scanned per table for distinct counts and samples
+SAMPLE_VALUES = 3
+SAMPLE_VALUE_MAX_CHARS = 24
+
+def estimate_tokens(text):
+    """Rough token count for prompt budgeting (~4 characters per token)"""
+    return (len(text) + 3) // 4
+
+class SchemaIntrospector:
+    """
+    Builds the GPT schema context from sqlite_master and PRAGMA table_info.
+    Column stats (distinct-count estimate, sample values) come from a bounded
+    sample of each table. The prompt text is cached until PRAGMA
+    schema_version changes (any migration) or the stats age out, and is
+    trimmed to a token budget by dropping samples, then stats, then falling
+    back to one line per table, then dropping tables.
+    """
+
+    def __init__(self, tables=QUERYABLE_TABLES, token_budget=SCHEMA_TOKEN_BUDGET,
+                 stats_ttl_seconds=SCHEMA_STATS_TTL_SECONDS):
+        self.tables = set(tables)
+        self.token_budget = token_budget
+        self.stats_ttl_seconds = stats_ttl_seconds
+        self._lock = threading.Lock()
+        self._schema_version = None
+        self._loaded_at = 0
+        self._tables = {}
+        self._description = None
+        self._structure_hash = None
+
+    def describe(self):
+        """Get the compact schema description for translation prompts"""
+        self._refresh()
+        return self._description
+
+    def structure_hash(self):
+        """Hash of table/column names and types only (stable across data changes)"""
+        self._refresh()
+        return self._structure_hash
+
+    def get_tables(self):
+        """Get {table: {'row_count', 'columns'}} for the introspected tables"""
+        self._refresh()
+        return self._tables
+
+    def _refresh(self):
+        """Re-introspect when the schema changed or the column stats are stale"""
+        with read_connection() as conn:
+            schema_version = conn.execute('PRAGMA schema_version').fetchone()[0]
+            if (schema_version == self._schema_version
+                    and time.monotonic() - self._loaded_at < self.stats_ttl_seconds):
+                return
+
+            with self._lock:
+                if (schema_version == self._schema_version
+                        and time.monotonic() - self._loaded_at < self.stats_ttl_seconds):
+                    return
+
+                tables = self._introspect(conn)
+                structure = '\n'.join(
+                    table + '(' + ', '.join(column['name'] + ' ' + column['type'] for column in info['columns']) + ')'
+                    for table, info in tables.items()
+                )
+
+                self._tables = tables
+                self._structure_hash = schema_hash(structure)
+                self._description = self._render(tables)
+                self._schema_version = schema_version
+                self._loaded_at = time.monotonic()
+
+        logger.info(f"Schema context rebuilt for {len(tables)} tables "
+                    f"(~{estimate_tokens(self._description)} tokens)")
+
+    def _introspect(self, conn):
+        """Read tables, columns and sampled column stats from the live database"""
+        table_names = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        ) if row[0] in self.tables]
+        priority = list(TABLE_DESCRIPTIONS)
+        table_names.sort(key=lambda name: priority.index(name) if name in priority else len(priority))
+
+        tables = {}
+        for table in table_names:
+            columns = [{
+                'name': row[1],
+                'type': (row[2] or 'ANY').upper(),
+                'primary_key': bool(row[5])
+            } for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+            for column in columns:
+                column.update(self._column_stats(conn, table, column['name']))
+            tables[table] = {
+                'row_count': conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0],
+                'columns': columns
+            }
+        return tables
+
+    def _column_stats(self, conn, table, column):
+        """Distinct count and a few common values from a bounded row sample"""
+        sample = f'(SELECT "{column}" AS value FROM "{table}" LIMIT {STATS_SAMPLE_ROWS})'
+        distinct, sampled = conn.execute(
+            f'SELECT COUNT(DISTINCT value), COUNT(*) FROM {sample}'
+        ).fetchone()
+        values = [row[0] for row in conn.execute(f'''
+            SELECT value FROM {sample}
+            WHERE value IS NOT NULL
+            GROUP BY value ORDER BY COUNT(*) DESC, value
+            LIMIT {SAMPLE_VALUES}
+        ''')]
+        return {
+            'distinct': distinct,
+            'distinct_exact': sampled < STATS_SAMPLE_ROWS,
+            'samples': values
+        }
+
+    def _render(self, tables):
+        """Render at the most detailed level that fits the token budget"""
+        for detail in ('full', 'stats', 'names', 'compact'):
+            text = self._render_level(tables, detail)
+            if estimate_tokens(text) <= self.token_budget:
+                return text
+
+        # Still too long: keep whole tables while they fit
+        blocks = []
+        for table in tables:
+            block = self._render_level({table: tables[table]}, 'compact')
+            if blocks and estimate_tokens('\n'.join(blocks + [block])) > self.token_budget:
+                break
+            blocks.append(block)
+        return '\n'.join(blocks)
+
+    def _render_level(self, tables, detail):
+        """Render tables as blocks with one line per column (or one line per table)"""
+        blocks = []
+        for table, info in tables.items():
+            if detail == 'compact':
+                blocks.append(f"{table}(" + ', '.join(f"{column['name']} {column['type']}"
+                                                     for column in info['columns']) + ')')
+                continue
+            
+            lines = [f"Table {table} ({info['row_count']} rows): {TABLE_DESCRIPTIONS.get(table, '')}".rstrip(': ')]
+            for column in info['columns']:
+                line = f"  {column['name']} {column['type']}"
+                if column['primary_key']:
+                    line += ' PK'
+                if detail in ('full', 'stats') and column['distinct']:
+                    line += f" {'' if column['distinct_exact'] else '~'}{column['distinct']} distinct"
+                if detail == 'full' and column['samples']:
+                    line += ' e.g. ' + ', '.join(_format_sample(value) for value in column['samples'])
+                lines.append(line)
+            blocks.append('\n'.join(lines))
+        return '\n'.join(blocks)
+
+def _format_sample(value):
+    """Short literal for a sample value"""
+    if isinstance(value, str):
+        text = value if len(value) <= SAMPLE_VALUE_MAX_CHARS else value[:SAMPLE_VALUE_MAX_CHARS] + '...'
+        return "'" + text.replace('\n', ' ') + "'"
+    if isinstance(value, bytes):
+        return '<blob>'
+    return repr(value)
+
+schema_introspector = SchemaIntrospector()
@@ -0,0 +1,343 @@
+from models.db_setup import read_connection, get_table_versions, get_table_rewrites, infer_column_types, QUERY_MAX_ROWS
+import numpy as np
+import os
+import re
+import threading
+import time
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SPEND_CUBE_ENABLED = os.environ.get('SPEND_CUBE', '1').lower() not in ('0', 'false', 'no')
+LOAD_BATCH_SIZE = 100000
+
+_DATE_CONDITION_PATTERN = re.compile(r'^date\s*(>=|<=|<|>|=)\s*(.+)$')
+_ISO_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+_LIMIT_PATTERN = re.compile(r'\bLIMIT\s+(\d+)\s*$', re.IGNORECASE)
+
+_COMPARATORS = {
+    '>=': np.greater_equal, '<=': np.less_equal,
+    '>': np.greater, '<': np.less, '=': np.equal
+}
+
+class _Dictionary:
+    """String <-> dense integer code mapping for dictionary encoding"""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def encode(self, values):
+        codes = self.codes
+        out = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self.values)
+                self.values.append(value)
+            out[i] = code
+        return out
+
+def _date_ordinals(dates):
+    """Days since 1970-01-01 per ISO date string; -1 for anything else"""
+    # NumPy also accepts '2024-09' or timestamps, so only bulk-parse plain dates
+    if all(isinstance(value, str) and len(value) == 10 for value in dates):
+        try:
+            return np.array(dates, dtype='datetime64[D]').astype(np.int32)
+        except ValueError:
+            pass
+
+    out = np.full(len(dates), -1, dtype=np.int32)
+    for i, value in enumerate(dates):
+        if isinstance(value, str) and _ISO_DATE_PATTERN.match(value):
+            try:
+                out[i] = np.datetime64(value, 'D').astype(np.int32)
+            except ValueError:
+                pass
+    return out
+
+class SpendCube:
+    """
+    Columnar in-memory copy of purchase_orders for spend aggregates.
+    Vendors and items are dictionary-encoded to int32 codes, dates are day
+    ordinals and totals float64, held in growable NumPy arrays. Appended
+    rows are synced incrementally when the table's write version changes;
+    updates, deletes or upserts trigger a background rebuild, during which
+    callers fall back to SQL. Matched router intents are answered with
+    vectorized masks and bincount group-bys.
+    """
+
+    def __init__(self, table='purchase_orders'):
+        self.table = table
+        self._lock = threading.Lock()
+        self._reset()
+        self._rebuilding = False
+        self.answered = 0
+        self.declined = 0
+
+    def _reset(self):
+        self.size = 0
+        self.vendors = _Dictionary()
+        self.items = _Dictionary()
+        self.vendor_codes = np.empty(0, dtype=np.int32)
+        self.item_codes = np.empty(0, dtype=np.int32)
+        self.dates = np.empty(0, dtype=np.int32)
+        self.totals = np.empty(0, dtype=np.float64)
+        self.qtys = np.empty(0, dtype=np.float64)
+        self.irregular_dates = 0
+        self.last_rowid = 0
+        self.version = None
+        self.rewrites = None
+        self.ready = False
+
+    def _append(self, rows):
+        """Encode a batch of (rowid, vendor, item, qty, total, date) rows onto the arrays"""
+        if not rows:
+            return
+        rowids, vendors, items, qtys, totals, dates = zip(*rows)
+        needed = self.size + len(rows)
+        if needed > len(self.totals):
+            capacity = max(needed, int(len(self.totals) * 1.5), 1024)
+            for name in ('vendor_codes', 'item_codes', 'dates', 'totals', 'qtys'):
+                grown = np.empty(capacity, dtype=getattr(self, name).dtype)
+                grown[:self.size] = getattr(self, name)[:self.size]
+                setattr(self, name, grown)
+
+        ordinals = _date_ordinals(dates)
+        window = slice(self.size, needed)
+        self.vendor_codes[window] = self.vendors.encode(vendors)
+        self.item_codes[window] = self.items.encode(items)
+        self.dates[window] = ordinals
+        self.totals[window] = np.array(totals, dtype=np.float64)
+        self.qtys[window] = np.array(qtys, dtype=np.float64)
+        self.irregular_dates += int(np.count_nonzero(ordinals < 0))
+        self.size = needed
+        self.last_rowid = max(self.last_rowid, max(rowids))
+
+    def _load_since(self, conn, rowid):
+        """Append every row with a rowid above the given one"""
+        cursor = conn.execute(f'''
+            SELECT rowid, vendor, item, qty, total, date
+            FROM {self.table}
+            WHERE rowid > ?
+            ORDER BY rowid
+        ''', (rowid,))
+        while True:
+            rows = cursor.fetchmany(LOAD_BATCH_SIZE)
+            if not rows:
+                break
+            self._append(rows)
+
+    def rebuild(self):
+        """Load the whole table from scratch"""
+        start = time.monotonic()
+        with self._lock:
+            try:
+                version = get_table_versions([self.table])
+                rewrites = get_table_rewrites(self.table)
+                self._reset()
+                with read_connection() as conn:
+                    self._load_since(conn, 0)
+                self.version = version
+                self.rewrites = rewrites
+                self.ready = True
+            finally:
+                # A failed rebuild leaves the cube not ready, so the next sync retries
+                self._rebuilding = False
+        logger.info(f"Spend cube built with {self.size} rows, {len(self.vendors.values)} vendors "
+                    f"in {time.monotonic() - start:.2f}s")
+
+    def rebuild_async(self):
+        """Rebuild in a background thread (answers fall back to SQL meanwhile)"""
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+            self.ready = False
+        threading.Thread(target=self.rebuild, name='spend-cube-rebuild', daemon=True).start()
+
+    def sync(self):
+        """
+        Bring the cube up to date. Returns True when it can answer now.
+        Appends are loaded inline; anything else schedules a rebuild.
+        """
+        if not self.ready:
+            if not self._rebuilding:
+                self.rebuild_async()
+            return False
+
+        version = get_table_versions([self.table])
+        if version == self.version:
+            return True
+
+        if get_table_rewrites(self.table) != self.rewrites:
+            self.rebuild_async()
+            return False
+
+        with self._lock:
+            if not self.ready:
+                return False
+            if version != self.version:
+                with read_connection() as conn:
+                    self._load_since(conn, self.last_rowid)
+                    count = conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+                self.version = version
+                if count != self.size:
+                    # Rows changed in a way the write tracking did not see
+                    self.ready = False
+        if not self.ready:
+            self.rebuild_async()
+        return self.ready
+
+    def answer(self, intent, parameters, sql_query, columnar=False):
+        """
+        Answer a routed intent from the cube.
+        Returns a governed-query-shaped result dict, or None to use SQL.
+        """
+        handler = _INTENT_HANDLERS.get(intent)
+        if handler is None or not SPEND_CUBE_ENABLED or not self.sync():
+            return None
+
+        start = time.monotonic()
+        with self._lock:
+            mask = self._filter_mask(parameters)
+            if mask is None:
+                self.declined += 1
+                return None
+            columns, rows = handler(self, mask)
+            self.answered += 1
+
+        limit = _LIMIT_PATTERN.search(sql_query)
+        if limit:
+            rows = rows[:int(limit.group(1))]
+        truncated = len(rows) > QUERY_MAX_ROWS
+        rows = rows[:QUERY_MAX_ROWS]
+
+        return {
+            'results': [tuple(row) for row in rows] if columnar else [dict(zip(columns, row)) for row in rows],
+            'columns': columns,
+            'column_types': infer_column_types(columns, rows) if columnar else None,
+            'row_count': len(rows),
+            'truncated': truncated,
+            'timed_out': False,
+            'limit_exceeded': None,
+            'max_rows': QUERY_MAX_ROWS,
+            'elapsed_ms': round((time.monotonic() - start) * 1000, 3)
+        }
+
+    def _filter_mask(self, parameters):
+        """Boolean row mask for the intent's filters, or None if the cube cannot apply them"""
+        n = self.size
+        mask = np.ones(n, dtype=bool)
+
+        if parameters.get('date'):
+            if self.irregular_dates:
+                return None  # Text comparison semantics differ for non-ISO dates
+            bounds = _resolve_date_conditions(parameters['date'])
+            if bounds is None:
+                return None
+            for operator, ordinal in bounds:
+                mask &= _COMPARATORS[operator](self.dates[:n], ordinal)
+
+        if parameters.get('vendor'):
+            code = self.vendors.codes.get(parameters['vendor'])
+            if code is None:
+                return np.zeros(n, dtype=bool)
+            mask &= self.vendor_codes[:n] == code
+
+        if parameters.get('amount'):
+            operator, amount = parameters['amount']
+            mask &= _COMPARATORS[operator](self.totals[:n], amount)
+
+        return mask
+
+    def get_stats(self):
+        """Get cube size and usage counters"""
+        return {
+            'enabled': SPEND_CUBE_ENABLED,
+            'ready': self.ready,
+            'rows': self.size,
+            'vendors': len(self.vendors.values),
+            'items': len(self.items.values),
+            'bytes': int(sum(getattr(self, name).nbytes for name in
+                             ('vendor_codes', 'item_codes', 'dates', 'totals', 'qtys'))),
+            'answered': self.answered,
+            'declined': self.declined
+        }
+
+def _resolve_date_conditions(conditions):
+    """Turn router date conditions into (operator, day ordinal) pairs using SQLite's date functions"""
+    parsed = []
+    for condition in conditions:
+        match = _DATE_CONDITION_PATTERN.match(condition.strip())
+        if not match:
+            return None
+        parsed.append(match.groups())
+
+    with read_connection() as conn:
+        values = conn.execute(
+            'SELECT ' + ', '.join(expression for _, expression in parsed)
+        ).fetchone()
+
+    bounds = []
+    for (operator, _), value in zip(parsed, values):
+        if not isinstance(value, str) or not _ISO_DATE_PATTERN.match(value):
+            return None
+        bounds.append((operator, int(np.datetime64(value, 'D').astype(np.int32))))
+    return bounds
+
+def _grouped(codes, mask, dictionary, weights=None):
+    """Per-code row counts (and weighted sums) over the masked rows"""
+    selected = codes[mask]
+    counts = np.bincount(selected, minlength=len(dictionary.values))
+    sums = np.bincount(selected, weights=weights[mask], minlength=len(dictionary.values)) if weights is not None else None
+    present = np.nonzero(counts)[0]
+    return present, counts, sums
+
+def _ranked(present, key):
+    """Present group codes ordered by key descending"""
+    return present[np.argsort(-key[present], kind='stable')]
+
+def _spend_by_vendor(cube, mask):
+    n = cube.size
+    present, _, sums = _grouped(cube.vendor_codes[:n], mask, cube.vendors, cube.totals[:n])
+    return ['vendor', 'total_spend'], [
+        (cube.vendors.values[code], float(sums[code])) for code in _ranked(present, sums)
+    ]
+
+def _vendor_order_count(cube, mask):
+    n = cube.size
+    present, counts, _ = _grouped(cube.vendor_codes[:n], mask, cube.vendors)
+    return ['vendor', 'order_count'], [
+        (cube.vendors.values[code], int(counts[code])) for code in _ranked(present, counts)
+    ]
+
+def _top_items(cube, mask):
+    n = cube.size
+    present, counts, qty_sums = _grouped(cube.item_codes[:n], mask, cube.items, cube.qtys[:n])
+    # Fractional quantities are kept, whole sums are reported as integers like SQL's SUM
+    return ['item', 'order_count', 'total_qty'], [
+        (cube.items.values[code], int(counts[code]),
+         int(qty_sums[code]) if qty_sums[code].is_integer() else float(qty_sums[code]))
+        for code in _ranked(present, counts)
+    ]
+
+def _average_order_value(cube, mask):
+    selected = cube.totals[:cube.size][mask]
+    return ['average_order_value'], [(float(selected.mean()) if len(selected) else None,)]
+
+def _purchase_order_totals(cube, mask):
+    selected = cube.totals[:cube.size][mask]
+    return ['total_pos', 'total_value'], [(int(len(selected)), float(selected.sum()) if len(selected) else None)]
+
+_INTENT_HANDLERS = {
+    'spend_by_vendor': _spend_by_vendor,
+    'vendor_order_count': _vendor_order_count,
+    'top_items': _top_items,
+    'average_order_value': _average_order_value,
+    'purchase_order_totals': _purchase_order_totals
+}
+
+spend_cube = SpendCube()
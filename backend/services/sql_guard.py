@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from models.db_setup import read_connection
+from services.result_cache import normalize_sql, strip_sql_comments
+import re
+import sqlite3
+import threading
+
+# Tables user and generated SQL may read
+QUERYABLE_TABLES = {'purchase_orders', 'invoices', 'leaderboard', 'query_history'}
+
+# Authorizer actions a read query needs; anything else is denied
+ALLOWED_ACTIONS = {sqlite3.SQLITE_SELECT, sqlite3.SQLITE_READ, sqlite3.SQLITE_FUNCTION, sqlite3.SQLITE_RECURSIVE}
+
+# Names defined by WITH clauses: `[WITH [RECURSIVE] | ,] name [(columns)] AS [[NOT] MATERIALIZED] (`
+_CTE_NAME_PATTERN = re.compile(
+    r'(?:\bWITH(?:\s+RECURSIVE)?|,)\s*("(?:[^"]|"")+"|`(?:[^`]|``)+`|\[[^\]]+\]|\w+)'
+    r'\s*(?:\([^()]*\))?\s*AS\s*(?:(?:NOT\s+)?MATERIALIZED\s*)?\(',
+    re.IGNORECASE
+)
+
+def cte_names(sql_query):
+    """Lower-cased names the statement's WITH clauses define"""
+    names = set()
+    for name in _CTE_NAME_PATTERN.findall(strip_sql_comments(sql_query)):
+        if name[0] in '"`[':
+            name = name[1:-1].replace(name[0] * 2, name[0]) if name[0] != '[' else name[1:-1]
+        names.add(name.lower())
+    return names
+
+class SQLGuard:
+    """
+    Validates SQL by compiling it on a pooled read-only connection under a sqlite3
+    authorizer that only permits SELECT/READ (on whitelisted tables and the
+    statement's own CTEs), function calls and recursive CTEs. SQLite reports
+    every table and action the statement touches, so column names like
+    last_updated or created_at are no longer mistaken for UPDATE/CREATE.
+    The exact text is compiled, and authorizer(sql_query) enforces the same
+    rules on the connection that runs it.
+    Verdicts are kept in an LRU keyed by normalized SQL text (comments
+    stripped), except errors like "no such table", which a later schema
+    change can fix.
+    """
+
+    def __init__(self, allowed_tables=QUERYABLE_TABLES, max_entries=1024):
+        self.allowed_tables = set(allowed_tables)
+        self.max_entries = max_entries
+        self._verdicts = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, sql_query):
+        """
+        Check that sql_query is a single read-only statement over allowed tables.
+        Returns (allowed, reason) where reason explains a rejection.
+        """
+        if not sql_query or not sql_query.strip():
+            return False, 'Empty SQL query provided'
+
+        key = normalize_sql(sql_query)
+        with self._lock:
+            entry = self._verdicts.get(key)
+            if entry is not None:
+                self._verdicts.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        verdict, ctes, cacheable = self._compile(sql_query)
+
+        if cacheable:
+            with self._lock:
+                self._verdicts[key] = (verdict, ctes)
+                while len(self._verdicts) > self.max_entries:
+                    self._verdicts.popitem(last=False)
+        return verdict
+
+    def authorizer(self, sql_query):
+        """
+        sqlite3 authorizer enforcing the guard on the connection that
+        executes sql_query (which validate() has accepted)
+        """
+        with self._lock:
+            entry = self._verdicts.get(normalize_sql(sql_query))
+        ctes = entry[1] if entry is not None else self._compile(sql_query)[1]
+        return self._make_authorizer(ctes)
+
+    def _make_authorizer(self, ctes, denied=None):
+        """Authorizer allowing reads of whitelisted tables and of the given CTE names"""
+        def authorize(action, arg1, arg2, db_name, trigger_name):
+            if action not in ALLOWED_ACTIONS:
+                if denied is not None:
+                    denied.append('Only read-only SELECT statements are allowed')
+                return sqlite3.SQLITE_DENY
+            if (action == sqlite3.SQLITE_READ and arg1 not in self.allowed_tables
+                    and (arg1 or '').lower() not in ctes):
+                if denied is not None:
+                    denied.append(f'Table "{arg1}" is not available for queries')
+                return sqlite3.SQLITE_DENY
+            return sqlite3.SQLITE_OK
+        return authorize
+
+    def _compile(self, sql_query):
+        """
+        Prepare the exact statement via EXPLAIN so the authorizer sees it
+        without running it. Returns ((allowed, reason), ctes, cacheable),
+        where ctes are the CTE names it may read (those shadowing no real
+        table, view or table-valued function).
+        """
+        denied = []
+
+        with read_connection() as conn:
+            ctes = {name for name in cte_names(sql_query) if not self._resolves(conn, name)}
+            conn.set_authorizer(self._make_authorizer(ctes, denied))
+            try:
+                conn.execute('EXPLAIN ' + sql_query).fetchone()
+                return (True, None), ctes, True
+            except (sqlite3.Warning, sqlite3.ProgrammingError):
+                return (False, 'Only a single SQL statement is allowed'), ctes, True
+            except sqlite3.DatabaseError as e:
+                # Authorizer denials surface as "not authorized"; report why
+                if denied:
+                    return (False, denied[0]), ctes, True
+                return (False, f'Invalid SQL: {str(e)}'), ctes, 'syntax error' in str(e)
+
+    @staticmethod
+    def _resolves(conn, name):
+        """Whether a name outside any WITH clause refers to something in the database"""
+        try:
+            conn.execute('EXPLAIN SELECT * FROM "{}"'.format(name.replace('"', '""'))).fetchone()
+        except sqlite3.OperationalError as e:
+            return 'no such table' not in str(e)
+        return True
+
+    def clear(self):
+        """Forget all cached verdicts (e.g. after a schema change)"""
+        with self._lock:
+            self._verdicts.clear()
+
+    def get_stats(self):
+        """Get verdict cache statistics"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._verdicts),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0
+            }
+
+sql_guard = SQLGuard()
@@ -0,0 +1,166 @@
+from collections import OrderedDict
+from openai import OpenAI
+from services.translation_cache import normalize_question
+import os
+import re
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are a SQL expert that converts natural language to SQL queries."
+
+PROMPT_TEMPLATE = """
+You are a SQL expert. Convert the following natural language query to SQL.
+
+Database Schema:
+{schema_description}
+
+Rules:
+1. Only use SELECT statements
+2. Use proper SQLite syntax
+3. Return only the SQL query, no explanations
+4. Use appropriate JOINs when needed
+5. Include proper GROUP BY and ORDER BY clauses
+6. Use date functions like date('now', '-3 months') for relative dates
+
+Natural Language Query: {natural_query}
+
+SQL Query:"""
+
+class _Flight:
+    """An upstream call that identical concurrent questions wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.status = None
+
+class GPT4Translator:
+    """
+    Long-lived GPT-4 translator with a shared OpenAI client.
+    Identical in-flight questions are coalesced into one upstream call,
+    concurrent upstream calls are capped by a semaphore, and requests that
+    cannot get a slot quickly are shed so the caller falls back to the
+    local intent router.
+    """
+
+    def __init__(self, api_key, model='gpt-4', timeout=15.0, max_concurrency=4,
+                 queue_timeout=0.5, base_url=None):
+        self.model = model
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=1)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self.stats = {'upstream_calls': 0, 'coalesced': 0, 'shed': 0, 'errors': 0}
+
+    def translate(self, natural_query, schema_description):
+        """
+        Translate a question to SQL text.
+        Returns (sql_query, status) where status is 'ok', 'coalesced', 'shed'
+        or 'error'; sql_query is None unless the upstream call succeeded.
+        """
+        key = (normalize_question(natural_query), schema_description)
+
+        with self._lock:
+            flight = self._in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._in_flight[key] = flight
+            else:
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            # Wait for the leader's call, bounded by the upstream timeout
+            if not flight.done.wait(self.queue_timeout + self.timeout * 2):
+                return None, 'error'
+            return flight.result, 'coalesced' if flight.result else flight.status
+
+        try:
+            flight.result, flight.status = self._call_upstream(natural_query, schema_description)
+            return flight.result, flight.status
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            flight.done.set()
+
+    def _call_upstream(self, natural_query, schema_description):
+        """Make one bounded chat completion call"""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self.stats['shed'] += 1
+            logger.warning("GPT-4 translator saturated, shedding request to local router")
+            return None, 'shed'
+
+        try:
+            with self._lock:
+                self.stats['upstream_calls'] += 1
+
+            response = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": PROMPT_TEMPLATE.format(
+                        schema_description=schema_description,
+                        natural_query=natural_query
+                    )}
+                ],
+                max_tokens=200,
+                temperature=0.1
+            )
+
+            sql_query = response.choices[0].message.content.strip()
+
+            # Clean up the response
+            sql_query = re.sub(r'^```sql\s*', '', sql_query)
+            sql_query = re.sub(r'\s*```$', '', sql_query)
+            return sql_query.strip(), 'ok'
+
+        except Exception as e:
+            with self._lock:
+                self.stats['errors'] += 1
+            logger.error(f"GPT-4 translation error: {str(e)}")
+            return None, 'error'
+        finally:
+            self._slots.release()
+
+    def get_stats(self):
+        """Get call, coalescing and shedding counters"""
+        with self._lock:
+            return dict(self.stats)
+
+_translators = OrderedDict()
+_translators_lock = threading.Lock()
+MAX_TRANSLATORS = 8  # Distinct API keys kept alive (keys may come per request)
+
+def get_translator(api_key):
+    """Get the shared translator for an API key, or None without a key"""
+    if not api_key:
+        return None
+
+    with _translators_lock:
+        translator = _translators.get(api_key)
+        if translator is None:
+            try:
+                translator = GPT4Translator(
+                    api_key,
+                    model=os.environ.get('OPENAI_MODEL', 'gpt-4'),
+                    timeout=float(os.environ.get('OPENAI_TIMEOUT_SECONDS', 15)),
+                    max_concurrency=int(os.environ.get('OPENAI_MAX_CONCURRENCY', 4)),
+                    queue_timeout=float(os.environ.get('OPENAI_QUEUE_TIMEOUT_SECONDS', 0.5)),
+                    base_url=os.environ.get('OPENAI_BASE_URL') or None
+                )
+            except Exception as e:
+                logger.warning(f"Failed to initialize OpenAI client: {e}")
+                return None
+            _translators[api_key] = translator
+            while len(_translators) > MAX_TRANSLATORS:
+                _translators.popitem(last=False)
+        else:
+            _translators.move_to_end(api_key)
+        return translator
@@ -0,0 +1,163 @@
+from collections import OrderedDict
+from models.db_setup import execute_query, get_db_connection, bump_data_version
+import hashlib
+import re
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Filler words that do not change what a question asks for.
+# Negations, comparisons and quantities are deliberately kept.
+STOPWORDS = {
+    'a', 'an', 'the', 'me', 'us', 'i', 'we', 'you', 'my', 'our', 'please',
+    'show', 'give', 'tell', 'display', 'get', 'find', 'list', 'what', 'whats',
+    'which', 'is', 'are', 'was', 'were', 'do', 'does', 'can', 'could', 'would',
+    'of', 'for', 'to', 'in', 'on', 'by', 'with', 'and', 'there', 'that'
+}
+
+def normalize_question(natural_query):
+    """
+    Normalize a question for cache lookup: case-folded, punctuation and
+    whitespace collapsed, stopwords removed
+    """
+    text = natural_query.casefold()
+    text = re.sub(r"[^\w\s$]", ' ', text)
+    words = [word for word in text.split() if word not in STOPWORDS]
+    # Fall back to the collapsed text if everything was a stopword
+    return ' '.join(words) or ' '.join(text.split())
+
+def schema_hash(schema_description):
+    """Hash of the schema (structure) text that cached translations were made against"""
+    return hashlib.sha1(schema_description.encode('utf-8')).hexdigest()
+
+class TranslationCache:
+    """
+    NL-to-SQL translation cache keyed by normalized question.
+    Held in memory with LRU eviction and persisted to the translation_cache
+    table. Entries made against a different schema are discarded.
+    """
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._schema_hash = None
+        self.hits = 0
+        self.misses = 0
+
+    def ensure_loaded(self, current_schema_hash, sql_validator=None):
+        """
+        Load persisted translations for the current schema, seeding from
+        query_history on first load. A schema change invalidates everything.
+        """
+        if self._schema_hash == current_schema_hash:
+            return
+
+        with self._lock:
+            if self._schema_hash == current_schema_hash:
+                return
+
+            try:
+                invalidated = execute_query("DELETE FROM translation_cache WHERE schema_hash != ?", (current_schema_hash,))
+
+                rows = execute_query("""
+                    SELECT normalized_query, sql_query
+                    FROM translation_cache
+                    ORDER BY last_used DESC
+                    LIMIT ?
+                """, (self.max_entries,))
+
+                self._entries = OrderedDict((row['normalized_query'], row['sql_query']) for row in reversed(rows))
+                self._schema_hash = current_schema_hash
+
+                # History was translated against the old schema, so only seed a fresh cache
+                if not rows and not invalidated:
+                    self._seed_from_history(sql_validator)
+
+                logger.info(f"Translation cache loaded with {len(self._entries)} entries")
+            except Exception as e:
+                logger.error(f"Error loading translation cache: {str(e)}")
+                self._entries = OrderedDict()
+                self._schema_hash = current_schema_hash
+
+    def _seed_from_history(self, sql_validator):
+        """Seed from successfully executed queries, most frequent translation per question"""
+        rows = execute_query("""
+            SELECT natural_language_query, sql_query, COUNT(*) as frequency
+            FROM query_history
+            WHERE result_count IS NOT NULL
+            GROUP BY natural_language_query, sql_query
+        """)
+
+        best = {}
+        for row in rows:
+            if sql_validator and not sql_validator(row['sql_query']):
+                continue
+            key = normalize_question(row['natural_language_query'])
+            count, _, _ = best.get(key, (0, None, None))
+            if row['frequency'] > count:
+                best[key] = (row['frequency'], row['natural_language_query'], row['sql_query'])
+
+        seeded = sorted(best.items(), key=lambda item: item[1][0])[-self.max_entries:]
+        for key, (_, natural_query, sql_query) in seeded:
+            self._entries[key] = sql_query
+
+        self._persist([(key, natural_query, sql_query) for key, (_, natural_query, sql_query) in seeded])
+
+    def _persist(self, entries):
+        """Write entries to the translation_cache table"""
+        if not entries:
+            return
+        conn = get_db_connection()
+        try:
+            conn.executemany("""
+                INSERT OR REPLACE INTO translation_cache
+                (normalized_query, natural_language_query, sql_query, schema_hash, last_used)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            """, [(key, natural_query, sql_query, self._schema_hash) for key, natural_query, sql_query in entries])
+            conn.commit()
+            bump_data_version(['translation_cache'], ['translation_cache'])
+        finally:
+            conn.close()
+
+    def get(self, natural_query):
+        """Get the cached SQL for a question, or None"""
+        key = normalize_question(natural_query)
+        with self._lock:
+            sql_query = self._entries.get(key)
+            if sql_query is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return sql_query
+
+    def set(self, natural_query, sql_query):
+        """Cache a translation in memory and persist it"""
+        key = normalize_question(natural_query)
+        with self._lock:
+            self._entries[key] = sql_query
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        try:
+            self._persist([(key, natural_query, sql_query)])
+        except Exception as e:
+            logger.error(f"Error persisting translation: {str(e)}")
+
+    def get_stats(self):
+        """Get cache hit/miss statistics"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0
+            }
+
+translation_cache = TranslationCache()
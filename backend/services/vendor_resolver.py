@@ -0,0 +1,270 @@
+from models.db_setup import get_db_connection, read_connection, get_table_versions, bump_data_version
+from services.fuzzy_memo import fuzzy_memo
+import os
+import threading
+import logging
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+VENDOR_ALIAS_LEARNING = os.environ.get('VENDOR_ALIAS_LEARNING', '1').lower() not in ('0', 'false', 'no')
+# Validation outcomes whose matched vendor is trusted as a new alias
+LEARNED_STATUSES = ('approved', 'approved_with_warnings')
+VENDOR_TABLES = ['vendors', 'vendor_aliases', 'purchase_orders']
+# What the alias list itself depends on (PO inserts only matter for unassigned vendors)
+ALIAS_TABLES = ['vendors', 'vendor_aliases']
+
+def normalize_vendor(name):
+    """Alias key: lower-cased, whitespace-collapsed vendor name"""
+    return ' '.join((name or '').lower().split())
+
+class VendorResolver:
+    """
+    In-memory copy of vendor_aliases (normalized spelling -> canonical vendor
+    id). Known spellings resolve with one dict lookup; unseen ones fall back
+    to fuzzy matching against every alias. Every PO vendor name is an alias
+    of its own canonical vendor, and purchase_orders.vendor_id is assigned
+    from it; invoice spellings are learned from approved validations and can
+    be edited through /api/vendors.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._aliases = {}       # alias -> vendor_id
+        self._alias_keys = []    # aliases in fuzzy-matching order
+        self._alias_ids = []     # vendor_id of each alias key
+        self._names = {}         # vendor_id -> canonical name
+        self._version = None
+        self._alias_version = None
+        self.exact_hits = 0
+        self.fuzzy_lookups = 0
+        self.learned = 0
+
+    def sync(self):
+        """Reload aliases after vendor table writes and give new PO vendors a canonical id"""
+        version = get_table_versions(VENDOR_TABLES)
+        if version == self._version:
+            return
+        with self._lock:
+            if version == self._version:
+                return
+            # Read before the tables: a write in between is picked up next sync
+            alias_version = get_table_versions(ALIAS_TABLES)
+            names, aliases, unassigned = self._read()
+            if unassigned:
+                self._assign_po_vendors(unassigned, aliases)
+                version = get_table_versions(VENDOR_TABLES)
+                alias_version = get_table_versions(ALIAS_TABLES)
+                names, aliases, _ = self._read()
+            # Fuzzy results are memoized by alias version, so the alias list
+            # only changes with it (PO uploads leave it and the memo intact)
+            if alias_version != self._alias_version:
+                self._names = names
+                self._aliases = aliases
+                self._alias_keys = list(aliases)
+                self._alias_ids = [aliases[key] for key in self._alias_keys]
+                self._alias_version = alias_version
+            self._version = version
+
+    def lookup(self, name):
+        """Canonical vendor id of a known spelling, or None"""
+        self.sync()
+        return self._aliases.get(normalize_vendor(name))
+
+    def lookup_many(self, names):
+        """Canonical vendor ids (or None) of many spellings, with one sync"""
+        self.sync()
+        aliases = self._aliases
+        return [aliases.get(normalize_vendor(name)) for name in names]
+
+    def resolve(self, name, threshold):
+        """
+        Canonical vendors a spelling may refer to, as {vendor_id: similarity}.
+        A known alias resolves to its vendor alone at 100; anything else is
+        scored against every alias (memoized per alias version) and keeps
+        each vendor's best score at or above threshold.
+        """
+        self.sync()
+        key = normalize_vendor(name)
+        if not key:
+            return {}
+        with self._lock:
+            vendor_id = self._aliases.get(key)
+            if vendor_id is not None:
+                self.exact_hits += 1
+                return {vendor_id: 100.0}
+            self.fuzzy_lookups += 1
+            alias_ids = self._alias_ids
+            matches = fuzzy_memo.extract(key, self._alias_keys, ('vendor_aliases', self._alias_version), threshold)
+        scores = {}
+        for index, score in matches:
+            vendor_id = alias_ids[index]
+            scores[vendor_id] = max(scores.get(vendor_id, 0.0), score)
+        return scores
+
+    def register(self, name):
+        """Canonical vendor id for a PO vendor name, creating the vendor if it is new"""
+        vendor_id = self.lookup(name)
+        if vendor_id is not None:
+            return vendor_id
+        with self._lock:
+            conn = get_db_connection()
+            try:
+                vendor_id = self._create_vendor(conn, name)
+                conn.commit()
+            finally:
+                conn.close()
+            bump_data_version(['vendors', 'vendor_aliases'])
+        return vendor_id
+
+    def learn(self, invoice_vendor, validation_result):
+        """
+        Record an approved invoice's vendor spelling as an alias of the
+        matched PO's vendor (validated matches already passed the vendor check)
+        """
+        if not VENDOR_ALIAS_LEARNING:
+            return None
+        status = validation_result.get('summary', {}).get('status')
+        matches = validation_result.get('matches') or []
+        key = normalize_vendor(invoice_vendor)
+        if status not in LEARNED_STATUSES or not matches or not key or self.lookup(key) is not None:
+            return None
+        with read_connection() as conn:
+            po = conn.execute('SELECT vendor, vendor_id FROM purchase_orders WHERE po_id = ?',
+                              (matches[0]['po_id'],)).fetchone()
+        if po is None:
+            return None
+        vendor_id = po['vendor_id'] or self.register(po['vendor'])
+        self.add_alias(vendor_id, invoice_vendor, source='learned')
+        self.learned += 1
+        logger.info(f"Learned vendor alias '{key}' for vendor {vendor_id}")
+        return vendor_id
+
+    def add_alias(self, vendor_id, alias, source='manual'):
+        """Map a spelling to a vendor; PO names stay with their own vendor (merge those instead)"""
+        key = normalize_vendor(alias)
+        if not key:
+            raise ValueError('Alias must not be empty')
+        with self._lock:
+            conn = get_db_connection()
+            try:
+                if not conn.execute('SELECT 1 FROM vendors WHERE vendor_id = ?', (vendor_id,)).fetchone():
+                    raise LookupError(f'Vendor {vendor_id} not found')
+                existing = conn.execute(
+                    'SELECT vendor_id, source FROM vendor_aliases WHERE alias = ?', (key,)
+                ).fetchone()
+                if existing and existing['source'] == 'po' and existing['vendor_id'] != vendor_id:
+                    raise ValueError(f"'{key}' is a PO vendor name of vendor {existing['vendor_id']}; "
+                                     f"merge the vendors instead")
+                conn.execute('''
+                    INSERT INTO vendor_aliases (alias, vendor_id, source) VALUES (?, ?, ?)
+                    ON CONFLICT (alias) DO UPDATE SET vendor_id = excluded.vendor_id, source = excluded.source
+                    WHERE vendor_aliases.source != 'po'
+                ''', (key, vendor_id, source))
+                conn.commit()
+            finally:
+                conn.close()
+            bump_data_version(['vendor_aliases'], ['vendor_aliases'])
+        return key
+
+    def remove_alias(self, alias):
+        """Delete a learned or manual alias (PO vendor names cannot be removed)"""
+        key = normalize_vendor(alias)
+        with self._lock:
+            conn = get_db_connection()
+            try:
+                existing = conn.execute('SELECT source FROM vendor_aliases WHERE alias = ?', (key,)).fetchone()
+                if not existing:
+                    raise LookupError(f"Alias '{key}' not found")
+                if existing['source'] == 'po':
+                    raise ValueError(f"'{key}' is a PO vendor name and cannot be removed")
+                conn.execute('DELETE FROM vendor_aliases WHERE alias = ?', (key,))
+                conn.commit()
+            finally:
+                conn.close()
+            bump_data_version(['vendor_aliases'], ['vendor_aliases'])
+        return key
+
+    def merge(self, source_id, target_id):
+        """Fold one canonical vendor into another: its aliases and POs move to the target"""
+        if source_id == target_id:
+            raise ValueError('Cannot merge a vendor into itself')
+        with self._lock:
+            conn = get_db_connection()
+            try:
+                for vendor_id in (source_id, target_id):
+                    if not conn.execute('SELECT 1 FROM vendors WHERE vendor_id = ?', (vendor_id,)).fetchone():
+                        raise LookupError(f'Vendor {vendor_id} not found')
+                conn.execute('UPDATE vendor_aliases SET vendor_id = ? WHERE vendor_id = ?', (target_id, source_id))
+                moved = conn.execute(
+                    'UPDATE purchase_orders SET vendor_id = ? WHERE vendor_id = ?', (target_id, source_id)
+                ).rowcount
+                conn.execute('DELETE FROM vendors WHERE vendor_id = ?', (source_id,))
+                conn.commit()
+            finally:
+                conn.close()
+            # vendor_id is not read by the in-memory PO copies, so POs only count as written
+            bump_data_version(['vendors', 'vendor_aliases', 'purchase_orders'], ['vendors', 'vendor_aliases'])
+        logger.info(f"Merged vendor {source_id} into {target_id} ({moved} POs)")
+        return moved
+
+    def _read(self):
+        """Vendors, aliases and the PO vendor names still without a canonical id"""
+        with read_connection() as conn:
+            names = dict(conn.execute('SELECT vendor_id, name FROM vendors').fetchall())
+            aliases = dict(conn.execute('SELECT alias, vendor_id FROM vendor_aliases ORDER BY alias').fetchall())
+            unassigned = [row[0] for row in conn.execute(
+                'SELECT DISTINCT vendor FROM purchase_orders WHERE vendor_id IS NULL'
+            )]
+        return names, aliases, unassigned
+
+    def _create_vendor(self, conn, name):
+        """Insert a canonical vendor with its PO name as the first alias (or reuse the alias's vendor)"""
+        existing = conn.execute('SELECT vendor_id FROM vendor_aliases WHERE alias = ?',
+                                (normalize_vendor(name),)).fetchone()
+        if existing:
+            return existing[0]
+        vendor_id = conn.execute('INSERT INTO vendors (name) VALUES (?)', (' '.join(name.split()),)).lastrowid
+        conn.execute('INSERT INTO vendor_aliases (alias, vendor_id, source) VALUES (?, ?, ?)',
+                     (normalize_vendor(name), vendor_id, 'po'))
+        return vendor_id
+
+    def _assign_po_vendors(self, vendors, aliases):
+        """Backfill purchase_orders.vendor_id for POs inserted without one"""
+        aliases = dict(aliases)
+        conn = get_db_connection()
+        try:
+            assigned = 0
+            created = 0
+            for vendor in vendors:
+                key = normalize_vendor(vendor)
+                if key not in aliases:
+                    aliases[key] = self._create_vendor(conn, vendor)
+                    created += 1
+                assigned += conn.execute(
+                    'UPDATE purchase_orders SET vendor_id = ? WHERE vendor = ? AND vendor_id IS NULL',
+                    (aliases[key], vendor)
+                ).rowcount
+            conn.commit()
+        finally:
+            conn.close()
+        # vendor_id is not read by the in-memory PO copies, so POs only count as
+        # written; the alias tables (and the fuzzy memo) only change with new vendors
+        bump_data_version(['vendors', 'vendor_aliases', 'purchase_orders'] if created else ['purchase_orders'])
+        logger.info(f"Assigned canonical vendors to {assigned} POs ({len(vendors)} vendor names)")
+
+    def get_stats(self):
+        """Get alias table size and lookup counters"""
+        lookups = self.exact_hits + self.fuzzy_lookups
+        return {
+            'learning_enabled': VENDOR_ALIAS_LEARNING,
+            'vendors': len(self._names),
+            'aliases': len(self._aliases),
+            'exact_hits': self.exact_hits,
+            'fuzzy_lookups': self.fuzzy_lookups,
+            'exact_hit_rate': round(self.exact_hits / lookups, 3) if lookups else 0.0,
+            'learned': self.learned
+        }
+
+vendor_resolver = VendorResolver()
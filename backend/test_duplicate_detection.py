@@ -0,0 +1,71 @@
+import sys
+sys.path.append('.')
+
+# Exercise duplicate detection on a scratch database: an upload that re-sends
+# a stored invoice number must be flagged before it replaces the stored row,
+# while re-validating a stored invoice must not flag it against itself.
+import os
+import tempfile
+import models.db_setup as db_setup
+
+tmp = tempfile.mkdtemp()
+os.chdir(tmp)
+db_setup.DATABASE_PATH = os.path.join(tmp, 'test_duplicate_detection.db')
+
+from app import create_app
+from models.db_setup import execute_query
+from services.duplicate_detector import duplicate_detector
+
+client = create_app().test_client()
+
+stored = {
+    'invoice_number': 'INV-DUP-001',
+    'vendor': 'ABC Electronics',
+    'date': '2024-01-15',
+    'total': 1500.0,
+    'raw_text': 'ABC Electronics invoice INV-DUP-001 dated 2024-01-15 for 3 laptop computers at 500.00 each, '
+                'total due 1500.00, payment terms net 30, remit to 12 Circuit Way'
+}
+execute_query("""
+    INSERT INTO invoices (invoice_id, vendor, item, qty, unit_price, total, date, status)
+    VALUES (?, ?, 'Laptop Computer', 3, 500, 1500, ?, 'approved')
+""", (stored['invoice_number'], stored['vendor'], stored['date']))
+assert duplicate_detector.add(stored['invoice_number'], stored)
+
+def duplicates(invoice_data):
+    response = client.post('/api/invoices/validate', json=invoice_data)
+    assert response.status_code == 200, response.get_json()
+    return [issue for issue in response.get_json()['validation_result']['mismatches']
+            if issue['type'] == 'possible_duplicate']
+
+print("Testing re-sent invoice numbers:")
+print("=" * 50)
+
+cases = {
+    'identical re-send': dict(stored),
+    'changed text': dict(stored, raw_text='Completely different wording for a corrected invoice, amount 1750.00',
+                         total=1750.0),
+    'no text': {key: value for key, value in stored.items() if key != 'raw_text'}
+}
+for name, invoice_data in cases.items():
+    issues = duplicates(invoice_data)
+    print(f"{name}: {[issue['message'] for issue in issues]}")
+    assert any(issue['details']['duplicate_invoice_id'] == 'INV-DUP-001' and issue['details']['same_number']
+               and issue['severity'] == 'high' for issue in issues)
+
+print("\n" + "=" * 50)
+print("Testing other numbers and re-validation:")
+
+rescan = dict(stored, invoice_number='INV-20240115093000')
+issues = duplicates(rescan)
+print(f"renumbered rescan: {[issue['message'] for issue in issues]}")
+assert [issue['details']['same_number'] for issue in issues] == [False]
+
+unrelated = dict(stored, invoice_number='INV-NEW-002', raw_text='XYZ Supplies invoice for office chairs, total 320.00')
+assert duplicates(unrelated) == []
+
+# The stored invoice is not a duplicate of itself
+assert duplicate_detector.mismatches(stored, stored_id='INV-DUP-001') == []
+
+print(f"\nDetector stats: {duplicate_detector.get_stats()}")
+print("\nDuplicate detection test completed!")
@@ -0,0 +1,84 @@
+import sys
+sys.path.append('.')
+
+# Exercise the SQL guard on a scratch database: comments must not hide part
+# of a statement from validation, the executing connection must enforce the
+# same rules, and CTEs (recursive or not) are readable unless they shadow a
+# real table.
+import os
+import sqlite3
+import tempfile
+import models.db_setup as db_setup
+
+tmp = tempfile.mkdtemp()
+os.chdir(tmp)
+db_setup.DATABASE_PATH = os.path.join(tmp, 'test_sql_guard.db')
+
+from app import create_app
+from services.result_cache import normalize_sql
+from services.sql_guard import sql_guard, cte_names
+
+client = create_app().test_client()
+
+def execute_sql(sql):
+    response = client.post('/api/queries/execute-sql', json={'sql': sql, 'fresh': True})
+    return response.status_code, response.get_json()
+
+print("Testing comments that hide part of a statement:")
+print("=" * 50)
+
+hidden = 'SELECT 1 AS x -- c\n, name, sql FROM sqlite_master'
+assert execute_sql('SELECT 1 AS x')[0] == 200
+status, body = execute_sql(hidden)
+print(f"{hidden!r}: {status} {body.get('error')}")
+assert status == 400 and 'sqlite_master' in body['error']
+assert normalize_sql(hidden) != normalize_sql('SELECT 1 AS x')
+assert normalize_sql('SELECT 1 -- a\n, 2') != normalize_sql('SELECT 1 -- b\n, 3')
+assert normalize_sql("SELECT '--not a comment' /* c */ FROM t") == "SELECT '--not a comment' FROM t"
+
+for sql in ['SELECT 1 /* c */, name FROM sqlite_master', 'SELECT vendor FROM purchase_orders;\n-- c\nDELETE FROM leaderboard']:
+    status, body = execute_sql(sql)
+    print(f"{sql!r}: {status} {body.get('error')}")
+    assert status == 400
+
+print("\n" + "=" * 50)
+print("Testing enforcement on the executing connection:")
+
+authorize = sql_guard.authorizer('SELECT vendor FROM purchase_orders')
+with sqlite3.connect(db_setup.DATABASE_PATH) as conn:
+    conn.set_authorizer(authorize)
+    assert conn.execute('SELECT COUNT(*) FROM purchase_orders').fetchone()[0] > 0
+    for sql in ['SELECT name FROM sqlite_master', 'SELECT * FROM vendor_aliases', 'DELETE FROM leaderboard']:
+        try:
+            conn.execute(sql)
+            raise AssertionError(f'{sql} was not denied')
+        except sqlite3.DatabaseError as e:
+            print(f"{sql!r}: {e}")
+
+print("\n" + "=" * 50)
+print("Testing CTEs:")
+
+recursive = 'WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 5) SELECT x FROM n'
+status, body = execute_sql(recursive)
+print(f"Recursive CTE: {status} {[row['x'] for row in body['results']]}")
+assert status == 200 and [row['x'] for row in body['results']] == [1, 2, 3, 4, 5]
+
+status, body = execute_sql('WITH v AS (SELECT vendor FROM purchase_orders), "Top" AS (SELECT * FROM v LIMIT 1) '
+                           'SELECT * FROM "Top"')
+assert status == 200 and len(body['results']) == 1
+assert cte_names('WITH RECURSIVE n(x) AS (SELECT 1), "My ""q""" AS MATERIALIZED (SELECT 2) SELECT 3') == {'n', 'my "q"'}
+
+# Some SQLite versions report CTE reads to the authorizer like table reads
+authorize = sql_guard._make_authorizer(cte_names(recursive))
+assert authorize(sqlite3.SQLITE_READ, 'n', 'x', None, None) == sqlite3.SQLITE_OK
+assert authorize(sqlite3.SQLITE_READ, 'vendor_aliases', 'alias', 'main', None) == sqlite3.SQLITE_DENY
+
+# A CTE named after a hidden table must not unlock the real one
+for sql in ['WITH vendor_aliases AS (SELECT 1 AS x) SELECT * FROM main.vendor_aliases',
+            'WITH sqlite_master AS (SELECT 1 AS x) SELECT name FROM main.sqlite_master']:
+    status, body = execute_sql(sql)
+    print(f"{sql!r}: {status} {body.get('error')}")
+    assert status == 400
+
+print(f"\nGuard stats: {sql_guard.get_stats()}")
+print("\nSQL guard test completed!")
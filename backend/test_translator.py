@@ -0,0 +1,83 @@
+import sys
+sys.path.append('.')
+
+# Exercise the GPT-4 translator against a local stub of the OpenAI API:
+# identical concurrent questions must share one upstream call, and load beyond
+# the concurrency limit must be shed instead of queueing.
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from services.sql_translator import GPT4Translator
+
+STUB_DELAY_SECONDS = 0.5
+upstream_calls = []
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        upstream_calls.append(body['messages'][-1]['content'])
+        time.sleep(STUB_DELAY_SECONDS)
+
+        payload = json.dumps({
+            'id': 'chatcmpl-stub',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body['model'],
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': '```sql\nSELECT vendor FROM purchase_orders\n```'},
+                'finish_reason': 'stop'
+            }],
+            'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2}
+        }).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+server = ThreadingHTTPServer(('127.0.0.1', 0), StubOpenAIHandler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def run_concurrently(translator, questions):
+    results = [None] * len(questions)
+
+    def worker(i, question):
+        results[i] = translator.translate(question, 'Table: purchase_orders')
+
+    threads = [threading.Thread(target=worker, args=(i, q)) for i, q in enumerate(questions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+print("Testing single-flight coalescing:")
+print("=" * 50)
+
+translator = GPT4Translator('stub-key', timeout=5, max_concurrency=2, queue_timeout=0.1, base_url=base_url)
+results = run_concurrently(translator, ['Show me spend per vendor!'] * 10 + ['show me SPEND per vendor'] * 5)
+print(f"Upstream calls: {len(upstream_calls)} for 15 identical questions")
+print(f"Statuses: {sorted(set(status for _, status in results))}")
+assert len(upstream_calls) == 1
+assert all(sql == 'SELECT vendor FROM purchase_orders' for sql, _ in results)
+
+print("\n" + "=" * 50)
+print("Testing concurrency cap and load shedding:")
+
+upstream_calls.clear()
+results = run_concurrently(translator, [f'question number {i}' for i in range(6)])
+statuses = [status for _, status in results]
+print(f"Upstream calls: {len(upstream_calls)}, shed: {statuses.count('shed')}")
+assert len(upstream_calls) == 2
+assert statuses.count('shed') == 4
+print(f"Translator stats: {translator.get_stats()}")
+
+server.shutdown()
+print("\nTranslator test completed!")
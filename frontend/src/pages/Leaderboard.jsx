@@ -30,10 +30,27 @@ const Leaderboard = () => {
     const dataInterval = setInterval(() => {
       fetchLeaderboardData();
     }, 60000); // Update every minute
-    
+
+    // Refresh as soon as the server pushes a change (polling above is the fallback)
+    let refreshTimeout = null;
+    const scheduleRefresh = () => {
+      clearTimeout(refreshTimeout);
+      refreshTimeout = setTimeout(() => {
+        fetchLeaderboardData();
+        fetchRealtimeActivity();
+      }, 1000); // Coalesce bursts of events into one refresh
+    };
+
+    const eventSource = new EventSource(`${API.LEADERBOARD}/stream`);
+    ['score_update', 'validation', 'query', 'team_created', 'team_deleted', 'resync'].forEach(eventType => {
+      eventSource.addEventListener(eventType, scheduleRefresh);
+    });
+
     return () => {
       clearInterval(activityInterval);
       clearInterval(dataInterval);
+      clearTimeout(refreshTimeout);
+      eventSource.close();
     };
   }, []);
 
@@ -57,11 +57,18 @@ const QueryAssistant = () => {
         },
         body: JSON.stringify({
           query: query.trim(),
-          team_id: teamId || undefined
+          team_id: teamId || undefined,
+          format: 'columnar'
         })
       });
 
       const data = await response.json();
+      if (data.rows) {
+        // Columnar responses send column names once; expand to row objects
+        data.results = data.rows.map(row =>
+          Object.fromEntries(data.columns.map((column, i) => [column, row[i]]))
+        );
+      }
       setResults(data);
       
       if (data.success) {
@@ -141,7 +148,7 @@ const QueryAssistant = () => {
                 Found {results.result_count} results in {results.execution_time?.toFixed(3)}s
               </p>
               <p className="text-xs text-blue-500 mt-1">
-                Method: {results.method === 'gpt4' ? 'GPT-4 Translation' : 'Pattern Matching'}
+                Method: {results.method === 'gpt4' ? 'GPT-4 Translation' : results.method === 'cache' ? 'Cached Translation' : results.method === 'intent_router' ? 'Local Intent Router' : 'Pattern Matching'}
               </p>
             </div>
             <button